@@ -0,0 +1,70 @@
+"""
+Benchmark the decimal-year conversion against the pandas accessor implementation.
+
+Usage
+-----
+  python benchmarks/benchmark_decimal_year.py --n-dates 5000000
+"""
+
+import argparse
+from timeit import repeat
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from risteys_pipeline.utils.utils import DAYS_IN_YEAR, to_decimal_year
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--n-dates",
+        help="number of dates to convert (default: 1000000)",
+        default=1_000_000,
+        type=int
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        help="number of timed runs, the best one is reported (default: 3)",
+        default=3,
+        type=int
+    )
+    args = parser.parse_args()
+    return args
+
+
+def to_decimal_year_accessors(date_col):
+    """Previous implementation, with the pandas datetime accessors"""
+    date_col = pd.to_datetime(date_col, infer_datetime_format=True)
+    decimal_year = date_col.dt.year + (date_col.dt.dayofyear - 1) / DAYS_IN_YEAR
+    return decimal_year
+
+
+def main():
+    args = cli_parser()
+
+    rng = np.random.default_rng(0)
+    dates = pd.Series(pd.Timestamp("1900-01-01") + pd.to_timedelta(rng.integers(0, 45_000, args.n_dates), unit="D"))
+    dates[rng.random(args.n_dates) < 0.1] = pd.NaT
+    strings = dates.dt.strftime("%Y-%m-%d")
+    arrow_strings = pa.array(strings)
+    arrow_dates = pa.array(dates.dt.date, type=pa.date32())
+
+    expected = to_decimal_year_accessors(strings).to_numpy()
+    cases = [
+        ("accessors, strings", lambda: to_decimal_year_accessors(strings)),
+        ("accessors, datetimes", lambda: to_decimal_year_accessors(dates)),
+        ("kernel, strings", lambda: to_decimal_year(strings)),
+        ("kernel, strings with format", lambda: to_decimal_year(strings, date_format="%Y-%m-%d")),
+        ("kernel, datetimes", lambda: to_decimal_year(dates)),
+        ("kernel, Arrow strings", lambda: to_decimal_year(arrow_strings)),
+        ("kernel, Arrow date32", lambda: to_decimal_year(arrow_dates)),
+    ]
+    for name, func in cases:
+        assert np.array_equal(np.asarray(func()), expected, equal_nan=True), name
+        best = min(repeat(func, number=1, repeat=args.repeat))
+        print(f"{name:<30} {best:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
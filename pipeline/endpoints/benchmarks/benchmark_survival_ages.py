@@ -0,0 +1,107 @@
+"""
+Benchmark the vectorized study ages and lag durations of the survival
+analyses against the previous row-wise DataFrame.apply implementation.
+
+Usage
+-----
+  python benchmarks/benchmark_survival_ages.py --n-persons 500000
+"""
+
+import argparse
+from timeit import repeat
+
+import numpy as np
+import pandas as pd
+from risteys_pipeline.finngen.surv_analysis import STUDY_ENDS, STUDY_STARTS
+
+
+MAX_LAG = 5
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--n-persons",
+        help="number of persons in the synthetic cohort (default: 500000)",
+        default=500_000,
+        type=int
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        help="number of timed runs, the best one is reported (default: 3)",
+        default=3,
+        type=int
+    )
+    args = parser.parse_args()
+    return args
+
+
+def start_age_apply(df):
+    """Previous implementation, one Python call per row"""
+    return df.apply(
+        lambda r: max(STUDY_STARTS - r.BIRTH_TYEAR, 0.0),
+        axis="columns"
+    )
+
+
+def start_age_vectorized(df):
+    return (STUDY_STARTS - df.BIRTH_TYEAR).clip(lower=0.0)
+
+
+def end_age_apply(df):
+    """Previous implementation, one Python call per row"""
+    return df.apply(
+        lambda r: r.DEATH_AGE if (r.BIRTH_TYEAR + r.DEATH_AGE) < STUDY_ENDS else (STUDY_ENDS - r.BIRTH_TYEAR),
+        axis="columns"
+    )
+
+
+def end_age_vectorized(df):
+    return df.DEATH_AGE.where(
+        (df.BIRTH_TYEAR + df.DEATH_AGE) < STUDY_ENDS,
+        STUDY_ENDS - df.BIRTH_TYEAR
+    )
+
+
+def lag_duration_apply(df):
+    """Previous implementation, one Python call per row"""
+    return df.apply(
+        lambda r: min(r.END_AGE - r.PRIOR_AGE, MAX_LAG),
+        axis="columns"
+    )
+
+
+def lag_duration_vectorized(df):
+    return (df.END_AGE - df.PRIOR_AGE).clip(upper=MAX_LAG)
+
+
+def main():
+    args = cli_parser()
+
+    rng = np.random.default_rng(0)
+    birth_year = rng.uniform(1910, 2015, args.n_persons)
+    death_age = np.where(
+        rng.random(args.n_persons) < 0.2,
+        rng.uniform(0, STUDY_ENDS + 5 - birth_year),
+        np.nan
+    )
+    df = pd.DataFrame({"BIRTH_TYEAR": birth_year, "DEATH_AGE": death_age})
+    df["START_AGE"] = start_age_vectorized(df)
+    df["END_AGE"] = end_age_vectorized(df)
+    df["PRIOR_AGE"] = df.START_AGE + rng.uniform(0, 1, args.n_persons) * (df.END_AGE - df.START_AGE)
+
+    cases = [
+        ("START_AGE", start_age_apply, start_age_vectorized),
+        ("END_AGE", end_age_apply, end_age_vectorized),
+        ("lag duration", lag_duration_apply, lag_duration_vectorized),
+    ]
+    for name, func_apply, func_vectorized in cases:
+        expected = func_apply(df).to_numpy()
+        assert np.array_equal(func_vectorized(df).to_numpy(), expected, equal_nan=True), name
+        for impl, func in [("apply", func_apply), ("vectorized", func_vectorized)]:
+            best = min(repeat(lambda: func(df), number=1, repeat=args.repeat))
+            print(f"{name + ', ' + impl:<30} {best:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,9 @@ FINREGISTRY_ENDPOINT_DEFINITIONS_DATA_PATH = ROOT_DIR / "endpoint_metadata" / "e
 # Output directory
 FINREGISTRY_OUTPUT_DIR = Path("/data") / "projects" / "risteys"
 
+# Memory-mapped snapshots of the preprocessed input data, see risteys_pipeline.utils.snapshot
+FINREGISTRY_SNAPSHOT_DIR = FINREGISTRY_OUTPUT_DIR / "snapshots"
+
 
 # --- FinnGen
 # Input data
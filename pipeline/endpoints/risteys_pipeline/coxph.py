@@ -0,0 +1,588 @@
+"""
+Weighted Cox proportional hazards models fitted in batches.
+
+NumPy implementation of the model fitted by lifelines' CoxPHFitter with
+weights, robust (sandwich) variance, and entry times for left-truncated
+data. Ties are handled with Efron's method.
+
+The data is sorted and the risk sets are indexed once by
+prepare_risk_sets(). Many designs can then be fitted together against
+these risk sets, as long as they share the times, events, and weights and
+only differ in the exposure column. The risk set sums at the event times
+are computed with cumulative sums instead of a Python loop over the
+event times.
+
+The fit follows the lifelines conventions:
+- Newton-Raphson on the covariates normalized with their (unweighted)
+  mean and standard deviation, starting from 0, with the same step size
+  rule and stopping criteria. A fit can also be warm-started from given
+  coefficients, e.g. the coefficients of a similar model or the last
+  iterate of a failed fit.
+- the baseline cumulative hazard is Breslow's estimate for the mean
+  covariates, at each distinct exit time
+- the robust variance is computed from the score residuals.
+
+As in lifelines, the entry times are only taken into account in the
+partial likelihood: the baseline cumulative hazard and the score
+residuals of the robust variance use the risk sets of the exit times
+only.
+"""
+
+import warnings
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from numpy.linalg import LinAlgError
+from scipy.stats import chi2, norm
+
+# Newton-Raphson parameters, as in lifelines
+STEP_SIZE = 0.95
+PRECISION = 1e-07
+R_PRECISION = 1e-09
+MAX_STEPS = 500
+MIN_STEP_SIZE = 0.00001
+# Stopping criterion norm(delta) above which a converged fit is still suspicious
+MAX_FINAL_NORM_DELTA = 0.1
+
+# Times, events, and weights sorted by exit time, with the indices of the risk sets
+CoxRiskSets = namedtuple("CoxRiskSets", [
+    "order",           # permutation sorting the rows by exit time
+    "weights",         # weight of each sorted row
+    "event",           # event indicator of each sorted row
+    "times",           # distinct exit times
+    "event_times",     # distinct exit times with an event
+    "event_time_idx",  # index of each event time in `times`
+    "risk_from",       # first sorted row with exit time >= each event time
+    "entry_order",     # permutation sorting the sorted rows by entry time, None without entry times
+    "late_from",       # first entry-sorted row with entry time >= each event time
+    "death_rows",      # sorted rows with an event, grouped by event time
+    "death_starts",    # start of the group of each event time in `death_rows`
+    "death_counts",    # number of events at each event time
+    "death_weights",   # sum of the weights of the events at each event time
+    "death_time",      # index of the event time of each event in `death_rows`
+    "tie_proportion",  # Efron's proportion of the tied events removed from the risk set, for each event
+    "deaths_upto",     # number of events in the sorted rows up to each row included
+])
+
+# Fitted model. Parameters are on the original scale of the covariates.
+CoxPHEstimate = namedtuple("CoxPHEstimate", [
+    "covariates",                  # covariate names
+    "params",                      # coefficient of each covariate
+    "standard_errors",             # standard error of each coefficient
+    "norm_mean",                   # mean of each covariate, used to center the baseline
+    "times",                       # distinct exit times
+    "baseline_cumulative_hazard",  # baseline cumulative hazard at these times
+    "log_likelihood",              # partial log-likelihood at the estimate
+    "n_iterations",                # number of Newton-Raphson iterations
+    "converged",                   # False if lifelines would have issued a ConvergenceWarning
+])
+
+
+class ConvergenceError(ValueError):
+    def __init__(self, message, params=None):
+        super().__init__(message)
+        # Last iterate of the failed fit, to resume from, None if it failed from the start
+        self.params = params
+
+
+class ConvergenceWarning(RuntimeWarning):
+    pass
+
+
+def prepare_risk_sets(stop, event, weights=None, start=None):
+    """
+    Sort the data by exit time and index the risk set of each event time.
+
+    A row is at risk at time t if start < t <= stop.
+
+    Args:
+        stop (array): exit time of each row
+        event (array): True (or non-zero) if the row ends with an event
+        weights (array, optional): weight of each row, 1 if not given
+        start (array, optional): entry time of each row, for left-truncated data
+
+    Returns:
+        risk_sets (CoxRiskSets): sorted data and risk set indices, to use with fit_coxph_batch()
+    """
+    stop = np.asarray(stop, dtype=np.float64)
+    event = np.asarray(event).astype(bool)
+    n_rows = stop.shape[0]
+    weights = np.ones(n_rows) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    # Sort as lifelines does: by exit time, then censored rows before the events
+    order = np.lexsort((event, stop))
+    stop = stop[order]
+    event = event[order]
+    weights = weights[order]
+
+    times = np.unique(stop)
+    death_rows = np.flatnonzero(event)
+    event_times, death_starts, death_counts = np.unique(stop[death_rows], return_index=True, return_counts=True)
+    death_weights = np.add.reduceat(weights[death_rows], death_starts) if death_rows.shape[0] > 0 else np.zeros(0)
+    tie_proportion = (
+        (np.arange(death_rows.shape[0]) - np.repeat(death_starts, death_counts))
+        / np.repeat(death_counts, death_counts)
+    )
+
+    risk_from = np.searchsorted(stop, event_times, side="left")
+    if start is None:
+        entry_order = None
+        late_from = None
+    else:
+        start = np.asarray(start, dtype=np.float64)[order]
+        entry_order = np.argsort(start, kind="stable")
+        late_from = np.searchsorted(start[entry_order], event_times, side="left")
+
+    return CoxRiskSets(
+        order=order,
+        weights=weights,
+        event=event,
+        times=times,
+        event_times=event_times,
+        event_time_idx=np.searchsorted(times, event_times),
+        risk_from=risk_from,
+        entry_order=entry_order,
+        late_from=late_from,
+        death_rows=death_rows,
+        death_starts=death_starts,
+        death_counts=death_counts,
+        death_weights=death_weights,
+        death_time=np.repeat(np.arange(event_times.shape[0]), death_counts),
+        tie_proportion=tie_proportion,
+        deaths_upto=np.cumsum(event),
+    )
+
+
+def fit_coxph(stop, event, design, weights=None, start=None, covariates=None, step_size=STEP_SIZE, init=None, robust=True):
+    """
+    Fit a Cox PH model.
+
+    Args:
+        stop (array): exit time of each row
+        event (array): True (or non-zero) if the row ends with an event
+        design (array): covariates, one column per covariate
+        weights (array, optional): weight of each row, 1 if not given
+        start (array, optional): entry time of each row, for left-truncated data
+        covariates (list of str, optional): covariate names, column indices if not given
+        step_size (float, default 0.95): initial step size of the Newton-Raphson algorithm
+        init (array, optional): coefficients to start the Newton-Raphson algorithm from, 0 if not given
+        robust (bool, default True): use the robust (sandwich) variance
+
+    Returns:
+        estimate (CoxPHEstimate): fitted model
+
+    Raises:
+        ConvergenceError: the Hessian is singular or the fit diverges.
+        Its `params` is the last iterate, to resume the fit from.
+        A ConvergenceWarning is issued if the fit doesn't converge.
+    """
+    design = np.asarray(design, dtype=np.float64)
+    risk_sets = prepare_risk_sets(stop, event, weights, start)
+    [estimate], last_params = fit_coxph_batch(
+        risk_sets,
+        design[:, :1],
+        design[:, 1:],
+        covariates=covariates,
+        step_size=step_size,
+        init=init,
+        robust=robust
+    )
+
+    if estimate is None:
+        raise ConvergenceError(
+            "Convergence halted due to matrix inversion problems or nan values. Suspicion is high collinearity.",
+            params=None if np.isnan(last_params[0]).any() else last_params[0]
+        )
+    if not estimate.converged:
+        warnings.warn("Newton-Raphson failed to converge sufficiently.", ConvergenceWarning)
+
+    return estimate
+
+
+def fit_coxph_batch(risk_sets, exposures, shared_covariates=None, covariates=None, step_size=STEP_SIZE, init=None, robust=True):
+    """
+    Fit Cox PH models for many exposures with the same covariates, times, events, and weights.
+
+    The design of model d is the exposure column d followed by the shared
+    covariate columns. All models are fitted together, each with its own
+    Newton-Raphson step size.
+
+    Args:
+        risk_sets (CoxRiskSets): output of prepare_risk_sets()
+        exposures (array): one column per model, rows in the order given to prepare_risk_sets()
+        shared_covariates (array, optional): covariates shared by all models, one column per covariate
+        covariates (list of str, optional): names of the exposure and shared covariates
+        step_size (float, default 0.95): initial step size of the Newton-Raphson algorithm
+        init (array, optional): coefficients to start the Newton-Raphson algorithm from,
+        for all models or one row per model, 0 if not given
+        robust (bool, default True): use the robust (sandwich) variance
+
+    Returns:
+        (estimates, last_params) (tuple): a CoxPHEstimate for each model, or None if its
+        Hessian is singular or its fit diverges, as a ConvergenceError would be raised by
+        lifelines, and the last iterate of each model (NaN if it failed from the start)
+    """
+    rs = risk_sets
+    exposures = np.asarray(exposures, dtype=np.float64)[rs.order]
+    n_rows, n_models = exposures.shape
+    if shared_covariates is None:
+        shared_covariates = np.zeros((n_rows, 0))
+    shared_covariates = np.asarray(shared_covariates, dtype=np.float64).reshape(n_rows, -1)[rs.order]
+    n_params = 1 + shared_covariates.shape[1]
+    if covariates is None:
+        covariates = list(range(n_params))
+
+    # Design of each model, normalized as in lifelines
+    X = np.empty((n_models, n_rows, n_params))
+    X[:, :, 0] = exposures.T
+    X[:, :, 1:] = shared_covariates
+    norm_mean = X.mean(axis=1)
+    norm_std = X.std(axis=1, ddof=1)
+    failed = np.any(norm_std == 0, axis=1)  # can't normalize a constant covariate
+    X = (X - norm_mean[:, None, :]) / np.where(norm_std == 0, 1.0, norm_std)[:, None, :]
+
+    # Start values, on the normalized scale
+    beta = np.zeros((n_models, n_params))
+    if init is not None:
+        beta[:] = np.asarray(init, dtype=np.float64) * norm_std
+
+    beta, last_beta, hessian, log_likelihood, n_iterations, converged, diverged = newton_raphson(
+        rs, X, beta, ~ failed, step_size
+    )
+    failed |= diverged
+    last_params = last_beta / norm_std
+
+    estimates = []
+    for dd in range(n_models):
+        if failed[dd]:
+            estimates.append(None)
+            continue
+
+        try:
+            variance = -np.linalg.inv(hessian[dd]) / np.outer(norm_std[dd], norm_std[dd])
+        except LinAlgError:
+            estimates.append(None)
+            continue
+
+        # Risk sets of the exit times only, as lifelines
+        risk, _ = risk_set_sums(rs._replace(entry_order=None), X[dd:dd + 1], beta[dd:dd + 1])
+        if robust:
+            scaled_variance = variance * norm_std[dd][:, None]
+            delta_betas = score_residuals(rs, X[dd], beta[dd]) @ scaled_variance
+            standard_errors = np.sqrt(np.diagonal(delta_betas.T @ delta_betas))
+        else:
+            standard_errors = np.sqrt(np.diagonal(variance))
+
+        # Breslow's baseline hazard, 0 at the times without events
+        baseline_hazard = np.zeros(rs.times.shape[0])
+        baseline_hazard[rs.event_time_idx] = rs.death_weights / risk[0][0]
+
+        estimates.append(CoxPHEstimate(
+            covariates=list(covariates),
+            params=beta[dd] / norm_std[dd],
+            standard_errors=standard_errors,
+            norm_mean=norm_mean[dd],
+            times=rs.times,
+            baseline_cumulative_hazard=np.cumsum(baseline_hazard),
+            log_likelihood=log_likelihood[dd],
+            n_iterations=n_iterations[dd],
+            converged=converged[dd],
+        ))
+
+    return estimates, last_params
+
+
+def newton_raphson(rs, X, beta, active, step_size):
+    """
+    Maximize the partial likelihood of each model with lifelines' Newton-Raphson algorithm.
+
+    Returns:
+        (beta, last_beta, hessian, log_likelihood, n_iterations, converged, diverged) (tuple):
+        normalized coefficients, last coefficients at which a Newton step could be computed
+        (NaN if none), Hessian and log-likelihood at the coefficients, and the state of each
+        model's fit
+    """
+    n_models, _, n_params = X.shape
+    active = active.copy()
+    beta = beta.copy()
+    last_beta = np.full((n_models, n_params), np.nan)
+    delta = np.zeros((n_models, n_params))
+    hessian = np.zeros((n_models, n_params, n_params))
+    log_likelihood = np.zeros(n_models)
+    previous_ll = np.zeros(n_models)
+    norm_delta = np.zeros(n_models)
+    n_iterations = np.zeros(n_models, dtype=np.int64)
+    converged = np.zeros(n_models, dtype=bool)
+    diverged = np.zeros(n_models, dtype=bool)
+    step_sizer = init_step_sizer(n_models, step_size)
+
+    for ii in range(1, MAX_STEPS + 1):
+        idx = np.flatnonzero(active)
+        if idx.shape[0] == 0:
+            break
+
+        beta[idx] += step_sizer["step_size"][idx, None] * delta[idx]
+        h, g, ll = efron_terms(rs, X[idx], beta[idx])
+
+        step, singular = solve_pos(-h, g)
+        singular |= np.any(np.isnan(step), axis=1)
+        diverged[idx[singular]] = True
+        active[idx[singular]] = False
+        idx, h, g, ll, step = idx[~ singular], h[~ singular], g[~ singular], ll[~ singular], step[~ singular]
+
+        delta[idx] = step
+        last_beta[idx] = beta[idx]
+        hessian[idx] = h
+        log_likelihood[idx] = ll
+        n_iterations[idx] = ii
+        norm_delta[idx] = np.linalg.norm(step, axis=1)
+        newton_decrement = np.sum(g * step, axis=1) / 2
+
+        prev = previous_ll[idx]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            small_ll_change = (prev != 0) & (np.abs(ll - prev) / (-prev) < R_PRECISION)
+        success = (norm_delta[idx] < PRECISION) | small_ll_change | (newton_decrement < PRECISION)
+        failure = ~ success & (
+            (ii >= MAX_STEPS)
+            | (step_sizer["step_size"][idx] <= MIN_STEP_SIZE)
+            | ((np.abs(ll) < 0.0001) & (norm_delta[idx] > 1.0))  # complete separation
+        )
+        converged[idx[success]] = True
+        active[idx[success | failure]] = False
+
+        previous_ll[idx] = ll
+        update_step_sizer(step_sizer, idx, norm_delta[idx])
+
+    converged &= norm_delta <= MAX_FINAL_NORM_DELTA
+
+    return beta, last_beta, hessian, log_likelihood, n_iterations, converged, diverged
+
+
+def init_step_sizer(n_models, step_size):
+    """State of lifelines' StepSizer for each model"""
+    return {
+        "initial": step_size,
+        "step_size": np.full(n_models, step_size, dtype=np.float64),
+        "temper_back_up": np.zeros(n_models, dtype=bool),
+        # Last 3 norms of the Newton-Raphson steps
+        "norms": np.full((n_models, 3), np.nan),
+    }
+
+
+def update_step_sizer(step_sizer, idx, norm_delta):
+    """Update the step size of the models `idx` as lifelines' StepSizer.update() does"""
+    scale = 1.3
+    step = step_sizer["step_size"][idx]
+    temper = step_sizer["temper_back_up"][idx]
+    norms = np.column_stack([step_sizer["norms"][idx, 1:], norm_delta])
+
+    # Speed up convergence by increasing step size again
+    step = np.where(temper, np.minimum(step * scale, step_sizer["initial"]), step)
+
+    # Only allow small steps
+    step = np.where(norm_delta >= 15.0, step * 0.1, step)
+    step = np.where((norm_delta < 15.0) & (norm_delta > 5.0), step * 0.25, step)
+    temper |= norm_delta > 5.0
+
+    # Recent non-monotonically decreasing is a concern, recent monotonically decreasing is good though
+    has_lookback = ~ np.isnan(norms[:, 0])
+    decreasing = np.all(np.diff(norms, axis=1) < 0, axis=1)
+    step = np.where(has_lookback & ~ decreasing, step * 0.98, step)
+    step = np.where(has_lookback & decreasing, np.minimum(step * scale, 1.0), step)
+
+    step_sizer["step_size"][idx] = step
+    step_sizer["temper_back_up"][idx] = temper
+    step_sizer["norms"][idx] = norms
+
+
+def risk_set_sums(rs, X, beta, second_order=False):
+    """
+    Sums over the risk set and over the tied events of each event time.
+
+    Args:
+        rs (CoxRiskSets): risk sets
+        X (array): normalized designs, of shape (models, rows, covariates)
+        beta (array): normalized coefficients, of shape (models, covariates)
+        second_order (bool): also compute the sums of the outer products of the covariates
+
+    Returns:
+        (risk, ties) (tuple): each a list [sum of w.exp(x.beta), sum of w.exp(x.beta).x, ...]
+        with one value per model and event time
+    """
+    scores = rs.weights * np.exp(np.einsum("mni,mi->mn", X, beta))
+    terms = [scores, scores[:, :, None] * X]
+    if second_order:
+        terms.append(terms[1][:, :, :, None] * X[:, :, None, :])
+
+    risk = []
+    ties = []
+    for term in terms:
+        risk_sum = suffix_sums(term, rs.risk_from)
+        if rs.entry_order is not None:
+            # Not yet at risk: entry time >= event time
+            risk_sum -= suffix_sums(term[:, rs.entry_order], rs.late_from)
+        risk.append(risk_sum)
+        ties.append(np.add.reduceat(term[:, rs.death_rows], rs.death_starts, axis=1))
+
+    return risk, ties
+
+
+def suffix_sums(a, from_rows):
+    """Sum of the rows from each index of `from_rows` to the end, along the rows axis 1"""
+    sums = np.zeros_like(a[:, :1])
+    sums = np.concatenate([np.cumsum(a[:, ::-1], axis=1)[:, ::-1], sums], axis=1)
+    return sums[:, from_rows]
+
+
+def efron_terms(rs, X, beta):
+    """
+    Hessian, gradient, and log of the partial likelihood with Efron's method for ties.
+
+    Returns:
+        (hessian, gradient, log_likelihood) (tuple): one value per model
+    """
+    (risk_phi, risk_phi_x, risk_phi_x_x), (tie_phi, tie_phi_x, tie_phi_x_x) = risk_set_sums(rs, X, beta, second_order=True)
+
+    # Efron's terms for each event: 1 / (risk - k/d . ties) for the k-th of d tied events
+    proportion = rs.tie_proportion
+    denom = 1.0 / (risk_phi[:, rs.death_time] - proportion * tie_phi[:, rs.death_time])
+
+    def sum_by_time(values):
+        return np.add.reduceat(values, rs.death_starts, axis=1)
+
+    s_denom = sum_by_time(denom)
+    s_p_denom = sum_by_time(proportion * denom)
+    s_denom2 = sum_by_time(denom ** 2)
+    s_p_denom2 = sum_by_time(proportion * denom ** 2)
+    s_p2_denom2 = sum_by_time(proportion ** 2 * denom ** 2)
+    s_log_denom = sum_by_time(np.log(denom))
+
+    weighted_average = rs.death_weights / rs.death_counts
+    x_death_sum = np.einsum("n,mni->mi", rs.weights[rs.death_rows], X[:, rs.death_rows])
+
+    summand_sum = risk_phi_x * s_denom[:, :, None] - tie_phi_x * s_p_denom[:, :, None]
+    gradient = x_death_sum - np.einsum("t,mti->mi", weighted_average, summand_sum)
+    log_likelihood = np.einsum("mi,mi->m", x_death_sum, beta) + s_log_denom @ weighted_average
+
+    # Sum of the outer products of the summands (a2) minus the second order risk terms (a1)
+    a1 = risk_phi_x_x * s_denom[:, :, None, None] - tie_phi_x_x * s_p_denom[:, :, None, None]
+    cross = np.einsum("mti,mtj->mtij", risk_phi_x, tie_phi_x)
+    a2 = (
+        np.einsum("mti,mtj->mtij", risk_phi_x, risk_phi_x) * s_denom2[:, :, None, None]
+        - (cross + np.swapaxes(cross, 2, 3)) * s_p_denom2[:, :, None, None]
+        + np.einsum("mti,mtj->mtij", tie_phi_x, tie_phi_x) * s_p2_denom2[:, :, None, None]
+    )
+    hessian = np.einsum("t,mtij->mij", weighted_average, a2 - a1)
+
+    return hessian, gradient, log_likelihood
+
+
+def score_residuals(rs, X, beta):
+    """
+    Weighted score residuals of each row.
+
+    As in lifelines, the tied rows are taken in sorted order: the risk set
+    of an event only includes the tied rows sorted after it, and the entry
+    times are not used.
+
+    Args:
+        rs (CoxRiskSets): risk sets
+        X (array): normalized design of one model, of shape (rows, covariates)
+        beta (array): normalized coefficients
+
+    Returns:
+        residuals (array): of shape (rows, covariates), in sorted order
+    """
+    deaths = rs.death_rows
+    phi = np.exp(X @ beta)
+    scores = rs.weights * phi
+
+    # Risk set of each event
+    risk_phi = suffix_sums(scores[None], deaths)[0]
+    risk_phi_x = suffix_sums((scores[:, None] * X)[None], deaths)[0]
+    x_bar = risk_phi_x / risk_phi[:, None]
+
+    # Cumulative sums over the events of the hazard increments, and of the weighted means of the risk sets
+    hazard = rs.weights[deaths] / risk_phi
+    cum_hazard = np.concatenate([[0.0], np.cumsum(hazard)])
+    cum_hazard_x = np.concatenate([np.zeros((1, X.shape[1])), np.cumsum(hazard[:, None] * x_bar, axis=0)])
+
+    # Events at which each row is at risk
+    row_hazard = cum_hazard[rs.deaths_upto]
+    row_hazard_x = cum_hazard_x[rs.deaths_upto]
+    residuals = -phi[:, None] * (X * row_hazard[:, None] - row_hazard_x)
+    residuals[deaths] += X[deaths] - x_bar
+
+    return residuals * rs.weights[:, None]
+
+
+def solve_pos(a, b):
+    """Solve a stack of positive definite linear systems, flagging the failing ones instead of raising"""
+    n_models = a.shape[0]
+    x = np.full_like(b, np.nan)
+    failed = np.zeros(n_models, dtype=bool)
+    for ii in range(n_models):
+        try:
+            np.linalg.cholesky(a[ii])
+            x[ii] = np.linalg.solve(a[ii], b[ii])
+        except LinAlgError:
+            failed[ii] = True
+
+    return x, failed
+
+
+def coxph_summary(estimate, alpha=0.05):
+    """
+    Summary table of a fitted model, with the same columns as lifelines' CoxPHFitter.summary.
+
+    Args:
+        estimate (CoxPHEstimate): fitted model
+        alpha (float, default 0.05): level of the confidence intervals
+
+    Returns:
+        summary (DataFrame): coefficients, confidence intervals, z and p values, indexed by covariate
+    """
+    ci = f"{100 * (1 - alpha):g}%"
+    z_alpha = norm.ppf(1 - alpha / 2)
+    coef = estimate.params
+    se = estimate.standard_errors
+    z = coef / se
+
+    summary = pd.DataFrame(
+        {
+            "coef": coef,
+            "exp(coef)": np.exp(coef),
+            "se(coef)": se,
+            f"coef lower {ci}": coef - z_alpha * se,
+            f"coef upper {ci}": coef + z_alpha * se,
+            f"exp(coef) lower {ci}": np.exp(coef - z_alpha * se),
+            f"exp(coef) upper {ci}": np.exp(coef + z_alpha * se),
+            "z": z,
+            "p": chi2.sf(z ** 2, 1),
+        },
+        index=pd.Index(estimate.covariates, name="covariate")
+    )
+
+    return summary
+
+
+def cumulative_hazard_at(estimate, times):
+    """Baseline cumulative hazard at the given times, linearly interpolated between the exit times"""
+    return np.interp(times, estimate.times, estimate.baseline_cumulative_hazard)
+
+
+def predict_survival(estimate, x, times):
+    """
+    Survival function of an individual.
+
+    Args:
+        estimate (CoxPHEstimate): fitted model
+        x (array): value of each covariate for the individual
+        times (array): times to predict the survival at
+
+    Returns:
+        survival (array): survival probability at each time
+    """
+    partial_hazard = np.exp((np.asarray(x, dtype=np.float64) - estimate.norm_mean) @ estimate.params)
+    return np.exp(-cumulative_hazard_at(estimate, times) * partial_hazard)
@@ -0,0 +1,124 @@
+"""
+Extract the drug purchase events from the detailed longitudinal file.
+
+medication_stats_logit.py only needs the drug purchase events (SOURCE
+== "PURCH") of the detailed longitudinal file. This one-off
+preprocessing step extracts them into a much smaller Parquet file, so
+that each medication job doesn't need to re-parse the full detailed
+longitudinal file.
+
+
+Usage
+-----
+  python extract_drug_purchases.py --help
+
+
+Input file
+----------
+- Detailed longitudinal
+  Detailed longitudinal file with one row per event, in CSV format.
+  Source: FinnGen data
+
+
+Output
+------
+- Drug purchases
+  Parquet format
+  . columns: FINNGENID, ATC (ATC code at level 5), CODE1 (full ATC code),
+    EVENT_AGE, EVENT_YEAR
+  . rows: one row per drug purchase event, sorted by FINNGENID, so
+    that readers filtering on FINNGENID can skip row groups
+"""
+
+import argparse
+from pathlib import Path
+
+import pyarrow
+import pyarrow.compute
+import pyarrow.csv
+import pyarrow.parquet as parquet
+
+
+SOURCE_PURCHASE = "PURCH"
+
+ATC_LEVEL = len('A10BA')  # Use broad level of ATC classification instead of full ATC codes
+
+ROW_GROUP_SIZE = 1_000_000
+
+OUT_SCHEMA = pyarrow.schema([
+    ("FINNGENID", pyarrow.string()),
+    ("ATC", pyarrow.string()),
+    ("CODE1", pyarrow.string()),
+    ("EVENT_AGE", pyarrow.float64()),
+    ("EVENT_YEAR", pyarrow.int16()),
+])
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i", "--input-detailed-longitudinal",
+        help="path to the detailed longitudinal file (CSV)",
+        required=True,
+        type=Path
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="path to output drug purchase file (Parquet)",
+        required=True,
+        type=Path
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = cli_parser()
+
+    convert_options = pyarrow.csv.ConvertOptions(
+        include_columns=["FINNGENID", "SOURCE", "EVENT_AGE", "APPROX_EVENT_DAY", "CODE1"],
+        column_types={
+            "FINNGENID": pyarrow.string(),
+            "SOURCE": pyarrow.string(),
+            "EVENT_AGE": pyarrow.float64(),
+            "APPROX_EVENT_DAY": pyarrow.date32(),
+            "CODE1": pyarrow.string(),
+        }
+    )
+    reader = pyarrow.csv.open_csv(args.input_detailed_longitudinal, convert_options=convert_options)
+
+    # Keep only the drug purchase events of each batch, so only the
+    # purchases, not the whole detailed longitudinal file, are held in
+    # memory. They are then sorted and written at once, taking about
+    # twice their size in memory.
+    batches = []
+    for batch in reader:
+        batches.append(extract_purchases(batch))
+
+    out_table = pyarrow.Table.from_batches(batches, schema=OUT_SCHEMA)
+
+    order = pyarrow.compute.sort_indices(out_table, sort_keys=[("FINNGENID", "ascending")])
+    out_table = out_table.take(order)
+
+    parquet.write_table(out_table, args.output, row_group_size=ROW_GROUP_SIZE)
+
+
+def extract_purchases(batch):
+    """Get the drug purchase events of a batch of detailed longitudinal events"""
+    batch = batch.filter(pyarrow.compute.equal(batch.column("SOURCE"), SOURCE_PURCHASE))
+
+    code1 = batch.column("CODE1")
+    return pyarrow.RecordBatch.from_arrays(
+        [
+            batch.column("FINNGENID"),
+            pyarrow.compute.utf8_slice_codeunits(code1, 0, ATC_LEVEL),
+            code1,
+            batch.column("EVENT_AGE"),
+            pyarrow.compute.year(batch.column("APPROX_EVENT_DAY")).cast(pyarrow.int16()),
+        ],
+        schema=OUT_SCHEMA
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,12 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 
+from risteys_pipeline.store import build_person_table, build_event_table_from_arrow, index_by_endpoint
 from risteys_pipeline.utils.log import logger
-from risteys_pipeline.utils.utils import log_if_diff
+from risteys_pipeline.utils.utils import log_if_diff, to_decimal_year
 
 
 def load_data(
@@ -18,21 +21,30 @@ def load_data(
     """Load input data from original files to pandas DataFrames.
 
     The resulting DataFrames are compliant with the format used for
-    the next pipeline steps.
+    the next pipeline steps: the minimal phenotype is a person table
+    indexed by `person_idx` and the first events point into it.
     """
     df_definitions = load_endpoint_definitions(definitions_path)
     df_fgid_covariates = load_fgid_covariates(covariates_path)
-    df_minimal_phenotype = load_minimal_phenotype_data(
-        minimal_phenotype_path,
+
+    # Single pass over the first-events data for both the death age and the first events
+    fevents = scan_first_events(
         long_format_first_events_path,
+        set(df_definitions.endpoint) | {"DEATH"},
+        df_fgid_covariates.FINNGENID
+    )
+    df_death_age = get_death_age(fevents)
+
+    df_minimal_phenotype = build_person_table(load_minimal_phenotype_data(
+        minimal_phenotype_path,
+        df_death_age,
         detailed_longitudinal_path,
         df_fgid_covariates
-    )
+    ))
     df_first_events = load_first_events_data(
-        long_format_first_events_path,
+        fevents,
         df_definitions,
-        df_minimal_phenotype,
-        df_fgid_covariates
+        df_minimal_phenotype
     )
 
     logger.info("Done loading data")
@@ -106,7 +118,7 @@ def load_fgid_covariates(covariates_path):
 
 def load_minimal_phenotype_data(
         minimal_phenotype_path,
-        long_format_fevents_path,
+        df_death_age,
         detailed_longit_path,
         df_fgid_covariates
 ):
@@ -116,7 +128,7 @@ def load_minimal_phenotype_data(
     the FinnGen minimal phenotype file. In particular the following
     information is taken elsewhere:
     - birth year: from the detailed longitudinal data
-    - death age: from the endpoint first-event data
+    - death age: from the endpoint first-event data, output of get_death_age()
     """
     logger.info("Loading minimal phenotype data")
 
@@ -138,7 +150,6 @@ def load_minimal_phenotype_data(
 
     # Get birth and death info
     df_birth_year = get_birth_year(df_minim)
-    df_death_age = get_death_age(long_format_fevents_path, df_fgid_covariates)
 
     # Combine minim & birth year info
     df_out = df_minim.merge(df_birth_year, on="FINNGENID", how="outer")
@@ -172,81 +183,74 @@ def load_minimal_phenotype_data(
 def get_birth_year(df_minimal_phenotype):
     df = df_minimal_phenotype.copy()
 
-    days_in_year = 365.25
-    df["birth_year"] = df.APPROX_BIRTH_DATE.dt.year + df.APPROX_BIRTH_DATE.dt.dayofyear / days_in_year
+    # The FinnGen birth year counts the first day of the year as day 1
+    df["birth_year"] = to_decimal_year(df.APPROX_BIRTH_DATE, day_offset=1)
     df = df.loc[:, ["FINNGENID", "birth_year"]]
 
     return df
 
 
-def get_death_age(long_format_fevents_path, df_fgid_covariates):
-    """Get the death age of individuals from the DEATH endpoint"""
-    logger.debug("Getting death age for all individuals using long-format first-events data")
-    df = pd.read_parquet(long_format_fevents_path)
+def scan_first_events(long_format_fevents_path, endpoints, finngenids):
+    """Read the long-format first-events data in a single pass.
 
-    df["death_age"] = np.nan
-    df.loc[df.ENDPOINT == "DEATH", "death_age"] = df.loc[df.ENDPOINT == "DEATH", "AGE"]
+    The path can be a single Parquet file or a partitioned Parquet
+    dataset directory. Only the FINNGENID, ENDPOINT and AGE columns are
+    read, and the endpoint and covariates filters are applied by the
+    dataset scanner, so only the matching partitions and row groups are
+    read and the filtered-out rows are never materialized.
 
-    # Only keep individuals that are in the covariates file
-    with log_if_diff("persons to get death age (fgid cov. filtering)", lambda: df.FINNGENID.unique().shape[0]):
-        df = df.loc[df.FINNGENID.isin(df_fgid_covariates.FINNGENID), :]
+    Returns an Arrow table with the columns `personid`, `endpoint`, `age`.
+    """
+    logger.info("Scanning first-events data")
+    dataset = ds.dataset(long_format_fevents_path, format="parquet", partitioning="hive")
+    scan_filter = (
+        ds.field("ENDPOINT").isin(list(endpoints))
+        & ds.field("FINNGENID").isin(list(finngenids))
+    )
+    table = dataset.to_table(columns=["FINNGENID", "ENDPOINT", "AGE"], filter=scan_filter)
+    table = table.rename_columns(["personid", "endpoint", "age"])
+    logger.debug(f"{table.num_rows:,} first events scanned")
+
+    return table
+
+
+def get_death_age(fevents):
+    """Get the death age of individuals from the DEATH endpoint"""
+    logger.debug("Getting death age for all individuals using long-format first-events data")
+    deaths = fevents.filter(pc.equal(fevents.column("endpoint"), "DEATH"))
 
     out = (
-        df
-        .groupby("FINNGENID")
-        .first("death_age")
-        .death_age
-        .reset_index()
+        pd.DataFrame({
+            "FINNGENID": deaths.column("personid").to_pandas(),
+            "death_age": deaths.column("age").to_pandas(),
+        })
+        .drop_duplicates(subset=["FINNGENID"])
+        .reset_index(drop=True)
     )
     return out
 
 
 def load_first_events_data(
-        long_format_fevents_path,
+        fevents,
         df_definitions,
-        df_minimal_phenotype,
-        df_fgid_covariates
+        df_minimal_phenotype
 ):
-    """Load and validate the long-format endpoint first-events file"""
+    """Load and validate the long-format endpoint first-events data.
+
+    `fevents` is the output of scan_first_events(), so it is already
+    restricted to the studied endpoints and the persons in the
+    covariates file.
+    """
     logger.info("Loading first-events data")
-    df_fevents = pd.read_parquet(long_format_fevents_path)
 
-    # Only keep individuals that are in the covariates file
-    with log_if_diff(
-            "persons in first-events (fgid cov. filtering)",
-            lambda: df_fevents.FINNGENID.unique().shape[0]
-    ):
-        df_fevents = df_fevents.loc[df_fevents.FINNGENID.isin(df_fgid_covariates.FINNGENID), :]
-
-    # Reshape dataframe to be compliant with the pipeline
-    df_fevents = df_fevents.drop(columns=[
-        "CONTROL_CASE_EXCL",
-        "NEVT",
-        "APPROX_EVENT_DAY"
-    ])
-    df_fevents = df_fevents.rename(columns={
-        "FINNGENID": "personid",
-        "ENDPOINT": "endpoint",
-        "AGE": "age",
-    })
-
-    # In FinnGen there is no concept of index person, so we mark all as being index persons
-    df_fevents["index_person"] = True
-
-    # Remove endpoints that we will not study
-    with log_if_diff("endpoints (subsetting)", lambda: df_fevents.endpoint.unique().shape[0]):
-        df_fevents = df_fevents.loc[df_fevents.endpoint.isin(df_definitions.endpoint), :]
-
-    # Add birth, death, and sex info
-    with log_if_diff("events (merging w/ min.pheno)", lambda: df_fevents.shape[0]), log_if_diff("persons (merging w/ min.pheno)", lambda: df_fevents.personid.unique().shape[0]):
-        df_fevents = df_fevents.merge(
-            df_minimal_phenotype.loc[:, ["personid", "birth_year", "death_year", "female"]],
-            on="personid",
-            how="left"
-        )
-
-    # Compute more accurate year of endpoint onset
-    df_fevents["year"] = df_fevents.birth_year + df_fevents.age
+    # Point to the birth, death, and sex info by person index instead of merging it.
+    # Events of endpoints not in the definitions, e.g. DEATH if it was only read
+    # for the death age, are dropped here.
+    df_fevents = build_event_table_from_arrow(fevents, df_minimal_phenotype, df_definitions.endpoint)
+
+    # Sort by endpoint so that the events of an endpoint are a contiguous slice
+    df_fevents = index_by_endpoint(df_fevents)
+    logger.debug(f"{df_fevents.shape[0]:,} first events loaded")
 
     return df_fevents
 
@@ -276,7 +280,7 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         "-f", "--input-long-format-first-events",
-        help="long-format version of the endpoint first-events file (Parquet)",
+        help="long-format version of the endpoint first-events file (Parquet file or partitioned dataset)",
         required=True,
         type=Path
     )
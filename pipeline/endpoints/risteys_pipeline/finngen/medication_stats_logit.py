@@ -5,8 +5,10 @@ Compute drug scores related to a given endpoint.
 Usage:
     python3 medication_stats_logit.py \
         <ENDPOINT> \                  # FinnGen endpoint for which to compute associated drug scores
-        <PATH_FIRST_EVENTS> \         # Path to the first events file from FinnGen
-        <PATH_DETAILED_LONGIT> \      # Path to the detailed longitudinal file from FinnGen
+        <PATH_FIRST_EVENTS> \         # Path to the first events file from FinnGen, or to the long-format
+                                      # first events (Parquet) from wide_to_long_endpoint_first_events.py
+        <PATH_DETAILED_LONGIT> \      # Path to the detailed longitudinal file from FinnGen, or to the
+                                      # drug purchase store (.parquet) from extract_drug_purchases.py
         <PATH_ENDPOINT_DEFINITIONS \  # Path to the endpoint definitions file from FinnGen
         <PATH_MINIMUM_INFO> \         # Path to the minimum file from FinnGen
         <OUTPUT_DIRECTORY>            # Path to where to put the output files
@@ -15,6 +17,14 @@ Outputs:
 - <ENDPOINT>_scores.csv: CSV file with score and standard error for each drug
 - <ENDPOINT>_counts.csv: CSV file which breakdowns drugs into their full ATC and counts how the
   number of individuals.
+
+Batch mode:
+    If FG_ENDPOINTS_LIST is set to a file listing one endpoint per line,
+    the input data is loaded once and the scores are computed for all
+    these endpoints, across N_WORKERS processes (default: 1).
+    The outputs are written in OUTPUT_DIRECTORY, either as the files
+    above for each endpoint, or as scores.csv and counts.csv for all
+    endpoints if CONSOLIDATE_OUTPUT=1.
 """
 
 import csv
@@ -23,10 +33,9 @@ from pathlib import Path
 
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as parquet
 from numpy.linalg import LinAlgError
-from numpy.linalg import multi_dot as mdot
 from scipy.stats import norm
-from statsmodels.formula.api import logit
 
 ### from log import logger
 # TODO #
@@ -70,6 +79,28 @@ PRED_FEMALE = 0.5
 PRED_YOB = 1960
 PRED_FG_ENDPOINT_YEAR = 2021
 
+# Logistic model fitting, same settings as statsmodels Logit.fit(method="newton")
+LOGIT_MAXITER = 35
+LOGIT_TOL = 1e-8
+LOGIT_RIDGE_FACTOR = 1e-10
+DRUG_BATCH_SIZE = 64  # number of drugs fitted together, bounds the memory use
+
+
+SCORES_HEADER = [
+    "endpoint",
+    "drug",
+    "score",
+    "stderr",
+    "n_indivs",
+    "pvalue"
+]
+COUNTS_HEADER = [
+    "endpoint",
+    "drug",
+    "full_ATC",
+    "count"
+]
+
 
 def main(fg_endpoint, first_events, detailed_longit, endpoint_defs, minimum_info, output_scores, output_counts):
     """Compute a score for the association of a given drug to a FinnGen endpoint"""
@@ -78,24 +109,12 @@ def main(fg_endpoint, first_events, detailed_longit, endpoint_defs, minimum_info
     # File with drug scores
     scores_file = open(output_scores, "x", buffering=line_buffering)
     res_writer = csv.writer(scores_file)
-    res_writer.writerow([
-        "endpoint",
-        "drug",
-        "score",
-        "stderr",
-        "n_indivs",
-        "pvalue"
-    ])
+    res_writer.writerow(SCORES_HEADER)
 
     # Results of full-ATC drug counts
     counts_file = open(output_counts, "x", buffering=line_buffering)
     counts_writer = csv.writer(counts_file)
-    counts_writer.writerow([
-        "endpoint",
-        "drug",
-        "full_ATC",
-        "count"
-    ])
+    counts_writer.writerow(COUNTS_HEADER)
 
     # Load endpoint and drug data
     df_logit, endpoint_def = load_data(
@@ -104,59 +123,287 @@ def main(fg_endpoint, first_events, detailed_longit, endpoint_defs, minimum_info
         detailed_longit,
         endpoint_defs,
         minimum_info)
-    is_sex_specific = pd.notna(endpoint_def.SEX)
 
-    for drug in df_logit.ATC.unique():
-        data_comp_logit(df_logit, fg_endpoint, drug, is_sex_specific, res_writer, counts_writer)
+    comp_endpoint(df_logit, fg_endpoint, endpoint_def, res_writer, counts_writer)
 
     scores_file.close()
     counts_file.close()
 
 
+def main_batch(fg_endpoints, first_events, detailed_longit, endpoint_defs, minimum_info, output_dir, n_workers, consolidate):
+    """Compute the drug scores for many FinnGen endpoints, loading the input data only once.
+
+    The output files are either <ENDPOINT>_scores.csv and
+    <ENDPOINT>_counts.csv for each endpoint, or scores.csv and
+    counts.csv for all endpoints if `consolidate` is set.
+    With more than 1 worker, the endpoints are computed across a
+    process pool, each worker getting a copy of the input data once.
+    """
+    line_buffering = 1
+
+    if consolidate:
+        scores_file = open(output_dir / "scores.csv", "x", buffering=line_buffering)
+        counts_file = open(output_dir / "counts.csv", "x", buffering=line_buffering)
+        res_writer = csv.writer(scores_file)
+        counts_writer = csv.writer(counts_file)
+        res_writer.writerow(SCORES_HEADER)
+        counts_writer.writerow(COUNTS_HEADER)
+    else:
+        res_writer = counts_writer = None
+
+    data = load_batch_data(fg_endpoints, first_events, detailed_longit, endpoint_defs, minimum_info)
+
+    if n_workers > 1:
+        from multiprocessing import get_context
+        with get_context("spawn").Pool(
+            processes=n_workers,
+            initializer=init_batch_worker,
+            initargs=(data,)
+        ) as pool:
+            results = pool.imap_unordered(comp_batch_endpoint, fg_endpoints)
+            write_batch_results(results, output_dir, res_writer, counts_writer)
+    else:
+        init_batch_worker(data)
+        results = map(comp_batch_endpoint, fg_endpoints)
+        write_batch_results(results, output_dir, res_writer, counts_writer)
+
+    if consolidate:
+        scores_file.close()
+        counts_file.close()
+
+
+def write_batch_results(results, output_dir, res_writer, counts_writer):
+    """Write the results as soon as each endpoint is done.
+
+    Without writers, each endpoint is written to its own files.
+    """
+    consolidate = res_writer is not None
+    for fg_endpoint, score_rows, count_rows in results:
+        if not consolidate:
+            scores_file = open(output_dir / f"{fg_endpoint}_scores.csv", "x")
+            counts_file = open(output_dir / f"{fg_endpoint}_counts.csv", "x")
+            res_writer = csv.writer(scores_file)
+            counts_writer = csv.writer(counts_file)
+            res_writer.writerow(SCORES_HEADER)
+            counts_writer.writerow(COUNTS_HEADER)
+
+        res_writer.writerows(score_rows)
+        counts_writer.writerows(count_rows)
+
+        if not consolidate:
+            scores_file.close()
+            counts_file.close()
+
+
+# Input data of the current batch worker, set by init_batch_worker()
+_batch_data = None
+
+
+def init_batch_worker(data):
+    """Set the input data used by comp_batch_endpoint() in the current process"""
+    global _batch_data
+    _batch_data = data
+
+
+def comp_batch_endpoint(fg_endpoint):
+    """Compute the drug scores of one endpoint of the batch, return the output rows"""
+    df_endpoint = get_endpoint_cases(_batch_data["first_events"], fg_endpoint)
+    df_logit = merge_logit_data(_batch_data["info"], df_endpoint, _batch_data["drug"])
+    endpoint_def = get_endpoint_def(_batch_data["endpoint_defs"], fg_endpoint)
+
+    res_rows = RowBuffer()
+    counts_rows = RowBuffer()
+    comp_endpoint(df_logit, fg_endpoint, endpoint_def, res_rows, counts_rows)
+
+    return fg_endpoint, res_rows.rows, counts_rows.rows
+
+
+class RowBuffer:
+    """Keep the rows in memory, to be used in place of a csv.writer"""
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+def comp_endpoint(df_logit, fg_endpoint, endpoint_def, res_writer, counts_writer):
+    """Compute the scores of all the drugs for the given endpoint"""
+    is_sex_specific = pd.notna(endpoint_def.SEX)
+
+    # Cases and controls of all the drugs are computed in a single pass
+    controls_cases = logit_controls_cases(
+        df_logit,
+        STUDY_DURATION,
+        PRE_DURATION,
+        PRE_EXCLUSION,
+        POST_DURATION)
+
+    drugs = []
+    for drug in df_logit.ATC.unique():
+        logger.info(f"Computing for: {fg_endpoint} / {drug}")
+        is_case, is_control, n_indivs, counts = drug_controls_cases(controls_cases, drug)
+
+        # Check that we have enough cases
+        ncases = is_case.sum()
+        if ncases < MIN_CASES:
+            logger.warning(f"Not enough cases ({ncases} < {MIN_CASES}) for {fg_endpoint} / {drug}")
+            continue
+
+        # Write the full-ATC drug counts
+        for full_atc, count in counts.items():
+            counts_writer.writerow([
+                fg_endpoint,
+                drug,
+                full_atc,
+                count
+            ])
+
+        drugs.append((drug, is_case, is_control, n_indivs))
+
+    # Compute the scores of the drugs with enough cases, by batches of drugs
+    for batch_start in range(0, len(drugs), DRUG_BATCH_SIZE):
+        batch = drugs[batch_start:batch_start + DRUG_BATCH_SIZE]
+        scores, stderrs, failed = comp_score_logit(
+            controls_cases["covariates"],
+            np.column_stack([is_case for (_, is_case, _, _) in batch]),
+            np.column_stack([is_control for (_, _, is_control, _) in batch]),
+            is_sex_specific
+        )
+
+        for (drug, _, _, n_indivs), score, stderr, fail in zip(batch, scores, stderrs, failed):
+            if fail:
+                logger.warning(f"LinAlgError: Singular matrix for {fg_endpoint} / {drug}")
+                continue
+
+            pvalue = 2 * norm.cdf(-abs(score / stderr))
+            res_writer.writerow([
+                fg_endpoint,
+                drug,
+                score,
+                stderr,
+                n_indivs,
+                pvalue
+            ])
+
+
 def load_data(fg_endpoint, first_events, detailed_longit, endpoint_defs, minimum_info):
     """Load the data for the given endpoint and all the drug events"""
-    fg_endpoint_age = fg_endpoint + "_AGE"
-    fg_endpoint_year = fg_endpoint + "_YEAR"
+    df_first_events = load_first_events(first_events, [fg_endpoint])
+    df_endpoint = get_endpoint_cases(df_first_events, fg_endpoint)
+    df_drug = load_drug_data(detailed_longit, df_endpoint.FINNGENID)
+    df_info = load_info_data(minimum_info)
+    endpoint_def = get_endpoint_def(load_endpoint_defs(endpoint_defs), fg_endpoint)
+
+    # Merge the data into a single DataFrame
+    df_logit = merge_logit_data(df_info, df_endpoint, df_drug)
+
+    return df_logit, endpoint_def
+
 
-    # FIRST-EVENT DATA (for logit model)
+def load_batch_data(fg_endpoints, first_events, detailed_longit, endpoint_defs, minimum_info):
+    """Load the data for all the given endpoints and all the drug events"""
+    return {
+        "first_events": load_first_events(first_events, fg_endpoints),
+        "drug": load_drug_data(detailed_longit),
+        "info": load_info_data(minimum_info),
+        "endpoint_defs": load_endpoint_defs(endpoint_defs),
+    }
+
+
+def load_first_events(first_events, fg_endpoints):
+    """Load the cases of the given endpoints, as a dict of endpoint -> DataFrame
+
+    The first events are either the wide-format first-event file from
+    FinnGen (CSV), or the long-format first-event file (Parquet file or
+    dataset directory) from wide_to_long_endpoint_first_events.py. The
+    long format is much faster to read since only the rows of the given
+    endpoints are read. It has the YEAR column only if the wide-format
+    file had the <ENDPOINT>_YEAR columns, otherwise the year is taken
+    from APPROX_EVENT_DAY.
+    """
     logger.info("Loading endpoint data")
-    df_endpoint = pd.read_csv(
-        first_events,
-        usecols=[
-            "FINNGENID",
-            fg_endpoint,
-            fg_endpoint_age,
-            fg_endpoint_year
-        ]
-    )
-    # Rename endpoint columns to genereic names for either reference down the line
-    df_endpoint = df_endpoint.rename(columns={
-        fg_endpoint: "fg_endpoint",
-        fg_endpoint_age: "fg_endpoint_age",
-        fg_endpoint_year: "fg_endpoint_year"
-    })
-
-    # Select only individuals having the endpoint
-    df_endpoint = df_endpoint.loc[df_endpoint["fg_endpoint"] == 1, :]
+    if first_events.suffix == ".parquet" or first_events.is_dir():
+        year_column = "YEAR" if "YEAR" in parquet.ParquetDataset(first_events).schema.names else "APPROX_EVENT_DAY"
+        df = pd.read_parquet(
+            first_events,
+            columns=["FINNGENID", "ENDPOINT", "AGE", year_column],
+            filters=[
+                ("ENDPOINT", "in", list(fg_endpoints)),
+                ("CONTROL_CASE_EXCL", "==", 1),
+            ]
+        )
+        if year_column == "APPROX_EVENT_DAY":
+            df["YEAR"] = pd.to_datetime(df.pop("APPROX_EVENT_DAY")).dt.year
+        df = df.rename(columns={"AGE": "fg_endpoint_age", "YEAR": "fg_endpoint_year"})
+        df["ENDPOINT"] = df["ENDPOINT"].astype(str)
+        df_cases = {
+            fg_endpoint: df_endpoint.drop(columns=["ENDPOINT"])
+            for fg_endpoint, df_endpoint in df.groupby("ENDPOINT", sort=False)
+        }
+    else:
+        usecols = ["FINNGENID"]
+        for fg_endpoint in fg_endpoints:
+            usecols += [fg_endpoint, fg_endpoint + "_AGE", fg_endpoint + "_YEAR"]
+        df = pd.read_csv(first_events, usecols=usecols)
+
+        # Select only individuals having the endpoint
+        df_cases = {}
+        for fg_endpoint in fg_endpoints:
+            df_endpoint = df.loc[df[fg_endpoint] == 1, ["FINNGENID", fg_endpoint + "_AGE", fg_endpoint + "_YEAR"]]
+            # Rename endpoint columns to genereic names for either reference down the line
+            df_cases[fg_endpoint] = df_endpoint.rename(columns={
+                fg_endpoint + "_AGE": "fg_endpoint_age",
+                fg_endpoint + "_YEAR": "fg_endpoint_year"
+            })
+
+    return df_cases
+
+
+def get_endpoint_cases(df_first_events, fg_endpoint):
+    """Get the incident cases of the given endpoint (for logit model)"""
+    df_endpoint = df_first_events.get(
+        fg_endpoint,
+        pd.DataFrame(columns=["FINNGENID", "fg_endpoint_age", "fg_endpoint_year"])
+    ).copy()
+
     # Compute approximate year of birth
     df_endpoint["yob"] = df_endpoint["fg_endpoint_year"] - df_endpoint["fg_endpoint_age"]
     # Keep only incident cases (individuals having the endpoint after start of study)
     df_endpoint = df_endpoint[df_endpoint["fg_endpoint_year"] >= STUDY_STARTS]
 
+    return df_endpoint
+
 
-    # DRUG DATA
+def load_drug_data(detailed_longit, finngenids=None):
+    """Load the drug purchase events, optionally only for the given individuals"""
     logger.info("Loading drug data")
-    df_drug = pd.read_csv(
-        detailed_longit,
-        usecols=["FINNGENID", "SOURCE", "EVENT_AGE", "APPROX_EVENT_DAY", "CODE1"]
-    )
+    if detailed_longit.suffix == ".parquet":
+        # Drug purchase store from extract_drug_purchases.py.
+        # It is sorted by FINNGENID, so only the row groups with
+        # the given individuals are read.
+        filters = None if finngenids is None else [("FINNGENID", "in", list(finngenids))]
+        df_drug = pd.read_parquet(
+            detailed_longit,
+            columns=["FINNGENID", "EVENT_AGE", "EVENT_YEAR", "CODE1", "ATC"],
+            filters=filters
+        )
+    else:
+        df_drug = pd.read_csv(
+            detailed_longit,
+            usecols=["FINNGENID", "SOURCE", "EVENT_AGE", "APPROX_EVENT_DAY", "CODE1"]
+        )
+
+        df_drug = df_drug.loc[df_drug.SOURCE == "PURCH", :]  # keep only drug purchase events
+        df_drug["EVENT_YEAR"] = pd.to_datetime(df_drug.APPROX_EVENT_DAY).dt.year  # needed for filtering based on year
+        df_drug["ATC"] = df_drug.CODE1.str[:ATC_LEVEL]
+        df_drug = df_drug.drop(columns=["SOURCE", "APPROX_EVENT_DAY"])
 
-    df_drug.APPROX_EVENT_DAY = pd.to_datetime(df_drug.APPROX_EVENT_DAY)  # needed for filtering based on year
-    df_drug = df_drug.loc[df_drug.SOURCE == "PURCH", :]  # keep only drug purchase events
-    df_drug["ATC"] = df_drug.CODE1.str[:ATC_LEVEL]
+    return df_drug
 
 
-    # INFO DATA
+def load_info_data(minimum_info):
+    """Load the sex of each individual"""
     logger.info("Loading info data")
     df_info = pd.read_csv(
         minimum_info,
@@ -165,169 +412,285 @@ def load_data(fg_endpoint, first_events, detailed_longit, endpoint_defs, minimum
     df_info["female"] = df_info.SEX.apply(lambda d: 1.0 if d == "female" else 0.0)
     df_info = df_info.drop(columns=["SEX"])
 
+    return df_info
+
 
-    # ENDPOINT DEFINITION
-    df_endpoint_defs = pd.read_csv(
+def load_endpoint_defs(endpoint_defs):
+    """Load the endpoint definitions"""
+    return pd.read_csv(
         endpoint_defs,
         usecols=["NAME", "SEX"]
     )
-    endpoint_def = df_endpoint_defs.loc[df_endpoint_defs.NAME == fg_endpoint, :].iloc[0]
 
-    # Merge the data into a single DataFrame
-    logger.info("Merging dataframes")
-    df_logit = df_info.merge(df_endpoint, on="FINNGENID")
-    df_logit = df_logit.merge(df_drug, on="FINNGENID")
-
-    return df_logit, endpoint_def
 
+def get_endpoint_def(df_endpoint_defs, fg_endpoint):
+    """Get the definition of the given endpoint"""
+    return df_endpoint_defs.loc[df_endpoint_defs.NAME == fg_endpoint, :].iloc[0]
 
-def data_comp_logit(df, fg_endpoint, drug, is_sex_specific, res_writer, counts_writer):
-    logger.info(f"Computing for: {fg_endpoint} / {drug}")
 
-    df_stats, n_indivs, counts = logit_controls_cases(
-        df,
-        drug,
-        STUDY_DURATION,
-        PRE_DURATION,
-        PRE_EXCLUSION,
-        POST_DURATION)
+def merge_logit_data(df_info, df_endpoint, df_drug):
+    """Merge the info, endpoint and drug data into a single DataFrame"""
+    logger.info("Merging dataframes")
+    df_logit = df_info.merge(df_endpoint, on="FINNGENID")
+    df_logit = df_logit.merge(df_drug, on="FINNGENID")
 
-    # Check that we have enough cases
-    (ncases, _) = df_stats[df_stats.drug == 1.0].shape
-    if ncases < MIN_CASES:
-        logger.warning(f"Not enough cases ({ncases} < {MIN_CASES}) for {fg_endpoint} / {drug}")
-        return
-
-    # Write the full-ATC drug counts
-    for full_atc, count in counts.items():
-        counts_writer.writerow([
-            fg_endpoint,
-            drug,
-            full_atc,
-            count
-        ])
-
-    # Compute the score for the given endpoint / drug
-    try:
-        score, stderr = comp_score_logit(df_stats, is_sex_specific)
-    except LinAlgError as exc:
-        logger.warning(f"LinAlgError: {exc}")
-    else:
-        pvalue = 2 * norm.cdf(-abs(score / stderr))
-        res_writer.writerow([
-            fg_endpoint,
-            drug,
-            score,
-            stderr,
-            n_indivs,
-            pvalue
-        ])
+    return df_logit
 
 
 def logit_controls_cases(
         df,
-        drug,
         study_duration,
         pre_duration,
         pre_exclusion,
         post_duration,
 ):
-    """Build a table of controls and cases"""
+    """Classify the drug events into controls and cases, for all drugs at once.
+
+    An event is a case event for its drug if it happens in the
+    post-endpoint time-window and not in the pre-endpoint time-window.
+    For a given drug:
+    - the cases are the individuals with a case event of that drug,
+    - the controls are the individuals with any other event.
+    The output is used by drug_controls_cases() to get the controls and
+    cases of each drug.
+    """
     logger.debug("Munging data into controls and cases")
-    df["drug"] = 0.0
 
     # Remove some data based on study_duration
     study_starts = STUDY_ENDS - study_duration
     keep_data = (
-        (df.APPROX_EVENT_DAY.dt.year >= study_starts)
+        (df.EVENT_YEAR >= study_starts)
         & (df["fg_endpoint_year"] >= study_starts))
     df = df.loc[keep_data, :]
 
-    # Count global number of individuals having the endpoint + drug at some point in time
-    n_indivs = df.loc[df.ATC == drug, "FINNGENID"].unique().shape[0]
-
-    # Check events where the drug happens BEFORE the endpoint
-    drug_pre_endpoint = (
-        (df.ATC == drug)
-        # Pre-endpoint time-window
-        & (df.EVENT_AGE >= df.fg_endpoint_age - pre_exclusion - pre_duration)
-        & (df.EVENT_AGE <= df.fg_endpoint_age - pre_exclusion)
+    # Covariates of each individual, individuals are sorted by FINNGENID
+    person, finngenids = pd.factorize(df.FINNGENID, sort=True)
+    covariates = df.groupby(person)[["female", "yob", "fg_endpoint_year"]].min()
+    covariates.index = pd.Index(finngenids, name="FINNGENID")
+    n_events = np.bincount(person, minlength=len(finngenids))
+
+    # Global number of individuals having the endpoint + drug at some point in time
+    n_indivs = (
+        pd.DataFrame({"ATC": df.ATC.values, "person": person})
+        .drop_duplicates()
+        .groupby("ATC")
+        .size()
     )
 
-    # Check events where the druge happens AFTER the endpoint
-    drug_post_endpoint = (
-        (df.ATC == drug)
-        # Post-endpoint time-window
-        & (df.EVENT_AGE >= df.fg_endpoint_age)
-        & (df.EVENT_AGE <= df.fg_endpoint_age + post_duration)
+    # Check events happening BEFORE and AFTER the endpoint, for the drug of the event
+    event_age = df.EVENT_AGE.values
+    endpoint_age = df.fg_endpoint_age.values
+    pre_endpoint = (
+        (event_age >= endpoint_age - pre_exclusion - pre_duration)
+        & (event_age <= endpoint_age - pre_exclusion)
     )
+    post_endpoint = (
+        (event_age >= endpoint_age)
+        & (event_age <= endpoint_age + post_duration)
+    )
+    case_events = (~ pre_endpoint) & post_endpoint
+
+    # Case events by drug and individual: number of events and smallest full ATC code
+    cases = (
+        pd.DataFrame({
+            "ATC": df.ATC.values[case_events],
+            "person": person[case_events],
+            "CODE1": df.CODE1.values[case_events],
+        })
+        .groupby(["ATC", "person"])
+        .agg(n_events=("CODE1", "size"), CODE1=("CODE1", "min"))
+        .reset_index(level="ATC")
+    )
+    cases_by_drug = {drug: df_drug for drug, df_drug in cases.groupby("ATC", sort=False)}
+
+    return {
+        "covariates": covariates,
+        "n_events": n_events,
+        "n_indivs": n_indivs,
+        "cases": cases_by_drug,
+    }
+
+
+def drug_controls_cases(controls_cases, drug):
+    """Get the controls and cases for the given drug.
+
+    Returns boolean arrays aligned with controls_cases["covariates"]
+    telling which individuals are cases and which are controls, an
+    individual can be both.
+    """
+    n_events = controls_cases["n_events"]
+    n_persons = n_events.shape[0]
+
+    n_indivs = controls_cases["n_indivs"].get(drug, 0)
+    df_cases = controls_cases["cases"].get(drug)
+    if df_cases is None:
+        case_person = np.array([], dtype=np.int64)
+        case_n_events = np.array([], dtype=np.int64)
+        counts = pd.Series([], dtype=np.int64)
+    else:
+        case_person = df_cases.index.values
+        case_n_events = df_cases.n_events.values
+        # Count the number of individuals for each full ATC code
+        counts = df_cases.groupby("CODE1").size()
 
-    # Define cases
-    cases = (~ drug_pre_endpoint) & drug_post_endpoint
-    df_cases = df.loc[cases, :]
-    df_cases.loc[:, "drug"] = 1.0
-
-    # The aggregate function doesn't matter: within each group the rows will differ by EVENT_AGE, but this column will be discarded in the model
-    df_cases = df_cases.groupby("FINNGENID").min()
-
-    # Count the number of individuals for each full ATC code
-    counts = df_cases.loc[df_cases.ATC == drug, :].groupby("CODE1").count().drug
-
-    # Remove unecessary columns
-    df_cases = df_cases.drop(columns=[
-        "fg_endpoint",
-        "fg_endpoint_age",
-        "EVENT_AGE",
-        "CODE1",
-        "ATC"])
+    is_case = np.zeros(n_persons, dtype=bool)
+    is_case[case_person] = True
 
-    df_controls = df.loc[~ cases, ["FINNGENID", "female", "yob", "fg_endpoint_year", "drug"]]
-    df_controls = df_controls.groupby("FINNGENID").min()
+    # Individuals with only case events of the drug are not controls
+    is_control = np.ones(n_persons, dtype=bool)
+    is_control[case_person] = case_n_events != n_events[case_person]
 
-    df_stats = pd.concat([df_cases, df_controls], sort=False)
+    return is_case, is_control, n_indivs, counts
 
-    return df_stats, n_indivs, counts
 
+def comp_score_logit(covariates, is_case, is_control, is_sex_specific):
+    """Compute the drug scores for a batch of drugs.
 
-def comp_score_logit(df, is_sex_specific):
+    Fit the model 'drug ~ yob + fg_endpoint_year (+ female)' for each
+    drug, the i-th column of `is_case` and `is_control` giving the
+    cases and controls of the i-th drug. Then predict the probability of
+    the drug at fixed covariate values and its standard error.
+    """
     logger.info("Model computation score")
     # Remove the sex covariate for sex-specific endpoints, otherwise
     # it will fail since there will be no females or no males.
-    model = 'drug ~ yob + yob*yob + fg_endpoint_year + fg_endpoint_year*fg_endpoint_year'
+    columns = ["yob", "fg_endpoint_year"]
+    predict_data = [1.0, PRED_YOB, PRED_FG_ENDPOINT_YEAR]
     if not is_sex_specific:
-        model += ' + female'
-    # Compute score using Logistic model, predict using fixed values
-    mod = logit(model, df)
-    res = mod.fit(disp=False)  # fit() without displaying convergence messages
-    predict_data = pd.DataFrame({
-        "Intercept": [1.0],
-        "yob": [PRED_YOB],
-        "fg_endpoint_year": [PRED_FG_ENDPOINT_YEAR],
-        "female": [PRED_FEMALE]
-    })
-
-    # Force "predict_cata" and "cov_params" matrix to use same column
-    # order, otherwise it will to a silent bug as their values are put
-    # together computing the std err with "mdot" below.
-    col_order = res.cov_params().columns.values
-    predict_data = predict_data.loc[:, col_order]
-
-    # Compute the standard error of the prediction
-    pred = res.predict(predict_data)
-    pred_lin = np.log(pred / (1 - pred))  # to scale of the linear predictors
-    stderr = np.sqrt(mdot([predict_data, res.cov_params(), predict_data.T]))
-    real_stderr = stderr.flatten() * (np.abs(np.exp(pred_lin)) / (1 + np.exp(pred_lin))**2)
-
-    return pred[0], real_stderr[0]
+        columns.append("female")
+        predict_data.append(PRED_FEMALE)
+    predict_data = np.array(predict_data)
+
+    exog = np.column_stack([np.ones(covariates.shape[0]), covariates.loc[:, columns].values])
+
+    # Individuals with missing covariates are dropped from the models
+    complete = ~ np.isnan(exog).any(axis=1)
+    params, cov_params, failed = fit_logit_batch(
+        exog[complete],
+        is_case[complete],
+        is_control[complete],
+    )
+
+    # Compute the standard error of the prediction, on the scale of the linear predictors
+    pred_lin = params @ predict_data
+    stderr = np.sqrt(np.einsum("i,dij,j->d", predict_data, cov_params, predict_data))
+    pred = 1 / (1 + np.exp(-pred_lin))
+    real_stderr = stderr * (np.abs(np.exp(pred_lin)) / (1 + np.exp(pred_lin))**2)
+
+    return pred, real_stderr, failed
+
+
+def fit_logit_batch(exog, is_case, is_control):
+    """Fit logistic models for many outcomes on the same design matrix.
+
+    Individual i is a row with outcome 1 in model d if is_case[i, d],
+    and a row with outcome 0 if is_control[i, d].
+    All models are fitted together with Newton's method (IRLS), using the
+    same start values, stopping rule and Hessian ridge as statsmodels
+    Logit.fit(method="newton"), so the results are the same as fitting
+    each model on its own table of cases and controls.
+    A model whose Hessian is singular is reported in `failed`, as a
+    LinAlgError would be raised when fitting it alone.
+    """
+    n_models = is_case.shape[1]
+    n_params = exog.shape[1]
+    successes = is_case.astype(np.float64)
+    trials = successes + is_control
+    nobs = trials.sum(axis=0)
+
+    params = np.zeros((n_models, n_params))
+    failed = np.zeros(n_models, dtype=bool)
+    active = np.ones(n_models, dtype=bool)
+    diag = np.arange(n_params)
+
+    for _ in range(LOGIT_MAXITER):
+        idx = np.flatnonzero(active)
+        if idx.shape[0] == 0:
+            break
+
+        score, hessian = logit_score_hessian(exog, successes[:, idx], trials[:, idx], params[idx])
+        score /= nobs[idx, None]
+        hessian /= nobs[idx, None, None]
+        hessian[:, diag, diag] += LOGIT_RIDGE_FACTOR
+
+        step, singular = batch_solve(hessian, score)
+        new_params = params[idx] - step
+        converged = ~ np.any(np.abs(new_params - params[idx]) > LOGIT_TOL, axis=1)
+
+        params[idx[~ singular]] = new_params[~ singular]
+        failed[idx[singular]] = True
+        active[idx[singular | converged]] = False
+
+    # Covariance of the parameters from the Hessian at the final parameters
+    _, hessian = logit_score_hessian(exog, successes, trials, params)
+    hessian /= nobs[:, None, None]
+    cov_params, singular = batch_inv(-hessian)
+    cov_params /= nobs[:, None, None]
+    failed |= singular
+
+    return params, cov_params, failed
+
+
+def logit_score_hessian(exog, successes, trials, params):
+    """Score and Hessian of the log-likelihood of each logistic model"""
+    prob = 1 / (1 + np.exp(-(exog @ params.T)))
+    score = (exog.T @ (successes - trials * prob)).T
+    weights = trials * prob * (1 - prob)
+    hessian = -np.einsum("nd,ni,nj->dij", weights, exog, exog, optimize=True)
+
+    return score, hessian
+
+
+def batch_solve(a, b):
+    """Solve a stack of linear systems, flagging the singular ones instead of raising"""
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0], np.zeros(a.shape[0], dtype=bool)
+    except LinAlgError:
+        x = np.zeros_like(b)
+        singular = np.zeros(a.shape[0], dtype=bool)
+        for ii in range(a.shape[0]):
+            try:
+                x[ii] = np.linalg.solve(a[ii], b[ii])
+            except LinAlgError:
+                singular[ii] = True
+        return x, singular
+
+
+def batch_inv(a):
+    """Invert a stack of matrices, flagging the singular ones instead of raising"""
+    try:
+        return np.linalg.inv(a), np.zeros(a.shape[0], dtype=bool)
+    except LinAlgError:
+        inv = np.full_like(a, np.nan)
+        singular = np.zeros(a.shape[0], dtype=bool)
+        for ii in range(a.shape[0]):
+            try:
+                inv[ii] = np.linalg.inv(a[ii])
+            except LinAlgError:
+                singular[ii] = True
+        return inv, singular
 
 
 if __name__ == '__main__':
-    main(
-        fg_endpoint=getenv("FG_ENDPOINT"),
-        first_events=Path(getenv("FIRST_EVENTS")),
-        detailed_longit=Path(getenv("DETAILED_LONGIT")),
-        endpoint_defs=Path(getenv("ENDPOINT_DEFS")),
-        minimum_info=Path(getenv("MINIMUM_INFO")),
-        output_scores=Path(getenv("OUTPUT_SCORES")),
-        output_counts=Path(getenv("OUTPUT_COUNTS")),
-    )
+    fg_endpoints_list = getenv("FG_ENDPOINTS_LIST")
+    if fg_endpoints_list is not None:
+        main_batch(
+            fg_endpoints=Path(fg_endpoints_list).read_text().split(),
+            first_events=Path(getenv("FIRST_EVENTS")),
+            detailed_longit=Path(getenv("DETAILED_LONGIT")),
+            endpoint_defs=Path(getenv("ENDPOINT_DEFS")),
+            minimum_info=Path(getenv("MINIMUM_INFO")),
+            output_dir=Path(getenv("OUTPUT_DIRECTORY")),
+            n_workers=int(getenv("N_WORKERS", 1)),
+            consolidate=getenv("CONSOLIDATE_OUTPUT") == "1",
+        )
+    else:
+        main(
+            fg_endpoint=getenv("FG_ENDPOINT"),
+            first_events=Path(getenv("FIRST_EVENTS")),
+            detailed_longit=Path(getenv("DETAILED_LONGIT")),
+            endpoint_defs=Path(getenv("ENDPOINT_DEFS")),
+            minimum_info=Path(getenv("MINIMUM_INFO")),
+            output_scores=Path(getenv("OUTPUT_SCORES")),
+            output_counts=Path(getenv("OUTPUT_COUNTS")),
+        )
@@ -19,6 +19,16 @@ environment. One needs to set the following environment variables (see
 and run:
   python surv_analysis.py
 
+The Cox models are fitted with risteys_pipeline/coxph.py. When this
+script is run outside of the risteys_pipeline package, coxph.py must be
+importable, e.g. copied to a directory on PYTHONPATH (cromwell/surv.wdl
+stages it from its CoxphModule input).
+
+The endpoint pairs can be run in parallel by setting the WORKERS
+environment variable to the number of worker processes (default: 1).
+This also requires risteys_pipeline/utils/shared_data.py, staged the
+same way as coxph.py.
+
 Input files
 -----------
 - INPUT_PAIRS
@@ -31,7 +41,10 @@ Input files
   Source: FinnGen
 
 - INPUT_LONG_FORMAT_FEVENTS
-  The long-format first-event phenotype file.
+  The long-format first-event phenotype file, or partitioned dataset
+  directory. Only the endpoints of the input pairs and DEATH are read.
+  This can be the first-event file of the shard written by
+  surv_plan_shards.py --write-fevents, with only these endpoints.
   Source: previous pipeline step
 
 - INPUT_INFO
@@ -61,6 +74,7 @@ References
 [ ] NB COMO
     https://plana-ripoll.github.io/NB-COMO/
 """
+import json
 import logging
 from csv import writer as csv_writer
 from os import getenv
@@ -70,9 +84,14 @@ from time import time as now
 
 import numpy as np
 import pandas as pd
-from lifelines import CoxPHFitter
-from lifelines.utils import ConvergenceError
-from lifelines.utils import interpolate_at_times
+import pyarrow.parquet as parquet
+
+try:
+    from risteys_pipeline.coxph import ConvergenceError, coxph_summary, cumulative_hazard_at, fit_coxph, predict_survival
+except ImportError:
+    # dsub runs this script outside of the risteys_pipeline package,
+    # with coxph.py staged on PYTHONPATH.
+    from coxph import ConvergenceError, coxph_summary, cumulative_hazard_at, fit_coxph, predict_survival
 
 # TODO #
 # Copy-pasted the logging configuration here instead of importing it
@@ -106,7 +125,7 @@ class NotEnoughIndividuals(Exception):
     pass
 
 
-# Step size for the fitting algorithm of CoxPHFitter
+# Step size for the fitting algorithm of the Cox model
 DEFAULT_STEP_SIZE = 1.0
 LOWER_STEP_SIZE   = 0.1
 
@@ -134,7 +153,7 @@ MEAN_INDIV_FEMALE_RATIO = 0.5
 BCH_TIMEPOINTS = [0, 2.5, 5, 7.5, 10, 12.5, 15, 17.5, 20, 21.99]
 
 
-def main(path_pairs, path_definitions, path_long_format_fevents, path_info, output_path, timings_path):
+def main(path_pairs, path_definitions, path_long_format_fevents, path_info, output_path, timings_path, n_workers=1):
     # Initialize the CSV output
     line_buffering = 1
     res_file = open(output_path, "x", buffering=line_buffering)
@@ -146,84 +165,172 @@ def main(path_pairs, path_definitions, path_long_format_fevents, path_info, outp
     timings_writer.writerow(["prior", "outcome", "lag", "step_size", "time_seconds"])
 
     # Load all data
-    pairs, endpoints, df_events, df_info = load_data(
+    pairs, endpoints, df_events, df_info, bitmaps = load_data(
         path_pairs,
         path_definitions,
         path_long_format_fevents,
         path_info
     )
 
+    # One task per outcome, running all its pairs, so that the
+    # case-cohort design study of an outcome is set up once for all its
+    # priors, including when running with workers.
+    sex_specific = set(endpoints.loc[endpoints.SEX.notna(), "NAME"])
+    priors = {}
+    for prior, outcome in pairs:
+        priors.setdefault(outcome, []).append(prior)
+    tasks = [
+        (outcome, outcome_priors, outcome in sex_specific)
+        for outcome, outcome_priors in sorted(priors.items())
+    ]
+
+    if n_workers > 1:
+        # The data is shared with the workers instead of being pickled
+        # for every task or worker. The bitmaps are shared as a table
+        # with one column per endpoint.
+        from multiprocessing import get_context
+        share_frames = import_shared_data().share_frames
+        shared = {"events": df_events, "info": df_info, "bitmaps": pd.DataFrame(bitmaps, copy=False)}
+        with share_frames(shared) as handle, get_context("spawn").Pool(
+            processes=n_workers,
+            initializer=init_worker,
+            initargs=(handle,)
+        ) as pool:
+            results = pool.imap_unordered(run_outcome, tasks)
+            write_results(results, res_writer, timings_writer)
+    else:
+        init_data(df_events, df_info, bitmaps)
+        results = map(run_outcome, tasks)
+        write_results(results, res_writer, timings_writer)
+
+    timings_file.close()
+    res_file.close()
+
+
+def write_results(results, res_writer, timings_writer):
+    """Write the result and timing rows of the pairs of each outcome as soon as it is done"""
+    for outcome_results in results:
+        for res_rows, timings_rows in outcome_results:
+            res_writer.writerows(res_rows)
+            timings_writer.writerows(timings_rows)
+
+
+# Input data of the current process, set by init_data()
+_data = {}
+
+# Case-cohort tables of the last outcome prepared by the current process
+_case_cohort = {"outcome": None, "tables": None}
+
+
+def init_data(df_events, df_info, bitmaps):
+    """Set the input data used by run_outcome() and run_pair() in the current process"""
+    _data.update(events=df_events, info=df_info, bitmaps=bitmaps)
+    _case_cohort.update(outcome=None, tables=None)
+
+
+def init_worker(handle):
+    """Pool initializer attaching the worker to the shared first events, info and bitmaps"""
+    shared_data = import_shared_data()
+    shared_data.attach_frames(handle)
+    df_bitmaps = shared_data.get_frame("bitmaps")
+    bitmaps = {endpoint: df_bitmaps[endpoint].values for endpoint in df_bitmaps.columns}
+    init_data(shared_data.get_frame("events"), shared_data.get_frame("info"), bitmaps)
+
+
+def import_shared_data():
+    """Import the shared_data module, only needed when running with workers"""
+    try:
+        from risteys_pipeline.utils import shared_data
+    except ImportError:
+        # Same as coxph.py, with utils/shared_data.py staged on PYTHONPATH.
+        import shared_data
+    return shared_data
+
+
+def run_outcome(task):
+    """Run the endpoint pairs of an outcome in turn.
+
+    Return the output of run_pair() for each pair.
+    """
+    outcome, priors, is_sex_specific = task
+    return [run_pair(((prior, outcome), is_sex_specific)) for prior in priors]
+
+
+def run_pair(task):
+    """Run the Cox regressions of all the lags of an endpoint pair.
+
+    Return the result rows and the timing rows of the pair.
+    """
+    pair, is_sex_specific = task
+    prior, outcome = pair
+    df_events = _data["events"]
+    df_info = _data["info"]
+    bitmaps = _data["bitmaps"]
+    res_rows = []
+    timings_rows = []
+
     # Initialize the job queue
     jobs = LifoQueue()
-    for pair in pairs:
-        for lag in LAGS:
-            jobs.put({"pair": pair, "lag": lag, "step_size": DEFAULT_STEP_SIZE})
+    for lag in LAGS:
+        jobs.put({"lag": lag, "step_size": DEFAULT_STEP_SIZE})
 
-    # Keep track if the current endpoint pair needs to be skipped
-    skip = None
+    # The data is prepared once for all the lags, and each Cox fit is
+    # warm-started from the coefficients of the previous lag.
+    prepared = None
+    warm_start = None
 
     # Run the regression for each job
     while not jobs.empty():
-        time_start = now()
-
         # Get job info
         job = jobs.get()
-        pair = job["pair"]
         lag = job["lag"]
         step_size = job["step_size"]
 
-        # Go to next endpoint pair if this one is to be skipped
-        if pair == skip:
-            continue
+        # Retried jobs resume from the last iterate of their failed fit
+        init = job.get("init", warm_start)
 
-        logger.info(f"Jobs remaining: ~ {jobs.qsize()}")
         logger.info(f"[JOB] pair: {pair} | lag: {lag} | step size: {step_size}")
-        prior, outcome = pair
-        is_sex_specific = pd.notna(endpoints.loc[endpoints.NAME == outcome, "SEX"].iloc[0])
 
         time_start = now()
         try:
-            (df_unexp,
-             df_unexp_death,
-             df_unexp_exp_p1,
-             df_unexp_exp_p2,
-             df_tri_p1,
-             df_tri_p2) = prep_coxhr(pair, lag, df_events, df_info)
-
-            nindivs, df_lifelines = prep_lifelines(
-                df_unexp,
-                df_unexp_death,
-                df_unexp_exp_p1,
-                df_unexp_exp_p2,
-                df_tri_p1,
-                df_tri_p2
-            )
-            compute_coxhr(
+            if prepared is None:
+                if _case_cohort["outcome"] != outcome:
+                    _case_cohort["tables"] = prep_case_cohort(outcome, df_events, df_info, bitmaps)
+                    _case_cohort["outcome"] = outcome
+                prepared = prep_coxhr(pair, _case_cohort["tables"], df_events, bitmaps)
+
+            nindivs, df_lifelines = prep_lifelines(lag_cols(lag), *prepared)
+            warm_start, res_row = compute_coxhr(
                 pair,
                 df_lifelines,
                 lag,
                 step_size,
+                init,
                 is_sex_specific,
-                nindivs,
-                res_writer
+                nindivs
             )
+            res_rows.append(res_row)
         except NotEnoughIndividuals as exc:
-            skip = pair  # skip remaining jobs (different lags) for this endpoint pair
+            # Skip remaining jobs (different lags) for this endpoint pair
             logger.warning(exc)
+            break
         except (ConvergenceError, Warning) as exc:
             # Retry with a lower step_size
             if step_size == DEFAULT_STEP_SIZE:
                 step_size = LOWER_STEP_SIZE
-                jobs.put({"pair": pair, "lag": lag, "step_size": step_size})
+                jobs.put({
+                    "lag": lag,
+                    "step_size": step_size,
+                    "init": getattr(exc, "params", None)
+                })
             # We already tried with the lower step size, we have to skip this job
             else:
                 logger.warning(f"Failed to run Cox.fit() for {pair}, lag: {lag}, step size: {step_size}:\n{exc}")
         finally:
             job_time = now() - time_start
-            timings_writer.writerow([prior, outcome, lag, step_size, job_time])
+            timings_rows.append([prior, outcome, lag, step_size, job_time])
 
-    timings_file.close()
-    res_file.close()
+    return res_rows, timings_rows
 
 
 def load_data(path_pairs, path_definitions, path_long_format_fevents, path_info):
@@ -235,8 +342,15 @@ def load_data(path_pairs, path_definitions, path_long_format_fevents, path_info)
     # Get endpoint list
     endpoints = pd.read_csv(path_definitions, usecols=["NAME", "SEX"])
 
-    # Get first events
-    df_events = pd.read_parquet(path_long_format_fevents)
+    # Get first events, only for the endpoints in the pairs and DEATH.
+    # The endpoint filter is pushed down to the Parquet reader.
+    select_endpoints = {endpoint for pair in pairs for endpoint in pair} | {"DEATH"}
+    check_pruned_fevents(path_long_format_fevents, select_endpoints)
+    df_events = pd.read_parquet(
+        path_long_format_fevents,
+        columns=["FINNGENID", "ENDPOINT", "AGE"],
+        filters=[("ENDPOINT", "in", list(select_endpoints))]
+    )
 
     # Get sex and approximate birth date of each indiv
     df_info = pd.read_csv(path_info, usecols=["FINNGENID", "BL_YEAR", "BL_AGE", "SEX"])
@@ -246,10 +360,7 @@ def load_data(path_pairs, path_definitions, path_long_format_fevents, path_info)
     df_info = df_info.drop(columns=["SEX", "BL_YEAR", "BL_AGE"])
 
     # Set age at start of study for each indiv.
-    df_info["START_AGE"] = df_info.apply(
-        lambda r: max(STUDY_STARTS - r.BIRTH_TYEAR, 0.0),
-        axis="columns"
-    )
+    df_info["START_AGE"] = (STUDY_STARTS - df_info.BIRTH_TYEAR).clip(lower=0.0)
     # We cannot set age at end of study yet, since it depends on the outcome age.
     # However, we need the death age for it when we are there.
     deaths = (
@@ -271,7 +382,58 @@ def load_data(path_pairs, path_definitions, path_long_format_fevents, path_info)
     df_events = df_events.loc[~ df_events.FINNGENID.isin(born_after_study), :]
     df_info = df_info.loc[~ df_info.FINNGENID.isin(born_after_study), :]
 
-    return pairs, endpoints, df_events, df_info
+    # Dense person index: the person of row i of df_info is person i,
+    # the events refer to it in the PERSON column.
+    # The FINNGENIDs are not needed after that, and dropping them
+    # leaves only columns that can be shared with the worker processes.
+    df_info = df_info.reset_index(drop=True)
+    df_events = df_events.assign(
+        PERSON=pd.Index(df_info.FINNGENID).get_indexer(df_events.FINNGENID),
+        ENDPOINT=df_events.ENDPOINT.astype("category")
+    )
+    df_events = df_events.loc[df_events.PERSON >= 0, ["PERSON", "ENDPOINT", "AGE"]].reset_index(drop=True)
+    df_info = df_info.drop(columns="FINNGENID")
+
+    bitmaps = endpoint_bitmaps(df_events, df_info.shape[0])
+
+    return pairs, endpoints, df_events, df_info, bitmaps
+
+
+def check_pruned_fevents(path_long_format_fevents, select_endpoints):
+    """Check that a first-event file pruned by surv_plan_shards.py has all the needed endpoints"""
+    if not Path(path_long_format_fevents).is_file():
+        return
+    metadata = parquet.read_schema(path_long_format_fevents).metadata or {}
+    if b"risteys_endpoints" not in metadata:
+        return
+    missing = select_endpoints - set(json.loads(metadata[b"risteys_endpoints"]))
+    if missing:
+        raise ValueError(f"First-event file {path_long_format_fevents} was pruned without endpoints: {sorted(missing)}")
+
+
+def endpoint_bitmaps(df_events, n_persons):
+    """Packed bitmap of the persons having each endpoint, over the dense person index"""
+    bitmaps = {}
+    for endpoint, persons in df_events.groupby("ENDPOINT", observed=True).PERSON:
+        members = np.zeros(n_persons, dtype=bool)
+        members[persons.to_numpy()] = True
+        bitmaps[endpoint] = np.packbits(members)
+    return bitmaps
+
+
+def endpoint_members(bitmaps, endpoint, n_persons):
+    """Boolean array of the persons having the endpoint"""
+    if endpoint not in bitmaps:
+        return np.zeros(n_persons, dtype=bool)
+    return np.unpackbits(bitmaps[endpoint], count=n_persons).astype(bool)
+
+
+def endpoint_ages(df_events, endpoint, n_persons):
+    """Age at the endpoint of each person, NaN for the persons not having it"""
+    ages = np.full(n_persons, np.nan)
+    events = df_events.loc[df_events.ENDPOINT == endpoint, :]
+    ages[events.PERSON.to_numpy()] = events.AGE.to_numpy()
+    return ages
 
 
 def init_csv(res_file):
@@ -324,96 +486,100 @@ def init_csv(res_file):
     return res_writer
 
 
-def prep_coxhr(pair, lag, df_events, df_info):
-    """Prepare the data to be used in the Cox model.
+def prep_case_cohort(outcome, df_events, df_info, bitmaps):
+    """Set up the case-cohort design study of an outcome.
 
-    Example timeline for an individual:
+    This only depends on the outcome, so it is shared by all the pairs
+    having this outcome.
 
-    study starts   prior  outcome     study ends
-    |              |      |           |
-    |--------------=======XXXXXXXXXXXX|
-    [  unexposed  ][     exposed      ]
+    Return the persons of the case-cohort sample, which of them are
+    cases, and the DataFrame of the sample (1 line = 1 individual) with
+    the case-cohort weight, outcome and end ages.
     """
-    logger.info(f"Preparing data before Cox fitting for {pair}")
-    prior, outcome = pair
+    logger.info(f"Setting-up the case-cohort design study for {outcome}")
+    n_persons = df_info.shape[0]
+    outcome_age = endpoint_ages(df_events, outcome, n_persons)
+    has_outcome = endpoint_members(bitmaps, outcome, n_persons)
 
     # Remove prevalent cases: outcome before study starts
     logger.debug("Removing prevalent cases")
-    prevalent = df_events.copy()
-    prevalent = prevalent.loc[df_events.ENDPOINT == outcome, ["FINNGENID", "AGE"]]
-    prevalent = prevalent.merge(df_info.loc[:, ["FINNGENID", "BIRTH_TYEAR"]], on="FINNGENID")
-    prevalent = set(prevalent.loc[prevalent.BIRTH_TYEAR + prevalent.AGE < STUDY_STARTS, "FINNGENID"])
-
-    df_events = df_events.loc[~ df_events.FINNGENID.isin(prevalent), :]
-    df_info = df_info.loc[~ df_info.FINNGENID.isin(prevalent), :]
+    prevalent = has_outcome & (df_info.BIRTH_TYEAR.to_numpy() + outcome_age < STUDY_STARTS)
 
     # Define groups for the case-cohort design study.
     # Naming follows Johansson-16 paper.
-    logger.debug("Setting-up the case-cohort design study")
-    cohort = set(df_events.FINNGENID)
-    cases = set(df_events.loc[df_events.ENDPOINT == outcome, "FINNGENID"])
-    size = min(N_SUBCOHORT, len(cohort))
-    cc_subcohort = set(np.random.choice(list(cohort), size, replace=False))
-    cc_m = len(cohort - cases)
-    cc_ms = len(cc_subcohort & (cohort - cases))
+    # The cohort is taken from the info data since df_events only has
+    # the endpoints needed for the current pairs.
+    cohort = ~ prevalent
+    cases = has_outcome & cohort
+    size = min(N_SUBCOHORT, cohort.sum())
+    cc_subcohort = np.zeros(n_persons, dtype=bool)
+    cc_subcohort[np.random.choice(np.flatnonzero(cohort), size, replace=False)] = True
+    cc_m = (cohort & ~ cases).sum()
+    cc_ms = (cc_subcohort & cohort & ~ cases).sum()
     cc_pm = cc_ms / cc_m
     cc_weight_non_cases = 1 / cc_pm
     cc_sample = cases | cc_subcohort
 
     # Reduce the original population to be the smaller "sample" pop from the case-cohort study
-    df_events = df_events.loc[df_events.FINNGENID.isin(cc_sample), :]
-    df_info = df_info.loc[df_info.FINNGENID.isin(cc_sample), :]
-
+    sample_cases = cases[cc_sample]
+    df_sample = df_info.loc[cc_sample, :].copy()
     # Assign case-cohort weight to each individual
-    df_weights = pd.DataFrame({"FINNGENID": list(cc_sample)})
-    df_weights["weight"] = 1.0
-    df_weights.loc[~ df_weights.FINNGENID.isin(cases), "weight"] = cc_weight_non_cases
-    df_info = df_info.merge(df_weights, on="FINNGENID")
+    df_sample["weight"] = np.where(sample_cases, 1.0, cc_weight_non_cases)
+    df_sample["OUTCOME_AGE"] = outcome_age[cc_sample]
+    # END_AGE
+    df_sample["END_AGE"] = pd.DataFrame({
+        "outcome": df_sample.OUTCOME_AGE,
+        "death": df_sample.DEATH_AGE,
+        "study_ends": STUDY_ENDS - df_sample.BIRTH_TYEAR,
+    }).min(axis="columns")
+
+    return cc_sample, sample_cases, df_sample
+
+
+def prep_coxhr(pair, case_cohort, df_events, bitmaps):
+    """Prepare the data to be used in the Cox model, for all the lags.
+
+    `case_cohort` is the output of prep_case_cohort() for the outcome of
+    the pair. The groups of persons are boolean arrays over the rows of
+    its sample, built from the endpoint bitmaps.
+
+    Only the phase-2 duration and outcome depend on the lag, they are
+    computed for each lag in the columns given by lag_cols().
+
+    Example timeline for an individual:
+
+    study starts   prior  outcome     study ends
+    |              |      |           |
+    |--------------=======XXXXXXXXXXXX|
+    [  unexposed  ][     exposed      ]
+    """
+    logger.info(f"Preparing data before Cox fitting for {pair}")
+    prior, outcome = pair
+    cc_sample, cases, df_sample = case_cohort
+    n_persons = cc_sample.shape[0]
+    has_prior = endpoint_members(bitmaps, prior, n_persons)[cc_sample]
+    df_sample = df_sample.copy()
+    df_sample["PRIOR_AGE"] = endpoint_ages(df_events, prior, n_persons)[cc_sample]
 
     # Individuals with prior: exclude those when prior age > outcome age
     logger.debug("Taking care of individuals with prior age > outcome age")
-    prior_age = df_events.loc[df_events.ENDPOINT == prior, ["FINNGENID", "AGE"]].rename(columns={"AGE": "prior"})
-    outcome_age = df_events.loc[df_events.ENDPOINT == outcome, ["FINNGENID", "AGE"]].rename(columns={"AGE": "outcome"})
-    ages = prior_age.merge(outcome_age, how="inner")  # keep those that have prior + outcome
-    exclude = set(ages.loc[ages.prior > ages.outcome, "FINNGENID"])
+    exclude = has_prior & cases & (df_sample.PRIOR_AGE > df_sample.OUTCOME_AGE).to_numpy()
 
     # Define groups for the unexposed/exposed study
     logger.debug("Setting-up unexposed/exposed")
-    with_prior = set(df_events.loc[df_events.ENDPOINT == prior, "FINNGENID"])
-    with_prior = with_prior - exclude
-    unexp             = cohort - with_prior - cases
-    unexp_outcome     = cases - with_prior
-    unexp_exp         = with_prior - cases
+    with_prior = has_prior & ~ exclude
+    unexp             = ~ with_prior & ~ cases
+    unexp_outcome     = cases & ~ with_prior
+    unexp_exp         = with_prior & ~ cases
     unexp_exp_outcome = with_prior & cases
-    assert len(cohort) == len(unexp) + len(unexp_outcome) + len(unexp_exp) + len(unexp_exp_outcome)
+    assert df_sample.shape[0] == unexp.sum() + unexp_outcome.sum() + unexp_exp.sum() + unexp_exp_outcome.sum()
 
     # Check that we have enough individuals to do the study
-    nindivs = len(unexp_exp_outcome)
+    nindivs = unexp_exp_outcome.sum()
     if nindivs < MIN_INDIVS:
         raise NotEnoughIndividuals(f"Not enough individuals having {prior} -> {outcome}: {nindivs} < {MIN_INDIVS}")
-    elif len(unexp_exp) < MIN_INDIVS:
-        raise NotEnoughIndividuals(f"Not enougth individuals in group: {prior} + no {outcome}, {len(unexp_exp)} < {MIN_INDIVS}")
-
-    # Build main DataFrame with necessary info (1 line = 1 individual)
-    logger.debug("Setting prior, outcome and end ages")
-    # PRIOR_AGE
-    df_prior = (
-        df_events.loc[df_events.ENDPOINT == prior, ["FINNGENID", "AGE"]]
-        .rename(columns={"AGE": "PRIOR_AGE"})
-    )
-    df_sample = df_info.merge(df_prior, on="FINNGENID", how="left")  # left join to keep individuals not having the endpoint
-    # OUTCOME_AGE
-    df_outcome = (
-        df_events.loc[df_events.ENDPOINT == outcome, ["FINNGENID", "AGE"]]
-        .rename(columns={"AGE": "OUTCOME_AGE"})
-    )
-    # END_AGE
-    df_sample = df_sample.merge(df_outcome, on="FINNGENID", how="left")
-    df_sample["END_AGE"] = pd.DataFrame({
-        "outcome": df_sample.OUTCOME_AGE,
-        "death": df_sample.DEATH_AGE,
-        "study_ends": STUDY_ENDS - df_sample.BIRTH_TYEAR,
-    }).min(axis="columns")
+    elif unexp_exp.sum() < MIN_INDIVS:
+        raise NotEnoughIndividuals(f"Not enougth individuals in group: {prior} + no {outcome}, {unexp_exp.sum()} < {MIN_INDIVS}")
 
     # Move endpoint to study start if it happened before the study
     exposed_before_study = df_sample.PRIOR_AGE < df_sample.START_AGE
@@ -421,19 +587,19 @@ def prep_coxhr(pair, lag, df_events, df_info):
 
     logger.info("Building timeline DataFrames with controls, unexposed, exposed")
     # Controls
-    df_unexp = df_sample.loc[df_sample.FINNGENID.isin(unexp), :].copy()
+    df_unexp = df_sample.loc[unexp, :].copy()
     df_unexp["duration"] = df_unexp.END_AGE - df_unexp.START_AGE
     df_unexp["prior"] = False
     df_unexp["outcome"] = False
 
     # Unexposed -> Outcome
-    df_unexp_outcome = df_sample.loc[df_sample.FINNGENID.isin(unexp_outcome), :].copy()
+    df_unexp_outcome = df_sample.loc[unexp_outcome, :].copy()
     df_unexp_outcome["duration"] = df_unexp_outcome.OUTCOME_AGE - df_unexp_outcome.START_AGE
     df_unexp_outcome["prior"] = False
     df_unexp_outcome["outcome"] = True
 
     # Unexposed -> Exposed: need time-window splitting
-    df_unexp_exp = df_sample.loc[df_sample.FINNGENID.isin(unexp_exp), :].copy()
+    df_unexp_exp = df_sample.loc[unexp_exp, :].copy()
     # Phase 1: unexposed
     df_unexp_exp_p1 = df_unexp_exp.copy()
     df_unexp_exp_p1["duration"] = df_unexp_exp_p1.PRIOR_AGE - df_unexp_exp_p1.START_AGE
@@ -442,24 +608,23 @@ def prep_coxhr(pair, lag, df_events, df_info):
     # Phase 2: exposed
     df_unexp_exp_p2 = df_unexp_exp.copy()
     df_unexp_exp_p2["prior"] = True
-    if lag is None:  # no lag HR
-        duration = df_unexp_exp_p2.END_AGE - df_unexp_exp_p2.PRIOR_AGE
-    else:
-        # Duration of exposure is time from exposure to "end" (death, study stop).
-        # This current cohort (unexposed->exposed) has no one with an
-        # outcome endpoint, so we don't need to do look ahead for an
-        # outcome in a given lag time-window.
-        # The lag is still used to cut the exposure time.
-        _min_lag, max_lag = lag
-        duration = df_unexp_exp_p2.apply(
-            lambda r: min(r.END_AGE - r.PRIOR_AGE, max_lag),
-            axis="columns"
-        )
-    df_unexp_exp_p2["duration"] = duration
-    df_unexp_exp_p2["outcome"] = False
+    for lag in LAGS:
+        cols = lag_cols(lag)
+        if lag is None:  # no lag HR
+            duration = df_unexp_exp_p2.END_AGE - df_unexp_exp_p2.PRIOR_AGE
+        else:
+            # Duration of exposure is time from exposure to "end" (death, study stop).
+            # This current cohort (unexposed->exposed) has no one with an
+            # outcome endpoint, so we don't need to do look ahead for an
+            # outcome in a given lag time-window.
+            # The lag is still used to cut the exposure time.
+            _min_lag, max_lag = lag
+            duration = (df_unexp_exp_p2.END_AGE - df_unexp_exp_p2.PRIOR_AGE).clip(upper=max_lag)
+        df_unexp_exp_p2[cols["duration"]] = duration
+        df_unexp_exp_p2[cols["outcome"]] = False
 
     # Unexposed -> Exposed -> Outcome: need time-window splitting
-    df_tri = df_sample.loc[df_sample.FINNGENID.isin(unexp_exp_outcome), :].copy()
+    df_tri = df_sample.loc[unexp_exp_outcome, :].copy()
     # Phase 1: unexposed
     df_tri_p1 = df_tri.copy()
     df_tri_p1["duration"] = df_tri_p1.PRIOR_AGE - df_tri_p1.START_AGE
@@ -468,21 +633,20 @@ def prep_coxhr(pair, lag, df_events, df_info):
     # Phase 2: exposed
     df_tri_p2 = df_tri.copy()
     df_tri_p2["prior"] = True
-    if lag is None:
-        duration = df_tri_p2.END_AGE - df_tri.PRIOR_AGE
-        outcome = True
-    else:
-        min_lag, max_lag = lag
-        # Duration is time from exposure endpoint to end event, no
-        # matter of the lag time-window.
-        duration = df_tri_p2.apply(
-            lambda r: min(r.END_AGE - r.PRIOR_AGE, max_lag),
-            axis="columns"
-        )
-        outcome_time = df_tri_p2.OUTCOME_AGE - df_tri_p2.PRIOR_AGE
-        outcome = (outcome_time >= min_lag) & (outcome_time <= max_lag)
-    df_tri_p2["duration"] = duration
-    df_tri_p2["outcome"] = outcome
+    for lag in LAGS:
+        cols = lag_cols(lag)
+        if lag is None:
+            duration = df_tri_p2.END_AGE - df_tri.PRIOR_AGE
+            outcome = True
+        else:
+            min_lag, max_lag = lag
+            # Duration is time from exposure endpoint to end event, no
+            # matter of the lag time-window.
+            duration = (df_tri_p2.END_AGE - df_tri_p2.PRIOR_AGE).clip(upper=max_lag)
+            outcome_time = df_tri_p2.OUTCOME_AGE - df_tri_p2.PRIOR_AGE
+            outcome = (outcome_time >= min_lag) & (outcome_time <= max_lag)
+        df_tri_p2[cols["duration"]] = duration
+        df_tri_p2[cols["outcome"]] = outcome
 
     return (
         df_unexp,
@@ -494,9 +658,30 @@ def prep_coxhr(pair, lag, df_events, df_info):
     )
 
 
-def prep_lifelines(df_unexp, df_unexp_death, df_unexp_exp_p1, df_unexp_exp_p2, df_tri_p1, df_tri_p2):
+def lag_cols(lag):
+    """Column names of the phase-2 duration and outcome for a lag"""
+    if lag is None:
+        return {"duration": "duration", "outcome": "outcome"}
+    _min_lag, max_lag = lag
+    return {"duration": f"duration_{max_lag}y", "outcome": f"outcome_{max_lag}y"}
+
+
+def prep_lifelines(cols, df_unexp, df_unexp_death, df_unexp_exp_p1, df_unexp_exp_p2, df_tri_p1, df_tri_p2):
     logger.info("Preparing lifelines dataframes")
 
+    # Rename lagged HR columns
+    col_duration = cols["duration"]
+    col_outcome = cols["outcome"]
+    keep_cols_p2 = [col_duration, "prior", "BIRTH_TYEAR", "female", col_outcome, "weight"]
+    df_unexp_exp_p2 = (
+        df_unexp_exp_p2.loc[:, keep_cols_p2]
+        .rename(columns={col_duration: "duration", col_outcome: "outcome"})
+    )
+    df_tri_p2 = (
+        df_tri_p2.loc[:, keep_cols_p2]
+        .rename(columns={col_duration: "duration", col_outcome: "outcome"})
+    )
+
     # Re-check that there are enough individuals to do the study,
     # since after setting the lag some individuals might not have the
     # death outcome anymore.
@@ -510,41 +695,48 @@ def prep_lifelines(df_unexp, df_unexp_death, df_unexp_exp_p1, df_unexp_exp_p2, d
         df_unexp.loc[:, keep_cols],
         df_unexp_death.loc[:, keep_cols],
         df_unexp_exp_p1.loc[:, keep_cols],
-        df_unexp_exp_p2.loc[:, keep_cols],
+        df_unexp_exp_p2,
         df_tri_p1.loc[:, keep_cols],
-        df_tri_p2.loc[:, keep_cols]],
+        df_tri_p2],
         ignore_index=True)
 
     return nindivs, df_lifelines
 
 
-def compute_coxhr(pair, df, lag, step_size, is_sex_specific, nindivs, res_writer):
+def compute_coxhr(pair, df, lag, step_size, init, is_sex_specific, nindivs):
+    """Fit the Cox model, starting from the coefficients `init` if given.
+
+    Return the fitted coefficients and the result row.
+    """
     logger.info(f"Running Cox regression")
     prior, outcome = pair
     # Handle sex-specific endpoints
+    covariates = ["prior", "BIRTH_TYEAR", "female"]
     if is_sex_specific:
-        df = df.drop(columns=["female"])
+        covariates.remove("female")
 
     # Fit Cox model
-    cph = CoxPHFitter()
-    cph.fit(
-        df,
-        duration_col="duration",
-        event_col="outcome",
-        step_size=step_size,
+    cph = fit_coxph(
+        df.duration.values,
+        df.outcome.values,
+        df.loc[:, covariates].values,
         # For the case-cohort study we need weights and robust errors:
-        weights_col="weight",
+        weights=df.weight.values,
+        covariates=covariates,
+        step_size=step_size,
+        init=init,
         robust=True
     )
+    logger.debug(f"Cox model fitted in {cph.n_iterations} iterations")
+    summary = coxph_summary(cph)
+    norm_mean = pd.Series(cph.norm_mean, index=cph.covariates)
 
     # Compute absolute risk
-    mean_indiv = pd.DataFrame({
-        "BIRTH_TYEAR": [MEAN_INDIV_BIRTH_YEAR],
-        "prior": [MEAN_INDIV_HAS_PRIOR_ENDPOINT],
-        "female": [MEAN_INDIV_FEMALE_RATIO]
-    })
-    if is_sex_specific:
-        mean_indiv.pop("female")
+    mean_indiv = {
+        "prior": MEAN_INDIV_HAS_PRIOR_ENDPOINT,
+        "BIRTH_TYEAR": MEAN_INDIV_BIRTH_YEAR,
+        "female": MEAN_INDIV_FEMALE_RATIO
+    }
 
     if lag is None:
         predict_at = STUDY_ENDS - STUDY_STARTS
@@ -554,40 +746,40 @@ def compute_coxhr(pair, df, lag, step_size, is_sex_specific, nindivs, res_writer
         predict_at = max_lag
         lag_value = max_lag
 
-    surv_probability = cph.predict_survival_function(
-        mean_indiv,
+    surv_probability = predict_survival(
+        cph,
+        [mean_indiv[covariate] for covariate in covariates],
         times=[predict_at]
-    ).values[0][0]
+    )[0]
     absolute_risk = 1 - surv_probability
 
     # Get values out of the fitted model
-    norm_mean = cph._norm_mean
-    prior_coef = cph.params_["prior"]
-    prior_se = cph.standard_errors_["prior"]
+    prior_coef = summary.coef["prior"]
+    prior_se = summary["se(coef)"]["prior"]
     prior_hr = np.exp(prior_coef)
     prior_ci_lower = np.exp(prior_coef - 1.96 * prior_se)
     prior_ci_upper = np.exp(prior_coef + 1.96 * prior_se)
-    prior_pval = cph.summary.p["prior"]
-    prior_zval = cph.summary.z["prior"]
+    prior_pval = summary.p["prior"]
+    prior_zval = summary.z["prior"]
     prior_norm_mean = norm_mean["prior"]
 
-    year_coef = cph.params_["BIRTH_TYEAR"]
-    year_se = cph.standard_errors_["BIRTH_TYEAR"]
+    year_coef = summary.coef["BIRTH_TYEAR"]
+    year_se = summary["se(coef)"]["BIRTH_TYEAR"]
     year_hr = np.exp(year_coef)
     year_ci_lower = np.exp(year_coef - 1.96 * year_se)
     year_ci_upper = np.exp(year_coef + 1.96 * year_se)
-    year_pval = cph.summary.p["BIRTH_TYEAR"]
-    year_zval = cph.summary.z["BIRTH_TYEAR"]
+    year_pval = summary.p["BIRTH_TYEAR"]
+    year_zval = summary.z["BIRTH_TYEAR"]
     year_norm_mean = norm_mean["BIRTH_TYEAR"]
 
     if not is_sex_specific:
-        sex_coef = cph.params_["female"]
-        sex_se = cph.standard_errors_["female"]
+        sex_coef = summary.coef["female"]
+        sex_se = summary["se(coef)"]["female"]
         sex_hr = np.exp(sex_coef)
         sex_ci_lower = np.exp(sex_coef - 1.96 * sex_se)
         sex_ci_upper = np.exp(sex_coef + 1.96 * sex_se)
-        sex_pval = cph.summary.p["female"]
-        sex_zval = cph.summary.z["female"]
+        sex_pval = summary.p["female"]
+        sex_zval = summary.z["female"]
         sex_norm_mean = norm_mean["female"]
     else:
         sex_coef = np.nan
@@ -600,16 +792,11 @@ def compute_coxhr(pair, df, lag, step_size, is_sex_specific, nindivs, res_writer
         sex_norm_mean = np.nan
 
     # Save the baseline cumulative hazard (bch)
-    df_bch = cph.baseline_cumulative_hazard_
-
-    baseline_cumulative_hazard = bch_at(df_bch, predict_at)
-
-    bch_values = {}
-    for time in BCH_TIMEPOINTS:
-        bch_values[time] = bch_at(df_bch, time)
+    baseline_cumulative_hazard = cumulative_hazard_at(cph, predict_at)
+    bch_values = dict(zip(BCH_TIMEPOINTS, cumulative_hazard_at(cph, BCH_TIMEPOINTS)))
 
     # Save values
-    res_writer.writerow([
+    res_row = [
         prior,
         outcome,
         lag_value,
@@ -651,16 +838,9 @@ def compute_coxhr(pair, df, lag, step_size, is_sex_specific, nindivs, res_writer
         bch_values[17.5],
         bch_values[20],
         bch_values[21.99]
-    ])
-
+    ]
 
-def bch_at(df, time):
-    try:
-        res = df.loc[time, "baseline cumulative hazard"]
-    except KeyError:
-        # Index of the BCH dataframe are floats, which may not be exact values, so we check for the closest one
-        res = interpolate_at_times(df, [time])[0]
-    return res
+    return cph.params, res_row
 
 
 if __name__ == '__main__':
@@ -670,6 +850,7 @@ if __name__ == '__main__':
     INPUT_INFO = Path(getenv("INPUT_INFO"))
     OUTPUT = Path(getenv("OUTPUT"))
     TIMINGS = Path(getenv("TIMINGS"))
+    WORKERS = int(getenv("WORKERS", 1))
 
     main(
         INPUT_PAIRS,
@@ -677,5 +858,6 @@ if __name__ == '__main__':
         INPUT_LONG_FORMAT_FEVENTS,
         INPUT_INFO,
         OUTPUT,
-        TIMINGS
+        TIMINGS,
+        WORKERS
     )
@@ -0,0 +1,291 @@
+"""Split the endpoint pairs into shards of balanced predicted runtime.
+
+Usage
+-----
+See 'python surv_plan_shards.py --help'
+
+Input files
+-----------
+- pairs
+  Each row is an exposure-outcome endpoint pair.
+  Format: CSV
+  Source: surv_select_endpoint_pairs.py
+- timings (optional)
+  TIMINGS files of previous surv_analysis.py runs, each row is the
+  time spent on one lag of an endpoint pair.
+  Format: CSV
+  Source: surv_analysis.py
+- long-format-fevents (optional)
+  The long-format first-event phenotype file, or partitioned dataset
+  directory.
+  Source: previous pipeline step
+
+Output
+------
+One CSV file per shard in the output directory, with the same header
+as the input pairs.
+
+With --write-fevents, also one Parquet file per shard with the first
+events of only the endpoints of the shard and DEATH, and only the
+columns read by surv_analysis.py. Each survAnalysis job then
+downloads and parses this file instead of the full first events. The
+endpoints are listed in the "risteys_endpoints" key of the Parquet
+schema metadata, so surv_analysis.py can check that the file matches
+its pairs.
+
+Description
+-----------
+The runtime of surv_analysis.py on a pair varies by orders of
+magnitude, mostly with the number of individuals in the Cox model.
+Splitting the pairs in fixed-size batches leaves a few shards running
+for hours while most finish quickly.
+
+The cost of a pair is its total time in the TIMINGS files (averaged
+across the files it appears in). Pairs without timings get a cost
+predicted from the case counts of their endpoints: the Cox model of a
+pair is fitted on the outcome cases, the case-cohort subcohort and the
+prior cases. This prediction is scaled to seconds on the pairs that
+have both. Without timings nor case counts, all pairs have the same
+cost.
+
+The pairs of an outcome are kept together, since surv_analysis.py
+sets up the case-cohort study of an outcome once for all its pairs.
+Only the outcomes costing more than the average shard are split, in
+parts of at most the average shard cost. The outcomes, or parts of
+outcomes, are then assigned, from the most to the least costly, to the
+shard with the lowest total cost so far (longest processing time
+first).
+"""
+import argparse
+import csv
+import heapq
+import json
+import logging
+from os import getenv
+from pathlib import Path
+
+import pandas as pd
+import pyarrow
+import pyarrow.compute
+import pyarrow.parquet as parquet
+
+# TODO #
+# Copy-pasted the logging configuration here instead of importing it
+# from log.py, as in surv_analysis.py, since this script is also run
+# outside of the risteys_pipeline package.
+level = getenv("LOG_LEVEL", logging.INFO)
+logger = logging.getLogger("pipeline")
+handler = logging.StreamHandler()
+formatter = logging.Formatter(
+    "%(asctime)s %(levelname)-8s %(module)-21s %(funcName)-25s: %(message)s")
+
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+logger.setLevel(level)
+# END #
+
+
+# Size of the case-cohort subcohort, same as in surv_analysis.py
+N_SUBCOHORT = 10_000
+
+# Columns of the first events read by surv_analysis.py
+FEVENTS_COLUMNS = ["FINNGENID", "ENDPOINT", "AGE"]
+
+
+def main():
+    args = cli_parser()
+
+    header, pairs = load_pairs(args.pairs)
+    timed_costs = load_timings(args.timings)
+    case_counts = load_case_counts(args.long_format_fevents)
+    costs = pair_costs(pairs, timed_costs, case_counts)
+
+    shards, loads = plan_shards(pairs, costs, args.n_shards)
+    if loads:
+        logger.info(f"Predicted shard cost: min {min(loads):.1f}, max {max(loads):.1f}, mean {sum(loads) / len(loads):.1f}")
+    write_shards(args.output, header, shards)
+
+    if args.write_fevents:
+        write_shard_fevents(args.long_format_fevents, args.output, shards)
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-p', '--pairs',
+        help='path to the endpoint pairs (CSV)',
+        type=Path,
+        required=True
+    )
+
+    parser.add_argument(
+        '-t', '--timings',
+        help='paths to TIMINGS files of previous surv_analysis.py runs (CSV)',
+        type=Path,
+        nargs='*',
+        default=[]
+    )
+
+    parser.add_argument(
+        '-f', '--long-format-fevents',
+        help='path to the long-format first events (Parquet), for the pairs without timings and --write-fevents',
+        type=Path
+    )
+
+    parser.add_argument(
+        '--write-fevents',
+        help='write the first events of the endpoints of each shard, requires --long-format-fevents',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '-n', '--n-shards',
+        help='number of shards',
+        type=int,
+        required=True
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        help='path to output directory for the shards of endpoint pairs (CSV)',
+        type=Path,
+        required=True
+    )
+
+    args = parser.parse_args()
+    if args.n_shards < 1:
+        parser.error('--n-shards must be at least 1')
+    if args.write_fevents and args.long_format_fevents is None:
+        parser.error('--write-fevents requires --long-format-fevents')
+    return args
+
+
+def load_pairs(filepath):
+    """Load the endpoint pairs, and the header of the pairs file"""
+    with open(filepath) as ff:
+        reader = csv.reader(ff)
+        header = next(reader)
+        pairs = [(prior, outcome) for prior, outcome in reader]
+    return header, pairs
+
+
+def load_timings(filepaths):
+    """Get the time spent on each pair, averaged across the TIMINGS files"""
+    runs = []
+    for filepath in filepaths:
+        timings = pd.read_csv(filepath, usecols=["prior", "outcome", "time_seconds"])
+        runs.append(timings.groupby(["prior", "outcome"]).time_seconds.sum())
+
+    if not runs:
+        return {}
+    costs = pd.concat(runs).groupby(level=["prior", "outcome"]).mean()
+    return costs.to_dict()
+
+
+def load_case_counts(filepath):
+    """Get the number of individuals having each endpoint"""
+    if filepath is None:
+        return {}
+    df_events = pd.read_parquet(filepath, columns=["ENDPOINT"])
+    return df_events.ENDPOINT.value_counts().to_dict()
+
+
+def pair_costs(pairs, timed_costs, case_counts):
+    """Get the cost of each pair, from its timings or predicted from case counts"""
+    def predicted(pair):
+        prior, outcome = pair
+        return case_counts.get(outcome, 0) + N_SUBCOHORT + case_counts.get(prior, 0)
+
+    if not case_counts:
+        default = pd.Series(timed_costs, dtype=float).median() if timed_costs else 1.0
+        return [timed_costs.get(pair, default) for pair in pairs]
+
+    # Seconds per predicted unit, on the pairs having timings
+    timed = [pair for pair in pairs if pair in timed_costs]
+    if timed:
+        scale = sum(timed_costs[pair] for pair in timed) / sum(predicted(pair) for pair in timed)
+    else:
+        scale = 1.0
+
+    return [timed_costs[pair] if pair in timed_costs else scale * predicted(pair) for pair in pairs]
+
+
+def plan_shards(pairs, costs, n_shards):
+    """Assign the pairs to shards, balancing the total cost of the shards.
+
+    The pairs of an outcome are assigned together, unless they cost more
+    than the average shard, see the module description.
+
+    Return a list of shards, each shard being a list of pairs, and the
+    list of the total cost of each shard. Empty shards are dropped.
+    """
+    outcomes = {}
+    for pair, cost in zip(pairs, costs):
+        _prior, outcome = pair
+        outcomes.setdefault(outcome, []).append((pair, cost))
+
+    # Split the outcomes into units of at most the average shard cost,
+    # an outcome costing less than that is a single unit.
+    mean_load = sum(costs) / n_shards
+    units = []  # (cost, pairs)
+    for outcome_pairs in outcomes.values():
+        unit_cost, unit_pairs = 0.0, []
+        for pair, cost in outcome_pairs:
+            if unit_pairs and unit_cost + cost > mean_load:
+                units.append((unit_cost, unit_pairs))
+                unit_cost, unit_pairs = 0.0, []
+            unit_cost += cost
+            unit_pairs.append(pair)
+        units.append((unit_cost, unit_pairs))
+
+    shards = [[] for _ in range(n_shards)]
+    loads = [(0.0, shard_idx) for shard_idx in range(n_shards)]  # (total cost, shard) heap
+
+    for unit_cost, unit_pairs in sorted(units, key=lambda unit: unit[0], reverse=True):
+        load, shard_idx = heapq.heappop(loads)
+        shards[shard_idx].extend(unit_pairs)
+        heapq.heappush(loads, (load + unit_cost, shard_idx))
+
+    shard_loads = {shard_idx: load for load, shard_idx in loads}
+    kept = [shard_idx for shard_idx, shard in enumerate(shards) if shard]
+    return [shards[shard_idx] for shard_idx in kept], [shard_loads[shard_idx] for shard_idx in kept]
+
+
+def write_shards(dirpath, header, shards):
+    """Write each shard of endpoint pairs to a CSV file"""
+    dirpath.mkdir(parents=True, exist_ok=True)
+    for shard_idx, shard in enumerate(shards):
+        with open(dirpath / f"shard_{shard_idx:04d}.csv", 'w') as ff:
+            writer = csv.writer(ff)
+            writer.writerow(header)
+            writer.writerows(shard)
+
+
+def write_shard_fevents(filepath, dirpath, shards):
+    """Write the first events of the endpoints of each shard, and DEATH, to a Parquet file"""
+    shard_endpoints = [
+        sorted({endpoint for pair in shard for endpoint in pair} | {"DEATH"})
+        for shard in shards
+    ]
+    # The first events are read once, the endpoint filter is pushed down
+    # to the Parquet reader.
+    all_endpoints = sorted(set().union(*shard_endpoints))
+    table = parquet.read_table(
+        filepath,
+        columns=FEVENTS_COLUMNS,
+        filters=[("ENDPOINT", "in", all_endpoints)]
+    )
+
+    for shard_idx, endpoints in enumerate(shard_endpoints):
+        shard_table = table.filter(pyarrow.compute.is_in(table.column("ENDPOINT"), pyarrow.array(endpoints)))
+        metadata = dict(shard_table.schema.metadata or {})
+        metadata[b"risteys_endpoints"] = json.dumps(endpoints).encode()
+        parquet.write_table(
+            shard_table.replace_schema_metadata(metadata),
+            dirpath / f"shard_{shard_idx:04d}.parquet"
+        )
+
+
+if __name__ == '__main__':
+    main()
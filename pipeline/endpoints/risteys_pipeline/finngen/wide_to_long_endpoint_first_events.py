@@ -28,14 +28,43 @@ Output
 Outputs a Parquet file in long format with all control information discarded.
 - Long format first events
   Parquet format
-  . columns: individual FinnGen ID, endpoint, age, day, number of events
+  . columns: individual FinnGen ID, endpoint, age, day, number of events,
+    and the event year if the input has the <ENDPOINT>_YEAR columns
   . rows: one row per event, so all the events from the same individual span multiple rows
+
+With --partition-by endpoint, the output is instead a hive-partitioned
+Parquet dataset directory, partitioned by ENDPOINT with one file per
+endpoint, so readers filtering on ENDPOINT only read the partitions they
+need.
+
+The rows of the input file are split into byte ranges of about 128 MB
+aligned on line ends, which are converted one at a time, or in parallel
+by worker processes with --jobs, and then merged in the input order.
+The memory used is mostly that of the converted ranges, up to 2 * jobs
+of them at once.
+
+The single output file is streamed to disk in row groups of
+--row-group-size rows. The partitioned output is written in two passes:
+each converted range is sorted by endpoint and spilled to a temporary
+file next to the output, then the partitions are written from these
+files a group of endpoints at a time, each group having about
+--row-group-size rows (or the rows of a single larger endpoint). The
+spilled files take about as much disk space as the output.
 """
 
 import argparse
+import math
+from collections import Counter, deque
+from functools import partial
+from multiprocessing import get_context
 from pathlib import Path
+from tempfile import TemporaryDirectory
 
+import numpy as np
 import pyarrow
+import pyarrow.compute
+import pyarrow.csv
+import pyarrow.dataset
 import pyarrow.parquet as parquet
 
 
@@ -55,6 +84,25 @@ OUT_HEADER = [
     "APPROX_EVENT_DAY",
     "NEVT"
 ]
+# Optional output column, only if the input has the <ENDPOINT>_YEAR columns
+OUT_YEAR = "YEAR"
+
+# Output partitioning
+PARTITION_ENDPOINT = "endpoint"
+
+# Approximate size in bytes of the input chunks converted at once
+CHUNK_SIZE = 128 * 1024 * 1024
+
+# Number of rows per row group of the output
+DEFAULT_ROW_GROUP_SIZE = 1_000_000
+
+# Number of rows per row group of the temporary files of the partitioned
+# output, small so that reading back a group of endpoints skips most of them
+SPILL_ROW_GROUP_SIZE = 64 * 1024
+
+# Maximum number of partitions written at once, below the usual limit of
+# 1024 file descriptors per process
+MAX_OPEN_FILES = 512
 
 
 def cli_parser():
@@ -67,93 +115,348 @@ def cli_parser():
     )
     parser.add_argument(
         "-o", "--output",
-        help="path to output long-format file (Parquet)",
+        help="path to output long-format file (Parquet), or output directory when partitioning",
         required=True,
         type=Path
     )
+    parser.add_argument(
+        "-p", "--partition-by",
+        help="write a hive-partitioned Parquet dataset, partitioned by ENDPOINT",
+        required=False,
+        choices=[PARTITION_ENDPOINT]
+    )
     parser.add_argument(
         "-k", "--keep-all",
         help="keep all of controls, excluded controls, and cases, instead of keeping only the cases",
         required=False,
         action="store_true"
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        help="number of worker processes converting the input file in parallel (default: 1)",
+        required=False,
+        default=1,
+        type=int
+    )
+    parser.add_argument(
+        "-r", "--row-group-size",
+        help=f"number of rows per row group of the output, and about the number of rows of each group of partitions written at once (default: {DEFAULT_ROW_GROUP_SIZE})",
+        required=False,
+        default=DEFAULT_ROW_GROUP_SIZE,
+        type=int
+    )
     args = parser.parse_args()
     return args
 
 
 def main():
     args = cli_parser()
+    wide_to_long(
+        args.input_first_events,
+        args.output,
+        partition_by=args.partition_by,
+        keep_all=args.keep_all,
+        jobs=args.jobs,
+        row_group_size=args.row_group_size
+    )
 
-    in_file = open(args.input_first_events)
 
-    # Read the header to build a lookup table for column -> column index
-    in_header = {}
-    for idx, col in enumerate(
-            in_file.readline()
-            .rstrip("\n")
-            .split(",")):
-        in_header[col] = idx
+def wide_to_long(
+        input_first_events,
+        output,
+        partition_by=None,
+        keep_all=False,
+        jobs=1,
+        row_group_size=DEFAULT_ROW_GROUP_SIZE
+):
+    """Convert the wide-format first-event file to a long-format Parquet file or dataset"""
+    # Read the header to find the endpoint columns
+    with open(input_first_events, "rb") as in_file:
+        header_line = in_file.readline()
+    in_header = header_line.decode().rstrip("\n").split(",")
+    in_columns = set(in_header)
 
     # Find endpoint columns
     endpoints = list(filter(
-        lambda c: c + "_FU_AGE" in in_header and c + "_APPROX_EVENT_DAY" in in_header and c + "_NEVT" in in_header,
+        lambda c: c + "_FU_AGE" in in_columns and c + "_APPROX_EVENT_DAY" in in_columns and c + "_NEVT" in in_columns,
         in_header))
 
-    # Initialize arrays that will be used to make the Parquet output file
-    fgid_values = []
-    endpoint_values = []
+    # The event year is only in some versions of the first-event file
+    has_year = all(endp + "_YEAR" in in_columns for endp in endpoints)
+
+    # Each byte range of rows is converted on its own, so that only one
+    # chunk of the wide file is parsed in memory at once per process.
+    ranges = byte_ranges(
+        input_first_events,
+        len(header_line),
+        max(jobs, math.ceil(input_first_events.stat().st_size / CHUNK_SIZE))
+    )
+    convert = partial(
+        convert_range,
+        input_first_events,
+        in_header,
+        endpoints,
+        has_year,
+        keep_all
+    )
+    out_schema = output_schema(has_year)
+    if jobs > 1:
+        with get_context("spawn").Pool(jobs) as pool:
+            tables = imap_bounded(pool, convert, ranges, 2 * jobs)
+            write_output(tables, out_schema, output, partition_by, row_group_size)
+    else:
+        tables = (convert(byte_range) for byte_range in ranges)
+        write_output(tables, out_schema, output, partition_by, row_group_size)
+
+
+def imap_bounded(pool, func, items, max_pending):
+    """Like pool.imap(), but with at most `max_pending` items in flight
+
+    pool.imap() submits all the items at once and keeps the results
+    until they are consumed, so the converted tables would pile up in
+    memory when the writing is slower than the conversion. The results
+    are yielded in the order of the items, so the output rows are in the
+    input order.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) == max_pending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def output_schema(has_year):
+    """Get the schema of the output file"""
+    out_types = [
+        pyarrow.string(),   # FINNGENID
+        pyarrow.string(),   # ENDPOINT
+        pyarrow.int64(),    # CONTROL_CASE_EXCL
+        pyarrow.float64(),  # AGE
+        pyarrow.string(),   # APPROX_EVENT_DAY
+        pyarrow.int64(),    # NEVT
+    ]
+    schema = pyarrow.schema(list(zip(OUT_HEADER, out_types)))
+    if has_year:
+        schema = schema.append(pyarrow.field(OUT_YEAR, pyarrow.float64()))
+    return schema
+
+
+def byte_ranges(path, start, n_ranges):
+    """Split a file from byte `start` into about `n_ranges` byte ranges aligned on line ends"""
+    size = path.stat().st_size
+    boundaries = [start]
+    with open(path, "rb") as in_file:
+        for ii in range(1, n_ranges):
+            pos = start + ii * (size - start) // n_ranges
+            if pos <= boundaries[-1]:
+                continue
+            # Move to the start of the next line, unless `pos` is already at a line start
+            in_file.seek(pos - 1)
+            in_file.readline()
+            boundary = in_file.tell()
+            if boundaries[-1] < boundary < size:
+                boundaries.append(boundary)
+    boundaries.append(size)
+
+    return [(beg, end) for beg, end in zip(boundaries[:-1], boundaries[1:]) if beg < end]
+
+
+def convert_range(path, in_header, endpoints, has_year, keep_all, byte_range):
+    """Convert the rows in a byte range of the wide-format file to a long-format table"""
+    beg, end = byte_range
+    with open(path, "rb") as in_file:
+        in_file.seek(beg)
+        data = in_file.read(end - beg)
+
+    fgid_col = in_header[0]
+    suffixes = ["", "_FU_AGE", "_APPROX_EVENT_DAY", "_NEVT"]
+    if has_year:
+        suffixes.append("_YEAR")
+    columns = [fgid_col] + [endp + suffix for endp in endpoints for suffix in suffixes]
+
+    # Read all values as strings, so that "NA" and "" are kept as-is
+    table = pyarrow.csv.read_csv(
+        pyarrow.py_buffer(data),
+        read_options=pyarrow.csv.ReadOptions(column_names=in_header),
+        convert_options=pyarrow.csv.ConvertOptions(
+            include_columns=columns,
+            column_types={col: pyarrow.string() for col in columns},
+            strings_can_be_null=False,
+            quoted_strings_can_be_null=False
+        )
+    )
+    columns = {col: table.column(col).combine_chunks() for col in columns}
+    fgids = columns[fgid_col]
+
+    row_indices = []
+    endpoint_indices = []
     kind_values = []
     age_values = []
     day_values = []
     nevt_values = []
+    year_values = []
+    for endp_idx, endp in enumerate(endpoints):
+        values = columns[endp]
+        is_control = pyarrow.compute.equal(values, CONTROL).to_numpy(zero_copy_only=False)
+        is_case = pyarrow.compute.equal(values, CASE).to_numpy(zero_copy_only=False)
+        is_excl = pyarrow.compute.equal(values, EXCL_CONTROL).to_numpy(zero_copy_only=False)
+
+        # Check if case, control or excluded control
+        unexpected = ~(is_control | is_case | is_excl)
+        if unexpected.any():
+            row = np.flatnonzero(unexpected)[0]
+            val_endp = values[row].as_py()
+            val_fgid = fgids[row].as_py()
+            raise ValueError(f"Unexpected value `{val_endp}` for `{val_fgid}` with endpoint `{endp}` .")
+
+        # Get the event info
+        rows = np.arange(table.num_rows) if keep_all else np.flatnonzero(is_case)
+        row_indices.append(rows)
+        endpoint_indices.append(np.full(rows.shape[0], endp_idx, dtype=np.int32))
+        kind_values.append(np.where(is_excl, 2, is_case.astype(np.int64))[rows])
+        age_values.append(columns[endp + "_FU_AGE"].take(rows))
+        day_values.append(columns[endp + "_APPROX_EVENT_DAY"].take(rows))
+        nevt_values.append(columns[endp + "_NEVT"].take(rows))
+        if has_year:
+            year_values.append(columns[endp + "_YEAR"].take(rows))
 
-    # Get the endpoint data for each individual
-    for row in in_file:
-        records = row.rstrip("\n").split(",")
-
-        for endp in endpoints:
-            col = in_header[endp]
-            val_endp = records[col]
-            val_fgid = records[0]
-
-            # Check if case, control or excluded control
-            if val_endp not in (CONTROL, CASE, EXCL_CONTROL):
-                raise ValueError(f"Unexpected value `{val_endp}` for `{val_fgid}` with endpoint `{endp}` .")
-            elif val_endp == EXCL_CONTROL:
-                kind = "2"
-            else:
-                kind = val_endp
-
-            # Get the event info
-            if args.keep_all or kind == CASE:
-                col_age = in_header[endp + "_FU_AGE"]
-                col_day = in_header[endp + "_APPROX_EVENT_DAY"]
-                col_nevt = in_header[endp + "_NEVT"]
-                val_age = records[col_age]
-                val_day = records[col_day]
-                val_nevt = records[col_nevt]
-
-                fgid_values.append(val_fgid)
-                endpoint_values.append(endp)
-                kind_values.append(int(kind))
-                age_values.append(float(val_age))
-                day_values.append(val_day)
-                nevt_values.append(int(val_nevt))
-
-    in_file.close()
+    # Order the rows by individual then by endpoint, as in the input file
+    row_indices = np.concatenate(row_indices) if row_indices else np.array([], dtype=np.int64)
+    endpoint_indices = np.concatenate(endpoint_indices) if endpoint_indices else np.array([], dtype=np.int32)
+    order = np.lexsort((endpoint_indices, row_indices))
 
+    def ordered(chunks, value_type):
+        return pyarrow.chunked_array(chunks, type=value_type).combine_chunks().take(order)
+
+    # FINNGENID and ENDPOINT are dictionary-encoded until written, so the
+    # tables sent back by the worker processes don't repeat their strings.
     out_table = pyarrow.table(
         [
-            fgid_values,
-            endpoint_values,
-            kind_values,
-            age_values,
-            day_values,
-            nevt_values,
+            pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array(row_indices[order], type=pyarrow.int32()),
+                fgids
+            ),
+            pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array(endpoint_indices[order], type=pyarrow.int32()),
+                pyarrow.array(endpoints, type=pyarrow.string())
+            ),
+            ordered([pyarrow.array(kind) for kind in kind_values], pyarrow.int64()),
+            ordered(age_values, pyarrow.string()).cast(pyarrow.float64()),
+            ordered(day_values, pyarrow.string()),
+            ordered(nevt_values, pyarrow.string()).cast(pyarrow.int64()),
         ],
         names=OUT_HEADER
     )
-    parquet.write_table(out_table, args.output)
+    if has_year:
+        years = ordered(year_values, pyarrow.string())
+        # The year of controls is either empty or NA
+        years = pyarrow.compute.if_else(
+            pyarrow.compute.is_in(years, pyarrow.array(["", "NA"])),
+            pyarrow.scalar(None, pyarrow.string()),
+            years
+        )
+        out_table = out_table.append_column(OUT_YEAR, years.cast(pyarrow.float64()))
+
+    return out_table
+
+
+def write_output(tables, out_schema, output, partition_by, row_group_size):
+    """Stream the long-format tables to a Parquet file or a partitioned Parquet dataset"""
+    if partition_by is not None:
+        write_partitions(tables, out_schema, output, row_group_size)
+        return
+
+    with parquet.ParquetWriter(output, out_schema) as writer:
+        for row_group in iter_row_groups(tables, out_schema, row_group_size):
+            writer.write_table(row_group, row_group_size=row_group_size)
+
+
+def write_partitions(tables, out_schema, output, row_group_size):
+    """Write the long-format tables to a Parquet dataset partitioned by ENDPOINT, one file per partition
+
+    The rows come ordered by individual, then by endpoint, so writing
+    them as they come keeps every partition open until the end, and
+    write_dataset() closes and reopens partition files once there are
+    more than MAX_OPEN_FILES endpoints, leaving many small files per
+    partition. Instead, each table is sorted by endpoint and spilled to
+    a temporary file, and each group of endpoints is then read back from
+    all these files and written at once.
+    """
+    output.mkdir(parents=True, exist_ok=True)
+    with TemporaryDirectory(dir=output.parent, prefix=f".{output.name}-") as spill_dir:
+        spill_paths = []
+        counts = Counter()
+        for table in tables:
+            table = table.cast(out_schema)
+            # The sort is stable, so the rows of an endpoint stay in the input order
+            table = table.take(pyarrow.compute.sort_indices(table, sort_keys=[("ENDPOINT", "ascending")]))
+            for count in table.column("ENDPOINT").value_counts().to_pylist():
+                counts[count["values"]] += count["counts"]
+
+            spill_path = Path(spill_dir) / f"part-{len(spill_paths)}.parquet"
+            parquet.write_table(table, spill_path, row_group_size=SPILL_ROW_GROUP_SIZE)
+            spill_paths.append(spill_path)
+
+        for group_idx, endpoints in enumerate(endpoint_groups(counts, row_group_size)):
+            # The endpoint filter only reads the row groups of the spilled
+            # files having these endpoints.
+            table = pyarrow.concat_tables([
+                parquet.read_table(spill_path, filters=[("ENDPOINT", "in", endpoints)], schema=out_schema)
+                for spill_path in spill_paths
+            ])
+            pyarrow.dataset.write_dataset(
+                table,
+                output,
+                format="parquet",
+                partitioning=["ENDPOINT"],
+                partitioning_flavor="hive",
+                basename_template=f"part-{group_idx}-{{i}}.parquet",
+                # Each group writes new partitions next to the previous ones
+                existing_data_behavior="error" if group_idx == 0 else "overwrite_or_ignore",
+                max_partitions=len(endpoints),
+                max_open_files=MAX_OPEN_FILES,
+                min_rows_per_group=row_group_size,
+                max_rows_per_group=row_group_size
+            )
+
+
+def endpoint_groups(counts, row_group_size):
+    """Split the sorted endpoints in groups of about `row_group_size` rows and at most MAX_OPEN_FILES endpoints"""
+    group = []
+    group_rows = 0
+    for endpoint in sorted(counts):
+        if group and (group_rows + counts[endpoint] > row_group_size or len(group) == MAX_OPEN_FILES):
+            yield group
+            group = []
+            group_rows = 0
+        group.append(endpoint)
+        group_rows += counts[endpoint]
+
+    if group:
+        yield group
+
+
+def iter_row_groups(tables, out_schema, row_group_size):
+    """Re-chunk a stream of tables into tables of `row_group_size` rows with the output schema"""
+    pending = []
+    n_pending = 0
+    for table in tables:
+        while table.num_rows > 0:
+            n_rows = min(row_group_size - n_pending, table.num_rows)
+            # Decode the dictionary-encoded columns only one row group at a time
+            pending.append(table.slice(0, n_rows).cast(out_schema))
+            n_pending += n_rows
+            table = table.slice(n_rows)
+
+            if n_pending == row_group_size:
+                yield pyarrow.concat_tables(pending)
+                pending = []
+                n_pending = 0
+
+    if n_pending > 0:
+        yield pyarrow.concat_tables(pending)
 
 
 if __name__ == "__main__":
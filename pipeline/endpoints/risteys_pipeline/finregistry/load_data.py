@@ -2,13 +2,23 @@
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
 from risteys_pipeline.config import (
     FINREGISTRY_MINIMAL_PHENOTYPE_DATA_PATH,
     FINREGISTRY_ENDPOINT_DEFINITIONS_DATA_PATH,
-    FINREGISTRY_LONG_FORMAT_FIRST_EVENTS_DATA_PATH,
+    FINREGISTRY_DENSIFIED_FIRST_EVENTS_DATA_PATH,
+    FINREGISTRY_SNAPSHOT_DIR,
+)
+from risteys_pipeline.store import (
+    build_person_table,
+    build_event_table,
+    index_by_endpoint,
+    set_endpoint_offsets,
 )
 from risteys_pipeline.utils.log import logger
-from risteys_pipeline.utils.utils import to_decimal_year
+from risteys_pipeline.utils.snapshot import get_fingerprint, read_snapshot, write_snapshot
+from risteys_pipeline.utils.utils import DAYS_IN_YEAR, to_decimal_year
 
 SEX_FEMALE_ENDPOINTS = 2.0
 SEX_MALE_ENDPOINTS = 1.0
@@ -16,32 +26,82 @@ SEX_FEMALE_MINIMAL_PHENOTYPE = 1.0
 SEX_MALE_MINIMAL_PHENOTYPE = 0.0
 
 
-def load_data():
+def load_data(snapshot_dir=FINREGISTRY_SNAPSHOT_DIR):
     """
     Loads the following datasets using the data paths on config:
     - endpoint definitions
     - minimal phenotype
     - first events
 
+    The minimal phenotype is returned as a person table indexed by `person_idx`
+    and the first events as the narrow event table pointing into it,
+    see risteys_pipeline.store.
+
+    The loaded datasets are saved to a snapshot in `snapshot_dir`. Later calls
+    with the same input files and loading parameters memory-map the snapshot
+    instead of loading the datasets again, see risteys_pipeline.utils.snapshot.
+
     Args:
-        None
+        snapshot_dir (Path, optional): directory of the snapshots, None to disable snapshots
 
     Returns
         (endpoint_definitions, minimal_phenotype, first_events) (tuple)
     """
+    names = ["endpoint_definitions", "minimal_phenotype", "first_events"]
+
+    if snapshot_dir is not None:
+        fingerprint = get_snapshot_fingerprint()
+        snapshot = read_snapshot(snapshot_dir, fingerprint, names)
+        if snapshot is not None:
+            first_events = set_endpoint_offsets(snapshot["first_events"])
+            return (snapshot["endpoint_definitions"], snapshot["minimal_phenotype"], first_events)
+
     endpoint_definitions = load_endpoint_definitions_data()
-    minimal_phenotype = load_minimal_phenotype_data()
+    minimal_phenotype = build_person_table(load_minimal_phenotype_data())
     first_events = load_first_events_data(endpoint_definitions, minimal_phenotype)
+
+    if snapshot_dir is not None:
+        dataframes = dict(zip(names, [endpoint_definitions, minimal_phenotype, first_events]))
+        try:
+            write_snapshot(dataframes, snapshot_dir, fingerprint)
+        except (OSError, pa.ArrowException) as err:
+            logger.warning(f"Could not write snapshot to {snapshot_dir}: {err}")
+
     return (endpoint_definitions, minimal_phenotype, first_events)
 
 
+def get_snapshot_fingerprint():
+    """
+    Get the fingerprint of the snapshot of the loaded datasets.
+
+    Args:
+        None
+
+    Returns:
+        fingerprint (str): output of risteys_pipeline.utils.snapshot.get_fingerprint()
+    """
+    input_paths = [
+        FINREGISTRY_ENDPOINT_DEFINITIONS_DATA_PATH,
+        FINREGISTRY_MINIMAL_PHENOTYPE_DATA_PATH,
+        FINREGISTRY_DENSIFIED_FIRST_EVENTS_DATA_PATH,
+    ]
+    params = {
+        "SEX_FEMALE_ENDPOINTS": SEX_FEMALE_ENDPOINTS,
+        "SEX_MALE_ENDPOINTS": SEX_MALE_ENDPOINTS,
+        "SEX_FEMALE_MINIMAL_PHENOTYPE": SEX_FEMALE_MINIMAL_PHENOTYPE,
+        "SEX_MALE_MINIMAL_PHENOTYPE": SEX_MALE_MINIMAL_PHENOTYPE,
+        "DAYS_IN_YEAR": DAYS_IN_YEAR,
+    }
+
+    return get_fingerprint(input_paths, params)
+
+
 def load_minimal_phenotype_data(data_path=FINREGISTRY_MINIMAL_PHENOTYPE_DATA_PATH):
     """
     Loads and applies the following steps to minimal phenotype data:
+    - add birth and death year, replacing date_of_birth and death_date
     - drop rows with no FinRegistry ID
     - drop duplicated rows
-    - add birth and death year
-    - drop redundant columns (date_of_birth, death_date)
     - set `index_person` to boolean
     - add `female` and drop `sex`
 
@@ -52,7 +112,14 @@ def load_minimal_phenotype_data(data_path=FINREGISTRY_MINIMAL_PHENOTYPE_DATA_PAT
         df (DataFrame): minimal phenotype dataframe
     """
     cols = ["FINREGISTRYID", "date_of_birth", "death_date", "sex", "index_person"]
-    df = pd.read_feather(data_path, columns=cols)
+    table = feather.read_table(data_path, columns=cols)
+
+    # The dates are converted from the Arrow columns, without going through pandas datetimes
+    birth_year = to_decimal_year(table.column("date_of_birth"))
+    death_year = to_decimal_year(table.column("death_date"))
+    df = table.drop(["date_of_birth", "death_date"]).to_pandas()
+    df["birth_year"] = birth_year
+    df["death_year"] = death_year
     logger.debug(f"{df.shape[0]:,} rows loaded")
 
     df.columns = df.columns.str.lower()
@@ -61,10 +128,6 @@ def load_minimal_phenotype_data(data_path=FINREGISTRY_MINIMAL_PHENOTYPE_DATA_PAT
     df = df.loc[~df["personid"].isna()]
     df = df.drop_duplicates(subset=["personid"]).reset_index(drop=True)
 
-    df["birth_year"] = to_decimal_year(df["date_of_birth"])
-    df["death_year"] = to_decimal_year(df["death_date"])
-    df = df.drop(columns=["date_of_birth", "death_date"])
-
     df["index_person"] = df["index_person"].astype(bool)
 
     df["female"] = np.nan
@@ -104,20 +167,22 @@ def load_endpoint_definitions_data(
 
 
 def load_first_events_data(
-    endpoints, minimal_phenotype, data_path=FINREGISTRY_LONG_FORMAT_FIRST_EVENTS_DATA_PATH
+    endpoints, minimal_phenotype, data_path=FINREGISTRY_DENSIFIED_FIRST_EVENTS_DATA_PATH
 ):
     """
     Loads and applies the following steps to first events data:
     - rename columns
     - remove endpoints not in endpoints dataset
-    - add demographics from minimal phenotype
-    - add the event year
+    - replace the person ID with the index of the person in the minimal phenotype
+    - sort the events by endpoint and index them, see risteys_pipeline.store.index_by_endpoint()
 
     Args:
+        endpoints (DataFrame): endpoint definitions, output of load_endpoint_definitions_data()
+        minimal_phenotype (DataFrame): person table, output of build_person_table()
         data_path (str, optional): file path of the long-format first events feather file
 
     Returns:
-        df (DataFrame): first events dataframe
+        df (DataFrame): first events dataframe with columns `person_idx`, `endpoint`, `age`
     """
     cols = ["FINREGISTRYID", "ENDPOINT", "AGE"]
     df = pd.read_feather(data_path, columns=cols)
@@ -125,10 +190,8 @@ def load_first_events_data(
 
     logger.debug(f"{df.shape[0]:,} rows loaded")
 
-    df = df.loc[df["endpoint"].isin(endpoints["endpoint"])].reset_index(drop=True)
-    df = df.merge(minimal_phenotype, how="left", on="personid")
-    df["year"] = df["birth_year"] + df["age"]
-    df = df.astype({"personid": "string[pyarrow]", "endpoint": "category"})
+    df = build_event_table(df, minimal_phenotype, endpoints["endpoint"])
+    df = index_by_endpoint(df)
 
     logger.info(f"{df.shape[0]:,} rows in first events")
 
@@ -1,7 +1,7 @@
 """Functions for computing cumulative incidence"""
 
 import pandas as pd
-import numpy as np
+from risteys_pipeline.aalen_johansen import predict_cif
 from risteys_pipeline.utils.log import logger
 from risteys_pipeline.config import MIN_SUBJECTS_PERSONAL_DATA
 from risteys_pipeline.survival_analysis import (
@@ -12,6 +12,7 @@ from risteys_pipeline.survival_analysis import (
     set_timescale,
     survival_analysis,
 )
+from risteys_pipeline.utils.shared_data import get_frame
 
 N_DECIMALS = 4
 
@@ -69,16 +70,8 @@ def cumulative_incidence_function(endpoint, cases, cohort):
 
                 if len(ages) > 0:
 
-                    # Duplicate ages of length 1 to keep the same output format
-                    # The duplicate is later dropped
-                    if len(ages == 1):
-                        ages = np.repeat(ages, 2)
-
-                    CIF_ = model.predict(ages).drop_duplicates()
-
-                    # Format output
-                    CIF_ = CIF_.reset_index()
-                    CIF_ = CIF_.rename(columns={"index": "age", "CIF_1": "cumulinc"})
+                    # The CIF is evaluated at all the ages at once
+                    CIF_ = pd.DataFrame({"age": ages, "cumulinc": predict_cif(model, ages)})
                     CIF_["cumulinc"] = CIF_["cumulinc"].round(N_DECIMALS)
                     CIF_["sex"] = {True: "female", False: "male"}[sex]
 
@@ -91,10 +84,27 @@ def cumulative_incidence_function(endpoint, cases, cohort):
     return CIF
 
 
+def cumulative_incidence_task(endpoint):
+    """
+    Compute the CIF for `endpoint` in a pool worker, using the shared cohort and first events.
+
+    Args:
+        endpoint (str): name of the endpoint
+
+    Returns:
+        CIF (DataFrame): output of cumulative_incidence_function()
+    """
+    cohort = get_frame("cohort")
+    cases = get_cases(endpoint, get_frame("first_events"), cohort)
+
+    return cumulative_incidence_function(endpoint, cases, cohort)
+
+
 if __name__ == "__main__":
     from risteys_pipeline.finregistry.load_data import load_data
     from risteys_pipeline.survival_analysis import get_cohort
     from risteys_pipeline.utils.write_data import get_output_filepath
+    from risteys_pipeline.utils.shared_data import share_frames, attach_frames
     from multiprocessing import get_context
     from tqdm import tqdm
 
@@ -107,13 +117,16 @@ if __name__ == "__main__":
 
     logger.info("Start multiprocessing")
 
-    with get_context("spawn").Pool(processes=N_PROCESSES) as pool, tqdm(
-        total=n_endpoints, desc="Computing CIF"
-    ) as pbar:
+    # The cohort and first events are shared with the workers instead of
+    # being pickled for every task
+    shared = {"cohort": cohort, "first_events": first_events}
+    with share_frames(shared) as handle, get_context("spawn").Pool(
+        processes=N_PROCESSES, initializer=attach_frames, initargs=(handle,)
+    ) as pool, tqdm(total=n_endpoints, desc="Computing CIF") as pbar:
         result = [
             pool.apply_async(
-                cumulative_incidence_function,
-                args=(endpoint, get_cases(endpoint, first_events, cohort), cohort),
+                cumulative_incidence_task,
+                args=(endpoint,),
                 callback=lambda _: pbar.update(),
             )
             for endpoint in endpoint_definitions["endpoint"]
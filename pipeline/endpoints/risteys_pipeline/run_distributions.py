@@ -59,7 +59,7 @@ def compute_distribution(first_events, column):
     No sex-specific distributions are computed as they are currently not used.
 
     Args:
-        first_events (DataFrame): first events dataset
+        first_events (DataFrame): first events dataset, with the `year` column added by add_event_year() if needed
         column (str): column used for the distributions; "age" or "year"
 
     Returns:
@@ -103,9 +103,11 @@ def compute_distribution(first_events, column):
 
 if __name__ == "__main__":
     from risteys_pipeline.finregistry.load_data import load_data
+    from risteys_pipeline.store import add_event_year
     from risteys_pipeline.utils.write_data import get_output_filepath
 
     endpoint_definitions, minimal_phenotype, first_events = load_data()
+    first_events = add_event_year(first_events, minimal_phenotype)
 
     dist_age = compute_distribution(first_events, "age")
     dist_year = compute_distribution(first_events, "year")
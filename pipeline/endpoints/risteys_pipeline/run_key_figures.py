@@ -4,6 +4,7 @@ import numpy as np
 import pandas as pd
 from risteys_pipeline.utils.log import logger
 from risteys_pipeline.config import MIN_SUBJECTS_PERSONAL_DATA
+from risteys_pipeline.store import lookup
 
 N_DECIMALS = 4
 
@@ -18,8 +19,8 @@ def compute_key_figures(first_events, minimal_phenotype, index_persons=False):
     Floats are rounded to N_DECIMALS digits.
 
     Args:
-        first_events (DataFrame): first events dataframe
-        minimal_phenotype(DataFrame): minimal phenotype dataframe
+        first_events (DataFrame): first events dataframe, pointing into `minimal_phenotype` by `person_idx`
+        minimal_phenotype(DataFrame): minimal phenotype dataframe indexed by `person_idx`
         index_persons (bool): compute key figures for index persons only (True) or everyone (False)
 
     Returns:
@@ -33,13 +34,13 @@ def compute_key_figures(first_events, minimal_phenotype, index_persons=False):
         "Computing key figures" + (" for index persons" if index_persons else "")
     )
 
-    mp = minimal_phenotype.copy()
-    fe = first_events.copy()
+    mp = minimal_phenotype
+    fe = first_events
 
     # Only include index_persons if specified
     if index_persons:
-        mp = mp.loc[mp["index_person"] == True].reset_index(drop=True)
-        fe = fe.loc[fe["index_person"] == True].reset_index(drop=True)
+        mp = mp.loc[mp["index_person"] == True]
+        fe = fe.loc[lookup(fe, minimal_phenotype, "index_person") == True]
 
     # Calculate the total number of individuals
     n_total = {
@@ -48,14 +49,16 @@ def compute_key_figures(first_events, minimal_phenotype, index_persons=False):
         "unknown": sum(mp["female"].isnull()),
     }
 
-    # Calculate key figures by endpoint and sex
+    # Calculate key figures by endpoint and sex, sex is looked up by person index
+    female = lookup(fe, minimal_phenotype, "female")
+    sex = np.select(
+        [pd.isnull(female), female == True], ["unknown", "female"], default="male"
+    )
     kf = (
-        fe.assign(
-            sex=fe["female"].replace({True: "female", False: "male", np.nan: "unknown"})
-        )
+        fe.assign(sex=sex)
         .groupby(["endpoint", "sex"])
-        .agg({"personid": "count", "age": "median"})
-        .rename(columns={"personid": "nindivs_", "age": "median_age_"})
+        .agg({"person_idx": "count", "age": "median"})
+        .rename(columns={"person_idx": "nindivs_", "age": "median_age_"})
         .fillna({"nindivs_": 0})
         .reset_index()
     )
@@ -3,6 +3,8 @@
 import pandas as pd
 import numpy as np
 
+from risteys_pipeline.aalen_johansen import predict_cif
+from risteys_pipeline.coxph import coxph_summary
 from risteys_pipeline.utils.log import logger
 from risteys_pipeline.config import (
     MIN_SUBJECTS_PERSONAL_DATA,
@@ -15,6 +17,7 @@ from risteys_pipeline.survival_analysis import (
     set_timescale,
     survival_analysis,
 )
+from risteys_pipeline.utils.shared_data import get_frame
 
 N_DIGITS = 4
 
@@ -87,7 +90,7 @@ def exposure_to_death(endpoint, cases, exposed, cohort):
                 if len(ages == 1):
                     ages = np.repeat(ages, 2)
 
-                survival = 1 - model.predict(times)
+                survival = 1 - predict_cif(model, times)
 
 
     return surv
@@ -141,11 +144,11 @@ def mortality_analysis(endpoint, cases, exposed, cohort):
                 logger.debug("Removing personal data")
 
                 # Get cumulative baseline hazard by age
-                cbh_ = model.baseline_cumulative_hazard_
-                cbh_ = cbh_.reset_index().rename(columns={"index": "age"})
-                cbh_["age"] = cbh_["age"].round(0)
+                cbh_ = pd.DataFrame({
+                    "age": model.times.round(0),
+                    "baseline_cumulative_hazard": model.baseline_cumulative_hazard,
+                })
                 cbh_ = cbh_.groupby("age").mean().reset_index()
-                cbh_ = cbh_.rename(columns={"baseline cumulative hazard": "baseline_cumulative_hazard"})
 
                 # Get ages with enough data
                 age_counts = (
@@ -167,7 +170,7 @@ def mortality_analysis(endpoint, cases, exposed, cohort):
                     cumulative_baseline_hazard.append(cbh_)
 
                 cols = ["coef", "coef lower 95%", "coef upper 95%", "p"]
-                params_ = model.summary[cols]
+                params_ = coxph_summary(model)[cols]
                 params_ = params_.rename(
                     columns={
                         "coef lower 95%": "ci95_lower",
@@ -208,13 +211,31 @@ def mortality_analysis(endpoint, cases, exposed, cohort):
     return (params, cumulative_baseline_hazard, counts)
 
 
+def mortality_task(endpoint):
+    """
+    Mortality analysis for `endpoint` in a pool worker,
+    using the shared cohort, first events and mortality cases.
+
+    Args:
+        endpoint (str): name of the endpoint
+
+    Returns:
+        (params, cumulative_baseline_hazard, counts) (tuple): output of mortality_analysis()
+    """
+    cohort = get_frame("cohort")
+    cases = get_frame("mortality_cases")
+    exposed = get_exposed(endpoint, get_frame("first_events"), cohort, cases)
+
+    return mortality_analysis(endpoint, cases, exposed, cohort)
+
+
 if __name__ == "__main__":
     import pandas as pd
     from risteys_pipeline.finregistry.load_data import load_data
     from risteys_pipeline.survival_analysis import get_cohort
     from risteys_pipeline.utils.write_data import get_output_filepath
+    from risteys_pipeline.utils.shared_data import share_frames, attach_frames
     from multiprocessing import get_context
-    from functools import partial
     from tqdm import tqdm
 
     N_PROCESSES = 20
@@ -231,19 +252,18 @@ if __name__ == "__main__":
 
     cohort = get_cohort(minimal_phenotype)
     mortality_cases = get_cases("death", first_events, cohort)
-    get_exposed_ = partial(
-        get_exposed, first_events=first_events, cohort=cohort, cases=mortality_cases
-    )
 
     logger.info("Start multiprocessing")
 
-    with get_context("spawn").Pool(processes=N_PROCESSES) as pool, tqdm(
-        total=n_endpoints, desc="Mortality"
-    ) as pbar:
+    # The datasets are shared with the workers instead of being pickled for every task
+    shared = {"cohort": cohort, "first_events": first_events, "mortality_cases": mortality_cases}
+    with share_frames(shared) as handle, get_context("spawn").Pool(
+        processes=N_PROCESSES, initializer=attach_frames, initargs=(handle,)
+    ) as pool, tqdm(total=n_endpoints, desc="Mortality") as pbar:
         result = [
             pool.apply_async(
-                mortality_analysis,
-                args=(endpoint, mortality_cases, get_exposed_(endpoint), cohort,),
+                mortality_task,
+                args=(endpoint,),
                 callback=lambda _: pbar.update(),
             )
             for endpoint in endpoint_definitions["endpoint"]
@@ -0,0 +1,250 @@
+"""
+Integer-keyed person and first-event tables shared by the data loaders.
+
+Demographics are kept once per person in the person table. The event table
+only holds a dense person index, the endpoint and the age at the event, and
+demographics are looked up by position in the person table when needed.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from risteys_pipeline.utils.log import logger
+
+PERSON_IDX_DTYPE = np.int32
+
+
+def build_person_table(minimal_phenotype):
+    """
+    Assign a dense integer index to each person of the minimal phenotype.
+
+    The row position in the person table is the `person_idx` used by the
+    event table, so a demographic column can be looked up with
+    `persons[column].values[events["person_idx"].values]`.
+
+    Args:
+        minimal_phenotype (DataFrame): minimal phenotype with one row per `personid`
+
+    Returns:
+        persons (DataFrame): minimal phenotype indexed by `person_idx`
+    """
+    persons = minimal_phenotype.reset_index(drop=True)
+    persons.index.name = "person_idx"
+
+    return persons
+
+
+def build_event_table(first_events, persons, endpoints):
+    """
+    Build the narrow event table pointing into the person table.
+
+    Events for persons missing from the person table and for endpoints
+    missing from `endpoints` are dropped.
+
+    Args:
+        first_events (DataFrame): first events with columns `personid`, `endpoint`, `age`
+        persons (DataFrame): person table, output of build_person_table()
+        endpoints (list-like): endpoints to keep, their order defines the endpoint codes
+
+    Returns:
+        events (DataFrame): event table with the following columns:
+            person_idx: index of the person in the person table
+            endpoint: endpoint as a categorical
+            age: age at the first event
+    """
+    person_idx = pd.Index(persons["personid"]).get_indexer(first_events["personid"])
+    endpoint = pd.Categorical(first_events["endpoint"], categories=pd.unique(endpoints))
+
+    missing_persons = person_idx < 0
+    if missing_persons.any():
+        logger.warning(
+            f"Dropping {missing_persons.sum():,} events of persons not in the person table"
+        )
+    keep = (~missing_persons) & (endpoint.codes >= 0)
+
+    events = pd.DataFrame(
+        {
+            "person_idx": person_idx[keep].astype(PERSON_IDX_DTYPE),
+            "endpoint": endpoint[keep],
+            "age": first_events["age"].values[keep],
+        }
+    )
+
+    return events
+
+
+def build_event_table_from_arrow(first_events, persons, endpoints):
+    """
+    Build the narrow event table from an Arrow table, see build_event_table().
+
+    The person IDs and endpoints are matched in Arrow, so the ID columns of
+    the first events are never converted to Python objects.
+
+    Args:
+        first_events (pyarrow.Table): first events with columns `personid`, `endpoint`, `age`
+        persons (DataFrame): person table, output of build_person_table()
+        endpoints (list-like): endpoints to keep, their order defines the endpoint codes
+
+    Returns:
+        events (DataFrame): event table, see build_event_table()
+    """
+    categories = pd.unique(endpoints)
+    person_idx = arrow_index_in(first_events.column("personid"), persons["personid"].astype(str))
+    codes = arrow_index_in(first_events.column("endpoint"), categories)
+
+    # Not found values are null, so NaN after the conversion to NumPy
+    missing_persons = np.isnan(person_idx)
+    if missing_persons.any():
+        logger.warning(
+            f"Dropping {missing_persons.sum():,} events of persons not in the person table"
+        )
+    keep = (~missing_persons) & (~np.isnan(codes))
+
+    events = pd.DataFrame(
+        {
+            "person_idx": person_idx[keep].astype(PERSON_IDX_DTYPE),
+            "endpoint": pd.Categorical.from_codes(codes[keep].astype(np.int32), categories),
+            "age": first_events.column("age").to_numpy()[keep],
+        }
+    )
+
+    return events
+
+
+def arrow_index_in(column, values):
+    """
+    Get the position of each value of an Arrow string column in `values`.
+
+    Args:
+        column (pyarrow.ChunkedArray): string or dictionary-encoded string column
+        values (list-like): values to look up
+
+    Returns:
+        positions (array): position in `values`, NaN if not found
+    """
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    positions = pc.index_in(column, value_set=pa.array(values, type=column.type))
+
+    return positions.to_numpy()
+
+
+def index_by_endpoint(events):
+    """
+    Sort the event table by endpoint code and build a compressed-sparse-row index.
+
+    The events of the endpoint with code `k` are the rows
+    `offsets[k]:offsets[k + 1]`. The offsets are kept in
+    `events.attrs["endpoint_offsets"]`, along with the endpoint codes
+    and categories they refer to in `events.attrs["endpoint_codes"]` and
+    `events.attrs["endpoint_categories"]`. Since pandas copies the
+    attributes to tables derived from this one, e.g. filtered or
+    re-sorted, endpoint_events() only uses the offsets on the table
+    holding these same endpoint codes.
+
+    Args:
+        events (DataFrame): event table, output of build_event_table()
+
+    Returns:
+        events (DataFrame): event table sorted by endpoint code, with the endpoint offsets
+    """
+    order = np.argsort(events["endpoint"].cat.codes.values, kind="stable")
+    events = events.take(order).reset_index(drop=True)
+
+    return set_endpoint_offsets(events)
+
+
+def set_endpoint_offsets(events):
+    """
+    Set the endpoint offsets of an event table already sorted by endpoint code.
+
+    This is used to restore the index of a sorted event table whose
+    attributes were lost, e.g. when it was read back from a file. A
+    ValueError is raised if the table is not sorted by endpoint code.
+
+    Args:
+        events (DataFrame): event table sorted by endpoint code
+
+    Returns:
+        events (DataFrame): event table with the endpoint offsets
+    """
+    codes = events["endpoint"].cat.codes.values
+    categories = events["endpoint"].cat.categories
+    if (np.diff(codes) < 0).any():
+        raise ValueError("The event table is not sorted by endpoint code")
+
+    offsets = np.zeros(len(categories) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(categories)))
+    events.attrs["endpoint_offsets"] = offsets
+    events.attrs["endpoint_codes"] = codes
+    events.attrs["endpoint_categories"] = categories
+
+    return events
+
+
+def endpoint_events(events, endpoint):
+    """
+    Get the events of a single endpoint.
+
+    This is a zero-copy slice if the event table was indexed with
+    index_by_endpoint(), otherwise the whole table is scanned. The index is
+    only used if the endpoint codes of the table are the very array it was
+    built from, so an index carried over to a derived table is not used.
+    The endpoint column must not be modified in place after indexing.
+
+    Args:
+        events (DataFrame): event table
+        endpoint (str): name of the endpoint
+
+    Returns:
+        events (DataFrame): events of `endpoint`
+    """
+    column = events["endpoint"]
+    offsets = events.attrs.get("endpoint_offsets")
+    if (
+        offsets is None
+        or not isinstance(column.dtype, pd.CategoricalDtype)
+        or not column.cat.categories.equals(events.attrs.get("endpoint_categories"))
+        # The indexed codes are kept referenced in the attributes, so their
+        # memory can't be reused by the codes of another table.
+        or column.cat.codes.values.__array_interface__
+        != events.attrs["endpoint_codes"].__array_interface__
+    ):
+        return events.loc[column.values == endpoint]
+
+    categories = column.cat.categories
+    if endpoint not in categories:
+        return events.iloc[0:0]
+
+    code = categories.get_loc(endpoint)
+    return events.iloc[offsets[code]:offsets[code + 1]]
+
+
+def lookup(events, persons, column):
+    """
+    Look up a person-level column for each event.
+
+    Args:
+        events (DataFrame): event table, output of build_event_table()
+        persons (DataFrame): person table, output of build_person_table()
+        column (str): column of the person table
+
+    Returns:
+        values (array): value of `column` for each event
+    """
+    return persons[column].values[events["person_idx"].values]
+
+
+def add_event_year(events, persons):
+    """
+    Add the calendar year of each event as a decimal year.
+
+    Args:
+        events (DataFrame): event table, output of build_event_table()
+        persons (DataFrame): person table, output of build_person_table()
+
+    Returns:
+        events (DataFrame): event table with the `year` column
+    """
+    return events.assign(year=lookup(events, persons, "birth_year") + events["age"].values)
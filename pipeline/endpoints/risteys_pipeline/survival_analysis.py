@@ -1,9 +1,8 @@
 import numpy as np
 import pandas as pd
 
-from lifelines import CoxPHFitter, AalenJohansenFitter
-from lifelines.utils import ConvergenceError
-
+from risteys_pipeline.aalen_johansen import fit_aalen_johansen
+from risteys_pipeline.coxph import ConvergenceError, fit_coxph
 from risteys_pipeline.utils.log import logger
 from risteys_pipeline.config import (
     FOLLOWUP_START,
@@ -12,6 +11,7 @@ from risteys_pipeline.config import (
     MIN_SUBJECTS_SURVIVAL_ANALYSIS,
 )
 from risteys_pipeline.sample import sample_cases, sample_controls
+from risteys_pipeline.store import endpoint_events
 
 DAYS_IN_YEAR = 365.25
 OUTCOME_COMPETING_EVENT = 2
@@ -29,14 +29,14 @@ def get_cohort(minimal_phenotype):
     - sex information is not missing
 
     Args:
-        minimal_phenotype (DataFrame): minimal phenotype dataset
+        minimal_phenotype (DataFrame): minimal phenotype dataset indexed by `person_idx`
 
     Returns
-        cohort (DataFrame): cohort dataset with personid as an index
+        cohort (DataFrame): cohort dataset with person_idx as an index
     """
     logger.debug("Building the cohort")
 
-    cols = ["personid", "birth_year", "death_year", "female"]
+    cols = ["birth_year", "death_year", "female"]
     cohort = minimal_phenotype[cols]
 
     cohort = cohort.loc[
@@ -46,15 +46,14 @@ def get_cohort(minimal_phenotype):
             | (cohort["death_year"].values > FOLLOWUP_START)
         )
         & (~cohort["female"].isnull())
-    ]
-    cohort = cohort.reset_index(drop=True)
+    ].copy()
 
+    # No missing values left, so sex can be stored as a boolean
+    cohort["female"] = cohort["female"].astype(bool)
     cohort["outcome"] = 0
     cohort["start"] = np.maximum(cohort["birth_year"], FOLLOWUP_START)
     cohort["stop"] = np.minimum(cohort["death_year"].fillna(np.Inf), FOLLOWUP_END)
 
-    cohort = cohort.set_index("personid")
-
     return cohort[["start", "stop", "outcome", "birth_year", "female"]]
 
 
@@ -79,17 +78,18 @@ def get_cases(outcome, first_events, cohort):
         # Note: should be re-implemented if censoring can occur for different reasons than death, e.g. immigration
         cases = cohort.loc[cohort["stop"] < FOLLOWUP_END].copy()
     else:
+        # Demographics are looked up from the cohort by person index
         cases = (
-            first_events.loc[
-                (first_events["endpoint"].values == outcome)
-                & (first_events["year"].values > FOLLOWUP_START)
-                & (first_events["year"].values < FOLLOWUP_END)
-            ]
-            .filter(["personid", "year"])
-            .set_index("personid")
+            endpoint_events(first_events, outcome)
+            .filter(["person_idx", "age"])
+            .set_index("person_idx")
             .join(cohort, how="inner")
         )
-        cases["stop"] = cases["year"]
+        cases["stop"] = cases["birth_year"] + cases["age"]
+        cases = cases.loc[
+            (cases["stop"].values > FOLLOWUP_START)
+            & (cases["stop"].values < FOLLOWUP_END)
+        ]
 
     cases["outcome"] = 1
 
@@ -140,7 +140,7 @@ def add_exposure(exposed, df_survival):
     """
     logger.debug("Adding exposure")
 
-    df_survival = df_survival.merge(exposed.reset_index(), how="left", on="personid")
+    df_survival = df_survival.merge(exposed.reset_index(), how="left", on="person_idx")
     df_survival = df_survival.fillna({"exposure": 0})
 
     exposed_rows = df_survival["exposure"] == 1
@@ -180,8 +180,8 @@ def add_death_as_competing_event(df_survival):
     """
     if "exposure" in df_survival.columns:
         # `followup_outcome`/`followup_exposure`: person's outcome/exposure during the full follow-up
-        followup_outcome = df_survival.groupby("personid")["outcome"].transform("sum")
-        followup_exposure = df_survival.groupby("personid")["exposure"].transform("sum")
+        followup_outcome = df_survival.groupby("person_idx")["outcome"].transform("sum")
+        followup_exposure = df_survival.groupby("person_idx")["exposure"].transform("sum")
         indx = (
             (df_survival["stop"] < FOLLOWUP_END)
             & (followup_outcome == 0)
@@ -244,7 +244,7 @@ def check_min_subjects(df):
     - non-exposed controls
 
     Args:
-        df (DataFrame): dataset with the following columns: `personid`, `outcome`, `exposure` (optional)
+        df (DataFrame): dataset with the following columns: `person_idx`, `outcome`, `exposure` (optional)
 
     Returns: 
         check (bool): True if there's enough subjects, otherwise False
@@ -255,11 +255,11 @@ def check_min_subjects(df):
         tbl = pd.crosstab(
             df["outcome"],
             df["exposure"],
-            values=df["personid"],
+            values=df["person_idx"],
             aggfunc=pd.Series.nunique,
         )
     else:
-        tbl = df.groupby("outcome")["personid"].nunique()
+        tbl = df.groupby("outcome")["person_idx"].nunique()
 
     check = tbl.values.min() > min_persons
 
@@ -315,44 +315,43 @@ def survival_analysis(df_survival, model_type="cox"):
         model_type (str, default "cox"): model to fit, "cox" for Cox PH model or "aalen-johansen" for Aalen-Johansen estimator
 
     Returns: 
-        model (object): fitted survival model or None
+        model (object): fitted survival model or None, a CoxPHEstimate or an
+        AalenJohansenEstimate, see risteys_pipeline.coxph and risteys_pipeline.aalen_johansen
     """
 
     model = None
 
     if (df_survival is not None) & (check_min_subjects(df_survival)):
 
-        df_survival = df_survival.drop(columns="personid")
+        df_survival = df_survival.drop(columns="person_idx")
         entry_col = "start" if "start" in df_survival.columns else None
 
         if model_type == "cox":
             logger.debug("Fitting the Cox PH model")
-            model = CoxPHFitter()
+            covariates = [
+                col for col in df_survival.columns
+                if col not in ("start", "stop", "outcome", "weight")
+            ]
             try:
-                model.fit(
-                    df_survival,
-                    entry_col=entry_col,
-                    duration_col="stop",
-                    event_col="outcome",
-                    weights_col="weight",
-                    robust=True,
+                model = fit_coxph(
+                    df_survival["stop"].values,
+                    df_survival["outcome"].values,
+                    df_survival[covariates].values,
+                    weights=df_survival["weight"].values,
+                    start=df_survival["start"].values if entry_col is not None else None,
+                    covariates=covariates,
                 )
             except ConvergenceError:
                 model = None
 
         elif model_type == "aalen-johansen":
             logger.debug("Fitting the Aalen-Johansen model")
-            model = AalenJohansenFitter(calculate_variance=False)
-            try:
-                model.fit(
-                    durations=df_survival["stop"],
-                    event_observed=df_survival["outcome"],
-                    event_of_interest=1,
-                    entry=df_survival["start"] if entry_col is not None else None,
-                    weights=df_survival["weight"],
-                )
-            except ConvergenceError:
-                model = None
+            model = fit_aalen_johansen(
+                df_survival["stop"].values,
+                df_survival["outcome"].values,
+                weights=df_survival["weight"].values,
+                start=df_survival["start"].values if entry_col is not None else None,
+            )
 
         else:
             raise ValueError("Model must be 'cox' or 'aalen-johansen'")
@@ -0,0 +1,169 @@
+"""
+Share read-only DataFrames with the worker processes of a multiprocessing pool.
+
+The column arrays of the DataFrames are copied once into shared memory by the
+main process. The worker processes attach to the shared memory in the pool
+initializer and rebuild the DataFrames as zero-copy views, so the tasks only
+need to carry small arguments such as an endpoint name instead of pickled
+DataFrames.
+
+Usage:
+    with share_frames({"cohort": cohort}) as handle:
+        with get_context("spawn").Pool(initializer=attach_frames, initargs=(handle,)) as pool:
+            ...
+
+and in the task function, running in a worker process:
+    cohort = get_frame("cohort")
+"""
+
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Shared memory blocks and DataFrames attached in the current worker process.
+# The shared memory blocks must be kept referenced as long as the DataFrames are used.
+_shared_memory = []
+_frames = {}
+
+
+def frame_layout(df):
+    """
+    Get the arrays to share for a DataFrame and their layout in the shared memory block.
+
+    Categorical columns are shared as their codes, the categories are kept in the layout.
+
+    Args:
+        df (DataFrame): DataFrame with numeric, boolean, or categorical columns
+
+    Returns:
+        (arrays, layout) (tuple): arrays to share and the layout, see share_frames()
+    """
+    arrays = [np.ascontiguousarray(df.index.values)]
+    columns = []
+    for column in df.columns:
+        values = df[column].values
+        if isinstance(values, pd.Categorical):
+            arrays.append(np.ascontiguousarray(values.codes))
+            columns.append((column, values.categories))
+        elif isinstance(values, np.ndarray) and values.dtype != object:
+            arrays.append(np.ascontiguousarray(values))
+            columns.append((column, None))
+        else:
+            raise TypeError(f"Column {column} of dtype {df[column].dtype} can't be shared")
+
+    layout = {
+        "index_name": df.index.name,
+        "columns": columns,
+        "arrays": [],
+        "attrs": df.attrs,
+        "size": 0,
+    }
+    offset = 0
+    for arr in arrays:
+        # Align each array on 8 bytes
+        offset = -(-offset // 8) * 8
+        layout["arrays"].append((arr.dtype.str, arr.shape[0], offset))
+        offset += arr.nbytes
+    layout["size"] = max(offset, 1)
+
+    return arrays, layout
+
+
+@contextmanager
+def share_frames(frames):
+    """
+    Copy DataFrames into shared memory.
+
+    The shared memory is released when exiting the context, so the pool
+    using it must be closed before.
+
+    Args:
+        frames (dict of str: DataFrame): DataFrames to share, by name
+
+    Returns:
+        handle (dict): picklable handle to the shared DataFrames, to pass to attach_frames()
+    """
+    blocks = []
+    handle = {}
+    try:
+        for name, df in frames.items():
+            arrays, layout = frame_layout(df)
+            shm = shared_memory.SharedMemory(create=True, size=layout["size"])
+            blocks.append(shm)
+            for arr, (dtype, length, offset) in zip(arrays, layout["arrays"]):
+                np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=offset)[:] = arr
+            handle[name] = dict(layout, shm_name=shm.name)
+
+        yield handle
+
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def frames_from_handle(handle):
+    """
+    Rebuild the shared DataFrames as read-only views on the shared memory.
+
+    Args:
+        handle (dict): output of share_frames()
+
+    Returns:
+        (frames, blocks) (tuple): DataFrames by name and the attached shared memory blocks
+    """
+    frames = {}
+    blocks = []
+    for name, layout in handle.items():
+        shm = shared_memory.SharedMemory(name=layout["shm_name"])
+        blocks.append(shm)
+
+        arrays = []
+        for dtype, length, offset in layout["arrays"]:
+            arr = np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=offset)
+            arr.flags.writeable = False
+            arrays.append(arr)
+
+        index = pd.Index(arrays[0], name=layout["index_name"], copy=False)
+        data = {}
+        for (column, categories), arr in zip(layout["columns"], arrays[1:]):
+            if categories is not None:
+                data[column] = pd.Categorical.from_codes(arr, categories=categories)
+            else:
+                data[column] = arr
+
+        df = pd.DataFrame(data, index=index, copy=False)
+        df.attrs = layout["attrs"]
+        frames[name] = df
+
+    return frames, blocks
+
+
+def attach_frames(handle):
+    """
+    Pool initializer attaching the worker process to the shared DataFrames.
+
+    Args:
+        handle (dict): output of share_frames()
+
+    Returns:
+        None
+    """
+    frames, blocks = frames_from_handle(handle)
+    _frames.update(frames)
+    _shared_memory.extend(blocks)
+
+
+def get_frame(name):
+    """
+    Get a shared DataFrame in a worker process.
+
+    Args:
+        name (str): name of the DataFrame given to share_frames()
+
+    Returns:
+        df (DataFrame): read-only DataFrame
+    """
+    return _frames[name]
@@ -0,0 +1,148 @@
+"""
+Memory-mapped snapshots of preprocessed DataFrames.
+
+A snapshot is a directory of uncompressed Arrow IPC files, one per
+DataFrame, named after a fingerprint of the input files and of the
+parameters used to build the DataFrames. Reading a snapshot memory-maps
+the files, so the scripts reading the same snapshot share the OS page cache
+instead of each re-doing the preprocessing.
+
+Writing a snapshot removes the snapshots of other fingerprints from the
+same directory, so that only the snapshot of the current inputs is kept.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+from risteys_pipeline.utils.log import logger
+
+# Bump when the content of the snapshotted DataFrames changes without any
+# change in the input files or parameters, e.g. after a change in the loaders.
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def get_fingerprint(input_paths, params):
+    """
+    Get a fingerprint of the input files and parameters.
+
+    The fingerprint changes when any input file is modified, or when any
+    parameter or the snapshot format version changes.
+
+    Args:
+        input_paths (list of Path): input files the snapshot is built from
+        params (dict): JSON-serializable parameters the snapshot is built with
+
+    Returns:
+        fingerprint (str): hexadecimal fingerprint
+    """
+    inputs = []
+    for path in input_paths:
+        stat = os.stat(path)
+        inputs.append([str(path), stat.st_mtime_ns, stat.st_size])
+
+    key = {"version": SNAPSHOT_FORMAT_VERSION, "inputs": inputs, "params": params}
+    key = json.dumps(key, sort_keys=True, default=str)
+
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def write_snapshot(dataframes, snapshot_dir, fingerprint):
+    """
+    Write DataFrames to a snapshot.
+
+    The files are first written to a temporary directory which is then
+    renamed, so a concurrent reader never sees a partial snapshot. The
+    temporary directory is removed if the writing fails. The other
+    snapshots of `snapshot_dir` are then removed, see prune_snapshots().
+
+    Args:
+        dataframes (dict of str: DataFrame): DataFrames to write, by name
+        snapshot_dir (Path): directory holding the snapshots
+        fingerprint (str): output of get_fingerprint()
+
+    Returns:
+        path (Path): path to the snapshot
+    """
+    path = Path(snapshot_dir) / fingerprint
+    tmp_path = Path(snapshot_dir) / f".{fingerprint}.{os.getpid()}.tmp"
+    tmp_path.mkdir(parents=True, exist_ok=True)
+
+    try:
+        for name, df in dataframes.items():
+            table = pa.Table.from_pandas(df)
+            with pa.OSFile(str(tmp_path / f"{name}.arrow"), "wb") as sink:
+                with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        try:
+            tmp_path.rename(path)
+        except OSError:
+            # Another process wrote the same snapshot in the meantime
+            if not path.exists():
+                raise
+    finally:
+        # Left over if the writing failed or another snapshot was renamed first
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    logger.info(f"Snapshot written to {path}")
+    prune_snapshots(snapshot_dir, fingerprint)
+
+    return path
+
+
+def prune_snapshots(snapshot_dir, fingerprint):
+    """
+    Remove the snapshots whose fingerprint differs from the given one.
+
+    They were built from older input files or parameters, so they won't
+    be read anymore. Only the directories named like a fingerprint are
+    removed, so the temporary directories of snapshots being written are
+    kept. A process still reading a removed snapshot keeps its memory
+    maps, the files are only freed once they are unmapped.
+
+    Args:
+        snapshot_dir (Path): directory holding the snapshots
+        fingerprint (str): fingerprint of the snapshot to keep
+    """
+    for path in Path(snapshot_dir).iterdir():
+        if path.name != fingerprint and re.fullmatch("[0-9a-f]{16}", path.name) and path.is_dir():
+            logger.info(f"Removing outdated snapshot {path}")
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_snapshot(snapshot_dir, fingerprint, names):
+    """
+    Read DataFrames from a snapshot by memory-mapping its files.
+
+    Args:
+        snapshot_dir (Path): directory holding the snapshots
+        fingerprint (str): output of get_fingerprint()
+        names (list of str): names of the DataFrames to read
+
+    Returns:
+        dataframes (dict of str: DataFrame or None): DataFrames by name,
+        None if the snapshot does not exist
+    """
+    path = Path(snapshot_dir) / fingerprint
+    if not path.exists():
+        return None
+
+    logger.info(f"Reading snapshot {path}")
+    dataframes = {}
+    for name in names:
+        source = pa.memory_map(str(path / f"{name}.arrow"))
+        table = pyarrow.ipc.open_file(source).read_all()
+        # String columns are only stored as "string" in the pandas metadata,
+        # the pipeline uses the pyarrow storage for them.
+        with pd.option_context("mode.string_storage", "pyarrow"):
+            dataframes[name] = table.to_pandas(split_blocks=True)
+
+    return dataframes
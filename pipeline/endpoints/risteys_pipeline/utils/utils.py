@@ -1,16 +1,64 @@
 """Utils functions"""
 from contextlib import contextmanager
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from risteys_pipeline.utils.log import logger
 
 
 DAYS_IN_YEAR = 365.25
 
 
-def to_decimal_year(date_col):
-    """Format date to a decimal year"""
-    date_col = pd.to_datetime(date_col, infer_datetime_format=True)
-    decimal_year = date_col.dt.year + (date_col.dt.dayofyear - 1) / DAYS_IN_YEAR
+def to_decimal_year(date_col, date_format=None, day_offset=0):
+    """
+    Format dates to decimal years.
+
+    The year and the day of year are computed with integer arithmetic on
+    the number of days since 1970-01-01, instead of with the pandas
+    datetime accessors.
+
+    Args:
+        date_col (Series, or Arrow Array or ChunkedArray): dates, either
+        as datetimes, Arrow dates or timestamps, or strings
+        date_format (str, optional): strptime format of the dates given as
+        strings, inferred if not given
+        day_offset (int, optional): added to the day of year counted from 0
+
+    Returns:
+        decimal_year (Series or ndarray): decimal years with NaN for missing
+        dates, a Series with the same index if date_col is a Series
+    """
+    if isinstance(date_col, (pa.Array, pa.ChunkedArray)):
+        return decimal_year_from_days(arrow_to_days(date_col, date_format), day_offset)
+
+    if not pd.api.types.is_datetime64_dtype(date_col):
+        date_col = pd.to_datetime(date_col, format=date_format, infer_datetime_format=date_format is None)
+    days = date_col.values.astype("datetime64[D]")
+
+    return pd.Series(decimal_year_from_days(days, day_offset), index=date_col.index, name=date_col.name)
+
+
+def arrow_to_days(date_col, date_format=None):
+    """Convert an Arrow column of dates, timestamps, or strings to a datetime64[D] array"""
+    if pa.types.is_string(date_col.type) or pa.types.is_large_string(date_col.type):
+        if date_format is None:
+            date_col = date_col.cast(pa.timestamp("s"))
+        else:
+            date_col = pc.strptime(date_col, format=date_format, unit="s")
+    if not pa.types.is_date32(date_col.type):
+        date_col = date_col.cast(pa.date32())
+
+    return date_col.to_numpy(zero_copy_only=False)
+
+
+def decimal_year_from_days(days, day_offset=0):
+    """Decimal-year kernel on a datetime64[D] array, with NaN for NaT"""
+    years = days.astype("datetime64[Y]")
+    day_of_year = (days - years).astype(np.int64)
+    decimal_year = (years.astype(np.int64) + 1970) + (day_of_year + day_offset) / DAYS_IN_YEAR
+    decimal_year[np.isnat(days)] = np.nan
+
     return decimal_year
 
 
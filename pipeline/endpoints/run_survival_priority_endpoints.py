@@ -13,10 +13,16 @@ from risteys_pipeline.finregistry.load_data import (
     load_related_endpoints_data,
 )
 from risteys_pipeline.survival_analysis import *
+from risteys_pipeline.coxph import coxph_summary
+from risteys_pipeline.store import index_by_endpoint
+from risteys_pipeline.utils.shared_data import attach_frames, get_frame
 
 DAYS_IN_YEAR = 365.25
 DAYS_BETWEEN_ENDPOINTS = 180
 
+# Related endpoints of the current pool worker, set by init_worker()
+_related_endpoints = None
+
 
 def filter_first_events(first_events, priority, cohort):
     """
@@ -25,6 +31,7 @@ def filter_first_events(first_events, priority, cohort):
     - include only persons in the cohort
     - include events within the followup period
     - include endpoints with at least MIN_SUBJECTS_SURVIVAL_ANALYSIS * 2 persons
+    - add the event year
 
     Args:
         first_events (DataFrame): first events dataset
@@ -35,9 +42,11 @@ def filter_first_events(first_events, priority, cohort):
         first_events (DataFrame): filtered first events dataset
     """
     first_events = first_events.loc[first_events["endpoint"].isin(priority["endpoint"])]
+    # Birth year is looked up from the cohort, it is NaN for persons outside the cohort
+    birth_year = cohort["birth_year"].reindex(first_events["person_idx"]).values
+    first_events = first_events.assign(year=birth_year + first_events["age"].values)
     first_events = first_events.loc[
-        (first_events["personid"].values.isin(cohort.index))
-        & (first_events["year"] >= FOLLOWUP_START)
+        (first_events["year"] >= FOLLOWUP_START)
         & (first_events["year"] <= FOLLOWUP_END)
     ]
     first_events = first_events.reset_index(drop=True)
@@ -46,9 +55,9 @@ def filter_first_events(first_events, priority, cohort):
         endpoint_counts > MIN_SUBJECTS_SURVIVAL_ANALYSIS * 2
     ]
     first_events = first_events.loc[
-        first_events["endpoint"].values.isin(endpoint_counts.index)
+        first_events["endpoint"].isin(endpoint_counts.index)
     ]
-    first_events = first_events.reset_index(drop=True)
+    first_events = index_by_endpoint(first_events)
 
     return first_events
 
@@ -68,9 +77,9 @@ def get_counts(endpoint, first_events, cohort, related_endpoints):
         DataFrame: counts for endpoints
     """
     cases = get_cases(endpoint, first_events, cohort)
-    temp = first_events.loc[first_events["personid"].values.isin(cases.index)]
+    temp = first_events.loc[first_events["person_idx"].isin(cases.index)]
     temp = temp.reset_index(drop=True)
-    temp = temp.merge(cases["stop"], how="left", right_index=True, left_on="personid")
+    temp = temp.merge(cases["stop"], how="left", right_index=True, left_on="person_idx")
     temp = temp.loc[
         (temp["year"] - temp["stop"]).values >= (DAYS_BETWEEN_ENDPOINTS / DAYS_IN_YEAR)
     ]
@@ -137,7 +146,7 @@ def run_survival_analysis(endpoint1, endpoint2, first_events, cohort):
         if model is not None:
             logger.debug("Formatting the output")
 
-            params = model.summary
+            params = coxph_summary(model)
 
             params = params.reset_index()
             params = params.loc[params["covariate"] == "exposure"]
@@ -195,9 +204,41 @@ def survival_analysis_loop(endpoint, first_events, cohort, related_endpoints):
     return res
 
 
+def init_worker(handle, related_endpoints):
+    """
+    Pool initializer attaching the worker to the shared cohort and first events.
+
+    Args:
+        handle (dict): output of risteys_pipeline.utils.shared_data.share_frames()
+        related_endpoints (DataFrame): related endpoints dataset
+
+    Returns:
+        None
+    """
+    global _related_endpoints
+    attach_frames(handle)
+    _related_endpoints = related_endpoints
+
+
+def survival_analysis_task(endpoint):
+    """
+    Run survival_analysis_loop() in a pool worker, using the shared datasets.
+
+    Args:
+        endpoint (str): name of the first endpoint ("exposure endpoint")
+
+    Returns:
+        params (DataFrame): output of survival_analysis_loop()
+    """
+    return survival_analysis_loop(
+        endpoint, get_frame("first_events"), get_frame("cohort"), _related_endpoints
+    )
+
+
 if __name__ == "__main__":
     from multiprocessing import get_context
     from tqdm import tqdm
+    from risteys_pipeline.utils.shared_data import share_frames
 
     N_PROCESSES = 20
 
@@ -212,13 +253,18 @@ if __name__ == "__main__":
     first_events = filter_first_events(first_events, priority, cohort)
 
     logger.info("Start multiprocessing")
-    with get_context("spawn").Pool(processes=N_PROCESSES) as pool, tqdm(
-        total=n_endpoints
-    ) as pbar:
+    # The cohort and first events are shared with the workers instead of
+    # being pickled for every task
+    shared = {"cohort": cohort, "first_events": first_events}
+    with share_frames(shared) as handle, get_context("spawn").Pool(
+        processes=N_PROCESSES,
+        initializer=init_worker,
+        initargs=(handle, related_endpoints),
+    ) as pool, tqdm(total=n_endpoints) as pbar:
         result = [
             pool.apply_async(
-                survival_analysis_loop,
-                args=(endpoint, first_events, cohort, related_endpoints),
+                survival_analysis_task,
+                args=(endpoint,),
                 callback=lambda _: pbar.update(),
             )
             for endpoint in priority["endpoint"]
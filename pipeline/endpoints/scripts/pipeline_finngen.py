@@ -7,6 +7,7 @@ from risteys_pipeline.finngen.load_data import load_data
 from risteys_pipeline.run_cumulative_incidence import cumulative_incidence_function
 from risteys_pipeline.run_distributions import compute_distribution
 from risteys_pipeline.run_key_figures import compute_key_figures
+from risteys_pipeline.store import add_event_year
 from risteys_pipeline.survival_analysis import (
     get_cases,
     get_cohort
@@ -44,7 +45,7 @@ def pipeline():
 
     # Run age and year distributions
     dist_age = compute_distribution(df_first_events, "age")
-    dist_year = compute_distribution(df_first_events, "year")
+    dist_year = compute_distribution(add_event_year(df_first_events, df_minimal_phenotype), "year")
 
     dist_age.to_csv(get_output_filepath(
         "distribution_age",
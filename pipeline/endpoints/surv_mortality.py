@@ -4,6 +4,13 @@ Mortality statistics.
 This script compute statistics on mortality.
 It is done using survival analysis with the Cox PH method.
 
+Usage
+-----
+  python surv_mortality.py <definitions> <first events> <info> <output> <timings> [<n workers>]
+
+With more than 1 worker, the endpoints are run in a process pool
+sharing the loaded first events and info data.
+
 References
 ----------
 - CASE-COHORT
@@ -18,11 +25,10 @@ from time import time as now
 
 import numpy as np
 import pandas as pd
-from lifelines import CoxPHFitter
-from lifelines.utils import ConvergenceError
-from lifelines.utils import interpolate_at_times
 
 from log import logger
+from risteys_pipeline.coxph import ConvergenceError, coxph_summary, cumulative_hazard_at, fit_coxph, predict_survival
+from risteys_pipeline.utils.shared_data import attach_frames, get_frame, share_frames
 
 
 STUDY_STARTS = 1998.0  # inclusive
@@ -61,8 +67,8 @@ LAG_COLS = {
 BCH_TIMEPOINTS = [0, 2.5, 5, 7.5, 10, 12.5, 15, 17.5, 20, 21.99]
 
 
-def main(path_definitions, path_long_format_fevents, path_info, output_path, timings_path):
-    endpoints, df_events, df_info = load_data(path_definitions, path_long_format_fevents, path_info)
+def main(path_definitions, path_long_format_fevents, path_info, output_path, timings_path, n_workers=1):
+    endpoints, df_events, df_info, bitmaps = load_data(path_definitions, path_long_format_fevents, path_info)
 
     line_buffering = 1
     res_file = open(output_path, "x", buffering=line_buffering)
@@ -73,60 +79,111 @@ def main(path_definitions, path_long_format_fevents, path_info, output_path, tim
     timings_writer = csv_writer(timings_file)
     timings_writer.writerow(["endpoint", "lags_computed", "time_seconds"])
 
-    for _, endpoint in endpoints.iterrows():
-        time_start = now()
-        lags_computed = 0
-        try:
-            (df_controls,
-             df_unexp_death,
-             df_unexp_exp_p1,
-             df_unexp_exp_p2,
-             df_tri_p1,
-             df_tri_p2) = prep_coxhr(endpoint, df_events, df_info)
-
-            for lag, cols in LAG_COLS.items():
-                logger.info(f"Setting HR lag to: {lag}")
-                nindivs, df_lifelines = prep_lifelines(
-                    cols,
-                    df_controls,
-                    df_unexp_death,
-                    df_unexp_exp_p1,
-                    df_unexp_exp_p2,
-                    df_tri_p1,
-                    df_tri_p2
-                )
-                compute_coxhr(
-                    endpoint,
-                    df_lifelines,
-                    lag,
-                    nindivs,
-                    res_writer
-                )
-                lags_computed += 1
-        except NotEnoughIndividuals as exc:
-            logger.warning(exc)
-        except ConvergenceError as exc:
-            logger.warning(f"Failed to run Cox.fit():\n{exc}")
-        finally:
-            endpoint_time = now() - time_start
-            timings_writer.writerow([endpoint.NAME, lags_computed, endpoint_time])
+    # One task per endpoint, running all its lags
+    tasks = [endpoint for _, endpoint in endpoints.iterrows()]
+
+    if n_workers > 1:
+        # The data is shared with the workers instead of being pickled
+        # for every task or worker. The bitmaps are shared as a table
+        # with one column per endpoint.
+        from multiprocessing import get_context
+        shared = {"events": df_events, "info": df_info, "bitmaps": pd.DataFrame(bitmaps, copy=False)}
+        with share_frames(shared) as handle, get_context("spawn").Pool(
+            processes=n_workers,
+            initializer=init_worker,
+            initargs=(handle,)
+        ) as pool:
+            results = pool.imap_unordered(run_endpoint, tasks)
+            write_results(results, res_writer, timings_writer)
+    else:
+        init_data(df_events, df_info, bitmaps)
+        results = map(run_endpoint, tasks)
+        write_results(results, res_writer, timings_writer)
 
     timings_file.close()
     res_file.close()
 
 
+def write_results(results, res_writer, timings_writer):
+    """Write the result and timing rows of each endpoint as soon as it is done"""
+    for res_rows, timings_row in results:
+        res_writer.writerows(res_rows)
+        timings_writer.writerow(timings_row)
+
+
+# Input data of the current process, set by init_data()
+_data = {}
+
+
+def init_data(df_events, df_info, bitmaps):
+    """Set the input data used by run_endpoint() in the current process"""
+    _data.update(events=df_events, info=df_info, bitmaps=bitmaps)
+
+
+def init_worker(handle):
+    """Pool initializer attaching the worker to the shared first events, info and bitmaps"""
+    attach_frames(handle)
+    df_bitmaps = get_frame("bitmaps")
+    bitmaps = {endpoint: df_bitmaps[endpoint].values for endpoint in df_bitmaps.columns}
+    init_data(get_frame("events"), get_frame("info"), bitmaps)
+
+
+def run_endpoint(endpoint):
+    """Run the Cox regressions of all the lags of an endpoint.
+
+    Return the result rows and the timing row of the endpoint.
+    """
+    res_rows = []
+    time_start = now()
+    try:
+        (df_controls,
+         df_unexp_death,
+         df_unexp_exp_p1,
+         df_unexp_exp_p2,
+         df_tri_p1,
+         df_tri_p2) = prep_coxhr(endpoint, _data["events"], _data["info"], _data["bitmaps"])
+
+        for lag, cols in LAG_COLS.items():
+            logger.info(f"Setting HR lag to: {lag}")
+            nindivs, df_lifelines = prep_lifelines(
+                cols,
+                df_controls,
+                df_unexp_death,
+                df_unexp_exp_p1,
+                df_unexp_exp_p2,
+                df_tri_p1,
+                df_tri_p2
+            )
+            res_rows.append(compute_coxhr(
+                endpoint,
+                df_lifelines,
+                lag,
+                nindivs
+            ))
+    except NotEnoughIndividuals as exc:
+        logger.warning(exc)
+    except ConvergenceError as exc:
+        logger.warning(f"Failed to run Cox.fit():\n{exc}")
+
+    endpoint_time = now() - time_start
+    return res_rows, [endpoint.NAME, len(res_rows), endpoint_time]
+
+
 def load_data(path_definitions, path_long_format_fevents, path_info):
     logger.info("Loading data")
     # Get endpoint list
     endpoints = pd.read_csv(path_definitions, usecols=["NAME", "SEX", "CORE_ENDPOINTS"])
 
-    # Get first events
-    df_events = pd.read_parquet(path_long_format_fevents)
-
     # Keep only core endpoints
     endpoints = endpoints.loc[endpoints.CORE_ENDPOINTS == "yes", :]
     select_endpoints = set(endpoints.NAME).union(["DEATH"])  # we need the DEATH endpoint to compute mortality
-    df_events = df_events.loc[df_events.ENDPOINT.isin(select_endpoints), :]
+
+    # Get first events, the endpoint filter is pushed down to the Parquet reader
+    df_events = pd.read_parquet(
+        path_long_format_fevents,
+        columns=["FINNGENID", "ENDPOINT", "AGE"],
+        filters=[("ENDPOINT", "in", list(select_endpoints))]
+    )
 
     # Get sex and approximate birth date of each indiv
     df_info = pd.read_csv(path_info, usecols=["FINNGENID", "BL_YEAR", "BL_AGE", "SEX"])
@@ -136,19 +193,17 @@ def load_data(path_definitions, path_long_format_fevents, path_info):
     df_info = df_info.drop(columns=["SEX", "BL_YEAR", "BL_AGE"])
 
     # Set age at start and end of study for each indiv
-    df_info["START_AGE"] = df_info.apply(
-        lambda r: max(STUDY_STARTS - r.BIRTH_TYEAR, 0.0),
-        axis="columns"
-    )
+    df_info["START_AGE"] = (STUDY_STARTS - df_info.BIRTH_TYEAR).clip(lower=0.0)
     deaths = (
         df_events.loc[df_events.ENDPOINT == "DEATH", ["FINNGENID", "AGE"]]
         .rename(columns={"AGE": "DEATH_AGE"})
     )
     df_info = df_info.merge(deaths, on="FINNGENID", how="left")
-    df_info["END_AGE"] = df_info.apply(
-        # We cannot simply use min() or max() here due to NaN, so we resort to an if-else
-        lambda r: r.DEATH_AGE if (r.BIRTH_TYEAR + r.DEATH_AGE) < STUDY_ENDS else (STUDY_ENDS - r.BIRTH_TYEAR),
-        axis="columns"
+    # We cannot simply use min() here due to NaN: individuals without a
+    # death age are followed until the end of the study.
+    df_info["END_AGE"] = df_info.DEATH_AGE.where(
+        (df_info.BIRTH_TYEAR + df_info.DEATH_AGE) < STUDY_ENDS,
+        STUDY_ENDS - df_info.BIRTH_TYEAR
     )
 
     # Remove individuals that lived outside of the study time frame
@@ -164,8 +219,50 @@ def load_data(path_definitions, path_long_format_fevents, path_info):
     df_events = df_events.loc[~ df_events.FINNGENID.isin(born_after_study), :]
     df_info = df_info.loc[~ df_info.FINNGENID.isin(born_after_study), :]
 
+    # The cohort is made of the individuals having at least one first event
+    df_info = df_info.loc[df_info.FINNGENID.isin(df_events.FINNGENID), :]
+
+    # Dense person index: the person of row i of df_info is person i,
+    # the events refer to it in the PERSON column.
+    # The FINNGENIDs are not needed after that, and dropping them
+    # leaves only columns that can be shared with the worker processes.
+    df_info = df_info.reset_index(drop=True)
+    df_events = df_events.assign(
+        PERSON=pd.Index(df_info.FINNGENID).get_indexer(df_events.FINNGENID),
+        ENDPOINT=df_events.ENDPOINT.astype("category")
+    )
+    df_events = df_events.loc[df_events.PERSON >= 0, ["PERSON", "ENDPOINT", "AGE"]].reset_index(drop=True)
+    df_info = df_info.drop(columns="FINNGENID")
+
+    bitmaps = endpoint_bitmaps(df_events, df_info.shape[0])
+
     logger.info("done loading data")
-    return endpoints, df_events, df_info
+    return endpoints, df_events, df_info, bitmaps
+
+
+def endpoint_bitmaps(df_events, n_persons):
+    """Packed bitmap of the persons having each endpoint, over the dense person index"""
+    bitmaps = {}
+    for endpoint, persons in df_events.groupby("ENDPOINT", observed=True).PERSON:
+        members = np.zeros(n_persons, dtype=bool)
+        members[persons.to_numpy()] = True
+        bitmaps[endpoint] = np.packbits(members)
+    return bitmaps
+
+
+def endpoint_members(bitmaps, endpoint, n_persons):
+    """Boolean array of the persons having the endpoint"""
+    if endpoint not in bitmaps:
+        return np.zeros(n_persons, dtype=bool)
+    return np.unpackbits(bitmaps[endpoint], count=n_persons).astype(bool)
+
+
+def endpoint_ages(df_events, endpoint, n_persons):
+    """Age at the endpoint of each person, NaN for the persons not having it"""
+    ages = np.full(n_persons, np.nan)
+    events = df_events.loc[df_events.ENDPOINT == endpoint, :]
+    ages[events.PERSON.to_numpy()] = events.AGE.to_numpy()
+    return ages
 
 
 def init_csv(res_file):
@@ -216,71 +313,66 @@ def init_csv(res_file):
     return res_writer
 
 
-def prep_coxhr(endpoint, df_events, df_info):
+def prep_coxhr(endpoint, df_events, df_info, bitmaps):
     logger.info(f"Preparing data before Cox fitting for {endpoint.NAME}")
+    # The groups of persons are boolean arrays over the dense person
+    # index of df_info, built from the endpoint bitmaps.
+    n_persons = df_info.shape[0]
+    has_endp = endpoint_members(bitmaps, endpoint.NAME, n_persons)
 
     # Define groups for the case-cohort design study.
     # Naming follows Johansson-16 paper.
-    cohort = set(df_events.FINNGENID)
-    cases = set(df_events.loc[df_events.ENDPOINT == "DEATH", "FINNGENID"])
-    size = min(N_SUBCOHORT, len(cohort))
-    cc_subcohort = set(np.random.choice(list(cohort), size, replace=False))
-    cc_m = len(cohort - cases)
-    cc_ms = len(cc_subcohort & (cohort - cases))
+    cohort = np.ones(n_persons, dtype=bool)
+    cases = endpoint_members(bitmaps, "DEATH", n_persons)
+    size = min(N_SUBCOHORT, n_persons)
+    cc_subcohort = np.zeros(n_persons, dtype=bool)
+    cc_subcohort[np.random.choice(n_persons, size, replace=False)] = True
+    cc_m = (cohort & ~ cases).sum()
+    cc_ms = (cc_subcohort & cohort & ~ cases).sum()
     cc_pm = cc_ms / cc_m
     cc_weight_non_cases = 1 / cc_pm
     cc_sample = cases | cc_subcohort
 
-    # Reduce the original population to be the smaller "sample" pop from the case-cohort study
-    df_events = df_events.loc[df_events.FINNGENID.isin(cc_sample), :]
-    df_info = df_info.loc[df_info.FINNGENID.isin(cc_sample), :]
-
-    # Assign case-cohort weight to each individual
-    df_weights = pd.DataFrame({"FINNGENID": list(cc_sample)})
-    df_weights["weight"] = 1.0
-    df_weights.loc[~ df_weights.FINNGENID.isin(cases), "weight"] = cc_weight_non_cases
-    df_info = df_info.merge(df_weights, on="FINNGENID")
-
     # Define groups for the unexposed/exposed study
-    with_endp = set(df_events.loc[df_events.ENDPOINT == endpoint.NAME, "FINNGENID"])
-    unexp           = cohort - with_endp - cases
-    unexp_death     = cases - with_endp
-    unexp_exp       = with_endp - cases
+    with_endp = has_endp & cc_sample
+    unexp           = cohort & ~ with_endp & ~ cases
+    unexp_death     = cases & ~ with_endp
+    unexp_exp       = with_endp & ~ cases
     unexp_exp_death = with_endp & cases
-    assert len(cohort) == (len(unexp) + len(unexp_death) + len(unexp_exp) + len(unexp_exp_death))
+    assert cohort.sum() == (unexp.sum() + unexp_death.sum() + unexp_exp.sum() + unexp_exp_death.sum())
 
     # Check that we have enough individuals to do the study
-    nindivs = len(unexp_exp_death)
+    nindivs = unexp_exp_death.sum()
     if nindivs < MIN_INDIVS:
         raise NotEnoughIndividuals(f"Not enough individuals having endpoint({endpoint.NAME}) and death: {nindivs} < {MIN_INDIVS}")
-    elif len(unexp_exp) < MIN_INDIVS:
-        raise NotEnoughIndividuals(f"Not enougth individuals in group: endpoint({endpoint.NAME}) + no death, {len(unexp_exp)} < {MIN_INDIVS}")
+    elif unexp_exp.sum() < MIN_INDIVS:
+        raise NotEnoughIndividuals(f"Not enougth individuals in group: endpoint({endpoint.NAME}) + no death, {unexp_exp.sum()} < {MIN_INDIVS}")
 
-    # Merge endpoint data with info data
-    df_endp = (
-        df_events.loc[df_events.ENDPOINT == endpoint.NAME, ["FINNGENID", "AGE"]]
-        .rename(columns={"AGE": "ENDPOINT_AGE"})
-    )
-    df_sample = df_info.merge(df_endp, on="FINNGENID", how="left")  # left join to keep individuals not having the endpoint
+    # Reduce the original population to be the smaller "sample" pop
+    # from the case-cohort study, and add the endpoint data
+    df_sample = df_info.loc[cc_sample, :].copy()
+    # Assign case-cohort weight to each individual
+    df_sample["weight"] = np.where(cases[cc_sample], 1.0, cc_weight_non_cases)
+    df_sample["ENDPOINT_AGE"] = endpoint_ages(df_events, endpoint.NAME, n_persons)[cc_sample]
 
     # Move endpoint to study start if it happened before the study
     exposed_before_study = df_sample.ENDPOINT_AGE < df_sample.START_AGE
     df_sample.loc[exposed_before_study, "ENDPOINT_AGE"] = df_sample.loc[exposed_before_study, "START_AGE"]
 
     # Unexposed
-    df_unexp = df_sample.loc[df_sample.FINNGENID.isin(unexp), :].copy()
+    df_unexp = df_sample.loc[unexp[cc_sample], :].copy()
     df_unexp["duration"] = df_unexp.END_AGE - df_unexp.START_AGE
     df_unexp["endpoint"] = False
     df_unexp["death"] = False
 
     # Unexposed -> Death
-    df_unexp_death = df_sample.loc[df_sample.FINNGENID.isin(unexp_death), :].copy()
+    df_unexp_death = df_sample.loc[unexp_death[cc_sample], :].copy()
     df_unexp_death["duration"] = df_unexp_death.DEATH_AGE - df_unexp_death.START_AGE
     df_unexp_death["endpoint"] = False
     df_unexp_death["death"] = True
 
     # Unexposed -> Exposed: need time-window splitting
-    df_unexp_exp = df_sample.loc[df_sample.FINNGENID.isin(unexp_exp), :].copy()
+    df_unexp_exp = df_sample.loc[unexp_exp[cc_sample], :].copy()
     # Phase 1: unexposed
     df_unexp_exp_p1 = df_unexp_exp.copy()
     df_unexp_exp_p1["duration"] = df_unexp_exp_p1.ENDPOINT_AGE - df_unexp_exp_p1.START_AGE
@@ -294,15 +386,12 @@ def prep_coxhr(endpoint, df_events, df_info):
             duration = df_unexp_exp_p2.END_AGE - df_unexp_exp_p2.ENDPOINT_AGE
         else:
             _min_lag, max_lag = lag
-            duration = df_unexp_exp_p2.apply(
-                lambda r: min(r.END_AGE - r.ENDPOINT_AGE, max_lag),
-                axis="columns"
-            )
+            duration = (df_unexp_exp_p2.END_AGE - df_unexp_exp_p2.ENDPOINT_AGE).clip(upper=max_lag)
         df_unexp_exp_p2[cols["duration"]] = duration
         df_unexp_exp_p2[cols["death"]] = False
 
     # Unexposed -> Exposed -> Death: need time-window splitting
-    df_tri = df_sample.loc[df_sample.FINNGENID.isin(unexp_exp_death), :].copy()
+    df_tri = df_sample.loc[unexp_exp_death[cc_sample], :].copy()
     # Phase 1: unexposed
     df_tri_p1 = df_tri.copy()
     df_tri_p1["duration"] = df_tri_p1.ENDPOINT_AGE - df_tri_p1.START_AGE
@@ -317,10 +406,7 @@ def prep_coxhr(endpoint, df_events, df_info):
             death = True
         else:
             min_lag, max_lag = lag
-            duration = df_tri_p2.apply(
-                lambda r: min(r.DEATH_AGE - r.ENDPOINT_AGE, max_lag),
-                axis="columns"
-            )
+            duration = (df_tri_p2.DEATH_AGE - df_tri_p2.ENDPOINT_AGE).clip(upper=max_lag)
             death_time = df_tri_p2.DEATH_AGE - df_tri_p2.ENDPOINT_AGE
             death = (death_time >= min_lag) & (death_time <= max_lag)
         df_tri_p2[cols["duration"]] = duration
@@ -375,36 +461,34 @@ def prep_lifelines(cols, df_unexp, df_unexp_death, df_unexp_exp_p1, df_unexp_exp
     return nindivs, df_lifelines
 
 
-def compute_coxhr(endpoint, df, lag, nindivs, res_writer):
+def compute_coxhr(endpoint, df, lag, nindivs):
+    """Fit the Cox model and return its result row"""
     logger.info(f"Running Cox regression")
     # Handle sex-specific endpoints
     is_sex_specific = pd.notna(endpoint.SEX)
+    covariates = ["endpoint", "BIRTH_TYEAR", "female"]
     if is_sex_specific:
-        df = df.drop(columns=["female"])
+        covariates.remove("female")
 
     # Fit Cox model
-    cph = CoxPHFitter()
-
-    cph.fit(
-        df,
-        duration_col="duration",
-        event_col="death",
+    cph = fit_coxph(
+        df.duration.values,
+        df.death.values,
+        df.loc[:, covariates].values,
         # For the case-cohort study we need weights and robust errors:
-        weights_col="weight",
+        weights=df.weight.values,
+        covariates=covariates,
         robust=True
     )
-
+    summary = coxph_summary(cph)
 
     # Compute absolute risk
     mean_indiv = {
-        "BIRTH_TYEAR": [1959.0],
-        "endpoint": [True],
-        "female": [0.5]
+        "BIRTH_TYEAR": 1959.0,
+        "endpoint": True,
+        "female": 0.5
     }
 
-    if is_sex_specific:
-        mean_indiv.pop("female")
-
     if lag is None:
         predict_at = STUDY_ENDS - STUDY_STARTS
         lag_value = None
@@ -413,40 +497,41 @@ def compute_coxhr(endpoint, df, lag, nindivs, res_writer):
         predict_at = max_lag
         lag_value = max_lag
 
-    surv_probability = cph.predict_survival_function(
-        pd.DataFrame(mean_indiv),
+    surv_probability = predict_survival(
+        cph,
+        [mean_indiv[covariate] for covariate in covariates],
         times=[predict_at]
-    ).values[0][0]
+    )[0]
     absolute_risk = 1 - surv_probability
 
-    norm_mean = cph._norm_mean
+    norm_mean = pd.Series(cph.norm_mean, index=cph.covariates)
     # Get values out of the fitted model
-    endp_coef = cph.params_["endpoint"]
-    endp_se = cph.standard_errors_["endpoint"]
+    endp_coef = summary.coef["endpoint"]
+    endp_se = summary["se(coef)"]["endpoint"]
     endp_hr = np.exp(endp_coef)
     endp_ci_lower = np.exp(endp_coef - 1.96 * endp_se)
     endp_ci_upper = np.exp(endp_coef + 1.96 * endp_se)
-    endp_pval = cph.summary.p["endpoint"]
-    endp_zval = cph.summary.z["endpoint"]
+    endp_pval = summary.p["endpoint"]
+    endp_zval = summary.z["endpoint"]
     endp_norm_mean = norm_mean["endpoint"]
 
-    year_coef = cph.params_["BIRTH_TYEAR"]
-    year_se = cph.standard_errors_["BIRTH_TYEAR"]
+    year_coef = summary.coef["BIRTH_TYEAR"]
+    year_se = summary["se(coef)"]["BIRTH_TYEAR"]
     year_hr = np.exp(year_coef)
     year_ci_lower = np.exp(year_coef - 1.96 * year_se)
     year_ci_upper = np.exp(year_coef + 1.96 * year_se)
-    year_pval = cph.summary.p["BIRTH_TYEAR"]
-    year_zval = cph.summary.z["BIRTH_TYEAR"]
+    year_pval = summary.p["BIRTH_TYEAR"]
+    year_zval = summary.z["BIRTH_TYEAR"]
     year_norm_mean = norm_mean["BIRTH_TYEAR"]
 
     if not is_sex_specific:
-        sex_coef = cph.params_["female"]
-        sex_se = cph.standard_errors_["female"]
+        sex_coef = summary.coef["female"]
+        sex_se = summary["se(coef)"]["female"]
         sex_hr = np.exp(sex_coef)
         sex_ci_lower = np.exp(sex_coef - 1.96 * sex_se)
         sex_ci_upper = np.exp(sex_coef + 1.96 * sex_se)
-        sex_pval = cph.summary.p["female"]
-        sex_zval = cph.summary.z["female"]
+        sex_pval = summary.p["female"]
+        sex_zval = summary.z["female"]
         sex_norm_mean = norm_mean["female"]
     else:
         sex_coef = np.nan
@@ -459,16 +544,11 @@ def compute_coxhr(endpoint, df, lag, nindivs, res_writer):
         sex_norm_mean = np.nan
 
     # Save the baseline cumulative hazard (bch)
-    df_bch = cph.baseline_cumulative_hazard_
-
-    baseline_cumulative_hazard = bch_at(df_bch, predict_at)
-
-    bch_values = {}
-    for time in BCH_TIMEPOINTS:
-        bch_values[time] = bch_at(df_bch, time)
+    baseline_cumulative_hazard = cumulative_hazard_at(cph, predict_at)
+    bch_values = dict(zip(BCH_TIMEPOINTS, cumulative_hazard_at(cph, BCH_TIMEPOINTS)))
 
     # Save values
-    res_writer.writerow([
+    res_row = [
         endpoint.NAME,
         lag_value,
         nindivs,
@@ -508,17 +588,10 @@ def compute_coxhr(endpoint, df, lag, nindivs, res_writer):
         bch_values[17.5],
         bch_values[20],
         bch_values[21.99]
-    ])
+    ]
     logger.info("done running Cox regression")
 
-
-def bch_at(df, time):
-    try:
-        res = df.loc[time, "baseline cumulative hazard"]
-    except KeyError:
-        # Index of the BCH dataframe are floats, which may not be exact values, so we check for the closest one
-        res = interpolate_at_times(df, [time])[0]
-    return res
+    return res_row
 
 
 if __name__ == '__main__':
@@ -527,11 +600,13 @@ if __name__ == '__main__':
     INPUT_INFO = Path(argv[3])
     OUTPUT = Path(argv[4])
     TIMINGS = Path(argv[5])
+    N_WORKERS = int(argv[6]) if len(argv) > 6 else 1
 
     main(
         INPUT_DEFINITIONS,
         INPUT_DENSE_FEVENTS,
         INPUT_INFO,
         OUTPUT,
-        TIMINGS
+        TIMINGS,
+        N_WORKERS
     )
@@ -0,0 +1,24 @@
+import numpy as np
+from lifelines import AalenJohansenFitter
+from risteys_pipeline.aalen_johansen import fit_aalen_johansen, predict_cif
+
+
+def test_fit_aalen_johansen():
+    """The CIF matches the lifelines Aalen-Johansen estimate with left truncation, weights, and competing events"""
+    rng = np.random.default_rng(0)
+    n_persons = 1000
+    start = rng.uniform(0, 60, n_persons)
+    stop = start + rng.exponential(20, n_persons)
+    outcome = rng.choice([0, 1, 2], size=n_persons, p=[0.5, 0.3, 0.2])
+    weights = rng.uniform(0.5, 3, n_persons)
+    ages = np.arange(0, 120, 0.5)
+
+    estimate = fit_aalen_johansen(stop, outcome, weights=weights, start=start)
+    res = predict_cif(estimate, ages)
+
+    model = AalenJohansenFitter(calculate_variance=False)
+    model.fit(stop, outcome, event_of_interest=1, entry=start, weights=weights)
+    expected = model.predict(ages).values.ravel()
+
+    assert np.allclose(res, expected, rtol=1e-10, equal_nan=True)
+    assert np.isnan(res[0])
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lifelines import CoxPHFitter
+from risteys_pipeline.coxph import (
+    ConvergenceError,
+    coxph_summary,
+    fit_coxph,
+    fit_coxph_batch,
+    predict_survival,
+    prepare_risk_sets,
+)
+
+
+def make_data(n_rows, rng):
+    """Weighted survival data with tied exit times"""
+    design = np.column_stack([
+        rng.random(n_rows) < 0.3,
+        rng.uniform(1930, 2000, n_rows),
+        rng.random(n_rows) < 0.5,
+    ]).astype(np.float64)
+    event_time = rng.exponential(15 * np.exp(-0.5 * design[:, 0] + 0.01 * (design[:, 1] - 1960)))
+    censoring_time = rng.uniform(0, 25, n_rows)
+    stop = np.round(np.minimum(event_time, censoring_time), 1) + 0.1
+    event = event_time <= censoring_time
+    weights = np.where(event, 1.0, rng.choice([1.0, 8.0], n_rows))
+
+    return stop, event, design, weights
+
+
+def test_fit_coxph():
+    """The fit matches lifelines' CoxPHFitter with weights, robust variance, and ties"""
+    rng = np.random.default_rng(0)
+    stop, event, design, weights = make_data(2000, rng)
+    covariates = ["exposure", "birth_year", "female"]
+
+    estimate = fit_coxph(stop, event, design, weights=weights, covariates=covariates)
+    summary = coxph_summary(estimate)
+
+    df = pd.DataFrame(design, columns=covariates).assign(stop=stop, event=event, weight=weights)
+    cph = CoxPHFitter()
+    cph.fit(df, duration_col="stop", event_col="event", weights_col="weight", robust=True)
+    cols = ["coef", "se(coef)", "coef lower 95%", "coef upper 95%", "z", "p"]
+
+    assert estimate.converged
+    assert np.allclose(summary[cols].values, cph.summary[cols].values, rtol=1e-8)
+    assert np.allclose(estimate.norm_mean, cph._norm_mean.values)
+    assert np.allclose(estimate.times, cph.baseline_cumulative_hazard_.index.values)
+    assert np.allclose(estimate.baseline_cumulative_hazard, cph.baseline_cumulative_hazard_.values[:, 0], rtol=1e-8)
+
+    individual = pd.DataFrame({"exposure": [1.0], "birth_year": [1959.0], "female": [0.5]})
+    expected = cph.predict_survival_function(individual, times=[5.0, 12.34]).values[:, 0]
+    assert np.allclose(predict_survival(estimate, individual.values[0], [5.0, 12.34]), expected, rtol=1e-8)
+
+
+def test_fit_coxph_entry():
+    """With entry times, the fit matches lifelines' fit of left-truncated data"""
+    rng = np.random.default_rng(1)
+    stop, event, design, weights = make_data(1000, rng)
+    start = rng.uniform(0, 0.5, stop.shape[0]) * stop
+
+    estimate = fit_coxph(stop, event, design, weights=weights, start=start)
+
+    df = pd.DataFrame(design, columns=["a", "b", "c"]).assign(start=start, stop=stop, event=event, weight=weights)
+    cph = CoxPHFitter()
+    cph.fit(df, entry_col="start", duration_col="stop", event_col="event", weights_col="weight", robust=True)
+
+    assert np.allclose(estimate.params, cph.params_.values, rtol=1e-8)
+    assert np.allclose(estimate.standard_errors, cph.standard_errors_.values, rtol=1e-8)
+    assert np.allclose(estimate.times, cph.baseline_cumulative_hazard_.index.values)
+    assert np.allclose(estimate.baseline_cumulative_hazard, cph.baseline_cumulative_hazard_.values[:, 0], rtol=1e-8)
+
+
+def test_fit_coxph_batch():
+    """Each model of a batch is the same as fitting it alone"""
+    rng = np.random.default_rng(2)
+    stop, event, design, weights = make_data(1000, rng)
+    exposures = np.column_stack([design[:, 0], rng.random(1000) < 0.5, rng.normal(size=1000)])
+
+    risk_sets = prepare_risk_sets(stop, event, weights)
+    estimates, _ = fit_coxph_batch(risk_sets, exposures, design[:, 1:])
+
+    for dd in range(3):
+        expected = fit_coxph(stop, event, np.column_stack([exposures[:, dd], design[:, 1:]]), weights=weights)
+        assert np.allclose(estimates[dd].params, expected.params, rtol=1e-10)
+        assert np.allclose(estimates[dd].standard_errors, expected.standard_errors, rtol=1e-10)
+
+
+def test_fit_coxph_collinear():
+    """A singular model raises a ConvergenceError, without failing the other models of a batch"""
+    rng = np.random.default_rng(3)
+    stop, event, design, weights = make_data(500, rng)
+    exposures = np.column_stack([design[:, 0], 2 * design[:, 2]])
+
+    risk_sets = prepare_risk_sets(stop, event, weights)
+    estimates, _ = fit_coxph_batch(risk_sets, exposures, design[:, 1:])
+
+    assert estimates[0] is not None
+    assert estimates[1] is None
+    with pytest.raises(ConvergenceError):
+        fit_coxph(stop, event, np.column_stack([exposures[:, 1], design[:, 1:]]), weights=weights)
+
+
+def test_fit_coxph_warm_start():
+    """A fit started from its own estimate stops at the first iteration, with the same estimate"""
+    rng = np.random.default_rng(4)
+    stop, event, design, weights = make_data(1000, rng)
+
+    cold = fit_coxph(stop, event, design, weights=weights)
+    warm = fit_coxph(stop, event, design, weights=weights, init=cold.params)
+
+    assert cold.n_iterations > 1
+    assert warm.n_iterations == 1
+    assert np.allclose(warm.params, cold.params, rtol=1e-8)
+    assert np.allclose(warm.standard_errors, cold.standard_errors, rtol=1e-8)
@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+from risteys_pipeline.finngen.medication_stats_logit import (
+    MIN_CASES,
+    POST_DURATION,
+    PRE_DURATION,
+    PRE_EXCLUSION,
+    PRED_FEMALE,
+    PRED_FG_ENDPOINT_YEAR,
+    PRED_YOB,
+    STUDY_DURATION,
+    STUDY_ENDS,
+    fit_logit_batch,
+    get_endpoint_cases,
+    load_batch_data,
+    load_first_events,
+    main_batch,
+    merge_logit_data,
+)
+
+
+def test_fit_logit_batch():
+    """Each batched model matches a statsmodels fit on its own table of cases and controls"""
+    rng = np.random.default_rng(0)
+    n_persons = 500
+    exog = np.column_stack([
+        np.ones(n_persons),
+        rng.normal(size=n_persons),
+        rng.integers(0, 2, size=n_persons),
+    ])
+    is_case = rng.random((n_persons, 3)) < [[0.1, 0.3, 0.5]]
+    # Some individuals are both case and control
+    is_control = ~is_case | (rng.random((n_persons, 3)) < 0.2)
+
+    params, cov_params, failed = fit_logit_batch(exog, is_case, is_control)
+
+    assert not failed.any()
+    for dd in range(3):
+        endog = np.concatenate([np.ones(is_case[:, dd].sum()), np.zeros(is_control[:, dd].sum())])
+        model_exog = np.concatenate([exog[is_case[:, dd]], exog[is_control[:, dd]]])
+        res = sm.Logit(endog, model_exog).fit(disp=False)
+
+        assert np.allclose(params[dd], res.params, rtol=1e-10)
+        assert np.allclose(cov_params[dd], res.cov_params(), rtol=1e-8)
+
+
+def test_fit_logit_batch_singular():
+    """A model with a singular Hessian is flagged without failing the other models"""
+    rng = np.random.default_rng(0)
+    n_persons = 200
+    exog = np.column_stack([
+        np.ones(n_persons),
+        rng.normal(size=n_persons),
+        np.arange(n_persons) < 100,
+    ])
+    is_case = rng.random((n_persons, 2)) < 0.3
+    is_control = ~is_case
+    # The last covariate is always 0 in the second model, so it can't be estimated
+    is_case[:100, 1] = False
+    is_control[:100, 1] = False
+
+    _, _, failed = fit_logit_batch(exog, is_case, is_control)
+
+    assert failed.tolist() == [False, True]
+
+
+@pytest.mark.parametrize("with_year", [True, False])
+def test_load_first_events_long_format(tmp_path, with_year):
+    """The event year is read from YEAR, or from APPROX_EVENT_DAY when the file has no YEAR column"""
+    fevents = pd.DataFrame({
+        "FINNGENID": ["FG1", "FG2", "FG2", "FG3"],
+        "ENDPOINT": ["A", "A", "B", "A"],
+        "CONTROL_CASE_EXCL": [1, 1, 1, 2],
+        "AGE": [50.5, 60.25, 61.0, 70.0],
+        "APPROX_EVENT_DAY": ["2000-06-01", "2010-01-15", "2011-12-31", None],
+    })
+    if with_year:
+        fevents["YEAR"] = [2000.0, 2010.0, 2011.0, None]
+    fevents.to_parquet(tmp_path / "fevents.parquet")
+
+    df_cases = load_first_events(tmp_path / "fevents.parquet", ["A"])
+
+    assert list(df_cases) == ["A"]
+    assert df_cases["A"].FINNGENID.tolist() == ["FG1", "FG2"]
+    assert df_cases["A"].fg_endpoint_age.tolist() == [50.5, 60.25]
+    assert df_cases["A"].fg_endpoint_year.tolist() == [2000, 2010]
+
+
+@pytest.fixture
+def medication_files(tmp_path):
+    """Input files of the batch mode: endpoint A, and endpoint B which is sex-specific"""
+    rng = np.random.default_rng(0)
+    n_persons = 400
+    fgids = np.array([f"FG{ii}" for ii in range(n_persons)])
+
+    pd.DataFrame({
+        "FINNGENID": fgids,
+        "SEX": rng.choice(["female", "male"], n_persons),
+    }).to_csv(tmp_path / "info.csv", index=False)
+    pd.DataFrame({"NAME": ["A", "B"], "SEX": [np.nan, 1.0]}).to_csv(tmp_path / "defs.csv", index=False)
+
+    age = rng.uniform(40, 70, n_persons)
+    year = rng.uniform(2003, 2020, n_persons)
+    fevents = pd.concat([
+        pd.DataFrame({
+            "FINNGENID": fgids[has],
+            "ENDPOINT": endpoint,
+            "CONTROL_CASE_EXCL": 1,
+            "AGE": age[has] + shift,
+            "YEAR": year[has] + shift,
+        })
+        for endpoint, has, shift in [
+            ("A", rng.random(n_persons) < 0.8, 0.0),
+            ("B", rng.random(n_persons) < 0.6, 0.05),
+        ]
+    ])
+    fevents.to_parquet(tmp_path / "fevents.parquet")
+
+    # Several purchases per individual, some of them in the post-endpoint window
+    n_events = 3000
+    person = rng.integers(0, n_persons, n_events)
+    delta = np.where(rng.random(n_events) < 0.5, rng.uniform(0, POST_DURATION, n_events), rng.uniform(-2, 1, n_events))
+    code1 = rng.choice(["A01AA01", "A01AA02", "B02BB01", "C03CC01", "D04DD01"], n_events, p=[0.3, 0.2, 0.3, 0.15, 0.05])
+    pd.DataFrame({
+        "FINNGENID": fgids[person],
+        "EVENT_AGE": age[person] + delta,
+        "EVENT_YEAR": np.floor(year[person] + delta),
+        "CODE1": code1,
+        "ATC": [code[:5] for code in code1],
+    }).sort_values("FINNGENID").to_parquet(tmp_path / "purchases.parquet", index=False)
+
+    return tmp_path / "fevents.parquet", tmp_path / "purchases.parquet", tmp_path / "defs.csv", tmp_path / "info.csv"
+
+
+def per_drug_scores(df, fg_endpoint, is_sex_specific):
+    """Scores and counts of each drug, building the cases and controls and fitting the model of one drug at a time"""
+    study_starts = STUDY_ENDS - STUDY_DURATION
+    df = df.loc[(df.EVENT_YEAR >= study_starts) & (df.fg_endpoint_year >= study_starts)]
+    columns = ["yob", "fg_endpoint_year"] + ([] if is_sex_specific else ["female"])
+    predict_data = np.array([1.0, PRED_YOB, PRED_FG_ENDPOINT_YEAR] + ([] if is_sex_specific else [PRED_FEMALE]))
+
+    score_rows = []
+    count_rows = []
+    for drug in df.ATC.unique():
+        is_drug = df.ATC == drug
+        pre_endpoint = is_drug & (df.EVENT_AGE >= df.fg_endpoint_age - PRE_EXCLUSION - PRE_DURATION) & (df.EVENT_AGE <= df.fg_endpoint_age - PRE_EXCLUSION)
+        post_endpoint = is_drug & (df.EVENT_AGE >= df.fg_endpoint_age) & (df.EVENT_AGE <= df.fg_endpoint_age + POST_DURATION)
+        cases = ~ pre_endpoint & post_endpoint
+
+        df_cases = df.loc[cases].groupby("FINNGENID").min()
+        df_controls = df.loc[~ cases].groupby("FINNGENID").min()
+        if df_cases.shape[0] < MIN_CASES:
+            continue
+
+        count_rows += [[fg_endpoint, drug, full_atc, count] for full_atc, count in df_cases.groupby("CODE1").size().items()]
+
+        endog = np.concatenate([np.ones(df_cases.shape[0]), np.zeros(df_controls.shape[0])])
+        exog = sm.add_constant(pd.concat([df_cases[columns], df_controls[columns]]).to_numpy())
+        res = sm.Logit(endog, exog).fit(disp=False)
+        pred_lin = res.params @ predict_data
+        stderr = np.sqrt(predict_data @ res.cov_params() @ predict_data)
+        score_rows.append([
+            fg_endpoint,
+            drug,
+            1 / (1 + np.exp(-pred_lin)),
+            stderr * np.exp(pred_lin) / (1 + np.exp(pred_lin))**2,
+            df.loc[is_drug, "FINNGENID"].nunique(),
+        ])
+
+    return score_rows, count_rows
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_main_batch_per_drug(medication_files, tmp_path, n_workers):
+    """The batch mode, fitting all the drugs of an endpoint together, gives the scores of the per-drug models"""
+    first_events, purchases, defs, info = medication_files
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    main_batch(["A", "B"], first_events, purchases, defs, info, output_dir, n_workers, consolidate=True)
+
+    data = load_batch_data(["A", "B"], first_events, purchases, defs, info)
+    expected_scores = []
+    expected_counts = []
+    for fg_endpoint, is_sex_specific in [("A", False), ("B", True)]:
+        df_logit = merge_logit_data(data["info"], get_endpoint_cases(data["first_events"], fg_endpoint), data["drug"])
+        score_rows, count_rows = per_drug_scores(df_logit, fg_endpoint, is_sex_specific)
+        expected_scores += score_rows
+        expected_counts += count_rows
+    expected_scores = pd.DataFrame(expected_scores, columns=["endpoint", "drug", "score", "stderr", "n_indivs"])
+    expected_counts = pd.DataFrame(expected_counts, columns=["endpoint", "drug", "full_ATC", "count"])
+
+    scores = pd.read_csv(output_dir / "scores.csv").sort_values(["endpoint", "drug"], ignore_index=True)
+    counts = pd.read_csv(output_dir / "counts.csv").sort_values(["endpoint", "drug", "full_ATC"], ignore_index=True)
+
+    assert scores.groupby("endpoint").size().to_dict() == {"A": 4, "B": 4}
+    pd.testing.assert_frame_equal(
+        scores.drop(columns=["pvalue"]),
+        expected_scores.sort_values(["endpoint", "drug"], ignore_index=True),
+        rtol=1e-8
+    )
+    pd.testing.assert_frame_equal(counts, expected_counts.sort_values(["endpoint", "drug", "full_ATC"], ignore_index=True))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from risteys_pipeline.utils.snapshot import get_fingerprint, read_snapshot, write_snapshot
+
+
+def test_snapshot_roundtrip(tmp_path):
+    """DataFrames read back from a snapshot are equal to the written ones"""
+    input_path = tmp_path / "input.csv"
+    input_path.write_text("A\n")
+    fingerprint = get_fingerprint([input_path], {"param": 1})
+
+    persons = pd.DataFrame(
+        {
+            "personid": pd.array(["P1", "P2"], dtype="string[pyarrow]"),
+            "birth_year": [1950.5, np.nan],
+        }
+    ).rename_axis("person_idx")
+    events = pd.DataFrame(
+        {
+            "person_idx": np.array([1, 0], dtype=np.int32),
+            "endpoint": pd.Categorical(["A", "B"], categories=["A", "B", "C"]),
+        }
+    )
+
+    assert read_snapshot(tmp_path, fingerprint, ["persons", "events"]) is None
+    write_snapshot({"persons": persons, "events": events}, tmp_path, fingerprint)
+    res = read_snapshot(tmp_path, fingerprint, ["persons", "events"])
+
+    pd.testing.assert_frame_equal(res["persons"], persons)
+    pd.testing.assert_frame_equal(res["events"], events)
+    assert get_fingerprint([input_path], {"param": 2}) != fingerprint
+
+
+def test_write_snapshot_failure(tmp_path):
+    """A snapshot that fails to be written leaves no snapshot and no temporary directory"""
+    persons = pd.DataFrame({"personid": ["P1", "P2"]})
+    # Mixed types can't be converted to an Arrow column
+    events = pd.DataFrame({"age": [1.0, "NA"]})
+
+    with pytest.raises(pa.ArrowException):
+        write_snapshot({"persons": persons, "events": events}, tmp_path, "fingerprint")
+
+    assert list(tmp_path.iterdir()) == []
+    assert read_snapshot(tmp_path, "fingerprint", ["persons", "events"]) is None
+
+
+def test_write_snapshot_prunes_outdated(tmp_path):
+    """Writing a snapshot removes the snapshots of other fingerprints, but not the ones being written"""
+    input_path = tmp_path / "input.csv"
+    input_path.write_text("A\n")
+    snapshot_dir = tmp_path / "snapshots"
+    old = get_fingerprint([input_path], {"param": 1})
+    new = get_fingerprint([input_path], {"param": 2})
+
+    df = pd.DataFrame({"personid": ["P1", "P2"]})
+    write_snapshot({"persons": df}, snapshot_dir, old)
+    (snapshot_dir / f".{old}.123.tmp").mkdir()
+
+    write_snapshot({"persons": df}, snapshot_dir, new)
+
+    assert sorted(path.name for path in snapshot_dir.iterdir()) == [f".{old}.123.tmp", new]
+    assert read_snapshot(snapshot_dir, old, ["persons"]) is None
+    assert read_snapshot(snapshot_dir, new, ["persons"])["persons"].personid.tolist() == ["P1", "P2"]
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from risteys_pipeline.store import (
+    build_person_table,
+    build_event_table,
+    build_event_table_from_arrow,
+    endpoint_events,
+    index_by_endpoint,
+    lookup,
+    set_endpoint_offsets,
+)
+
+
+def test_build_event_table():
+    """Events point into the person table and unknown persons/endpoints are dropped"""
+    persons = build_person_table(
+        pd.DataFrame({"personid": ["P1", "P2", "P3"], "birth_year": [1950.0, 1960.0, 1970.0]})
+    )
+    first_events = pd.DataFrame(
+        {
+            "personid": ["P3", "P1", "P4", "P2"],
+            "endpoint": ["A", "B", "A", "C"],
+            "age": [10.0, 20.0, 30.0, 40.0],
+        }
+    )
+    events = build_event_table(first_events, persons, ["A", "B"])
+
+    assert events["person_idx"].dtype == np.int32
+    assert events["person_idx"].tolist() == [2, 0]
+    assert events["endpoint"].tolist() == ["A", "B"]
+    assert list(events["endpoint"].cat.categories) == ["A", "B"]
+    assert lookup(events, persons, "birth_year").tolist() == [1970.0, 1950.0]
+
+
+def test_build_event_table_from_arrow():
+    """The Arrow and pandas inputs give the same event table"""
+    persons = build_person_table(pd.DataFrame({"personid": ["P1", "P2", "P3"]}))
+    first_events = pd.DataFrame(
+        {
+            "personid": ["P3", "P1", "P4", "P2"],
+            "endpoint": ["A", "B", "A", "C"],
+            "age": [10.0, 20.0, 30.0, 40.0],
+        }
+    )
+    expected = build_event_table(first_events, persons, ["A", "B"])
+    res = build_event_table_from_arrow(pa.table(first_events), persons, ["A", "B"])
+
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_endpoint_events():
+    """The CSR slice matches a scan of the whole event table"""
+    events = pd.DataFrame(
+        {
+            "person_idx": np.array([0, 1, 2, 3, 4], dtype=np.int32),
+            "endpoint": pd.Categorical(["B", "A", "B", "C", "A"], categories=["A", "B", "C", "D"]),
+            "age": [1.0, 2.0, 3.0, 4.0, 5.0],
+        }
+    )
+    indexed = index_by_endpoint(events)
+
+    assert indexed.attrs["endpoint_offsets"].tolist() == [0, 2, 4, 5, 5]
+    for endpoint in ["A", "B", "C", "D", "E"]:
+        expected = endpoint_events(events, endpoint)
+        res = endpoint_events(indexed, endpoint)
+        assert res["person_idx"].tolist() == expected["person_idx"].tolist()
+
+
+def test_endpoint_events_derived_table():
+    """A table derived from an indexed one doesn't use the index it carries over"""
+    events = pd.DataFrame(
+        {
+            "person_idx": np.array([0, 1, 2, 3, 4, 5], dtype=np.int32),
+            "endpoint": pd.Categorical(["B", "A", "B", "C", "A", "C"], categories=["A", "B", "C"]),
+            "age": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        }
+    )
+    indexed = index_by_endpoint(events)
+    derived = [
+        # Same number of rows, in another order
+        indexed.sort_values("age"),
+        indexed.iloc[::-1],
+        # Rows filtered and appended back
+        pd.concat([indexed.iloc[1:], indexed.iloc[:1]]),
+        # Other categories
+        indexed.assign(endpoint=indexed["endpoint"].cat.reorder_categories(["C", "B", "A"])),
+        # Same codes at the boundaries of the slices, codes [0, 0, 1, 1, 2, 2] to [0, 1, 0, 1, 2, 2]
+        indexed.take([0, 2, 1, 3, 4, 5]),
+        # Not categorical
+        indexed.assign(endpoint=indexed["endpoint"].astype(str)),
+    ]
+
+    for df in derived:
+        assert "endpoint_offsets" in df.attrs
+        for endpoint in ["A", "B", "C"]:
+            res = endpoint_events(df, endpoint)
+            assert sorted(res["person_idx"].tolist()) == sorted(events.loc[events["endpoint"] == endpoint, "person_idx"])
+
+
+def test_endpoint_events_same_boundary_codes():
+    """A derived table with the same row count and codes around the slices doesn't use the index"""
+    events = pd.DataFrame(
+        {
+            "person_idx": np.array([0, 1, 2, 3], dtype=np.int32),
+            "endpoint": pd.Categorical(["A", "A", "A", "B"], categories=["A", "B"]),
+        }
+    )
+    indexed = index_by_endpoint(events)
+    # Codes [0, 0, 0, 1] to [0, 1, 0, 1]
+    derived = indexed.take([0, 3, 1, 3])
+
+    assert endpoint_events(derived, "A")["person_idx"].tolist() == [0, 1]
+    assert endpoint_events(derived, "B")["person_idx"].tolist() == [3, 3]
+
+
+def test_set_endpoint_offsets_unsorted():
+    """Only a table sorted by endpoint code can be indexed"""
+    events = pd.DataFrame({"endpoint": pd.Categorical(["B", "A"], categories=["A", "B"])})
+
+    with pytest.raises(ValueError):
+        set_endpoint_offsets(events)
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+import pytest
+from risteys_pipeline.coxph import ConvergenceError
+from risteys_pipeline.finngen import surv_analysis
+from risteys_pipeline.finngen.surv_analysis import (
+    DEFAULT_STEP_SIZE,
+    LOWER_STEP_SIZE,
+    STUDY_STARTS,
+    compute_coxhr,
+    init_data,
+    load_data,
+    main,
+    prep_case_cohort,
+    prep_coxhr,
+    run_pair,
+)
+
+
+PAIRS = [("P1", "O"), ("P2", "O"), ("P2", "O2")]
+
+
+@pytest.fixture
+def surv_files(tmp_path):
+    """Input files of surv_analysis.py for a cohort smaller than the subcohort size, so the subcohort is the whole cohort"""
+    rng = np.random.default_rng(0)
+    n_persons = 1000
+    fgids = np.array([f"FG{ii}" for ii in range(n_persons)])
+    birth_year = rng.uniform(1930, 1980, n_persons)
+    start_age = STUDY_STARTS - birth_year
+
+    pd.DataFrame({
+        "FINNGENID": fgids,
+        "BL_YEAR": 2010.0,
+        "BL_AGE": 2010.0 - birth_year,
+        "SEX": rng.choice(["female", "male"], n_persons),
+    }).to_csv(tmp_path / "info.csv", index=False)
+
+    # The outcome is more frequent after a prior, some outcomes are
+    # before the study (prevalent) or before the prior (excluded).
+    has_prior = {prior: rng.random(n_persons) < 0.3 for prior in ["P1", "P2"]}
+    has_outcome = {
+        "O": rng.random(n_persons) < np.where(has_prior["P1"], 0.4, 0.15),
+        "O2": rng.random(n_persons) < np.where(has_prior["P2"], 0.4, 0.15),
+    }
+    events = [
+        (endpoint, has, start_age + rng.uniform(low, high, n_persons))
+        for endpoint, has, low, high in [
+            ("P1", has_prior["P1"], -10, 20),
+            ("P2", has_prior["P2"], -10, 20),
+            ("O", has_outcome["O"], -2, 23),
+            ("O2", has_outcome["O2"], -2, 23),
+            ("DEATH", rng.random(n_persons) < 0.1, 20, 23),
+        ]
+    ]
+    pd.concat([
+        pd.DataFrame({"FINNGENID": fgids[has], "ENDPOINT": endpoint, "AGE": age[has]})
+        for endpoint, has, age in events
+    ]).to_parquet(tmp_path / "fevents.parquet")
+
+    pd.DataFrame(PAIRS, columns=["prior", "outcome"]).to_csv(tmp_path / "pairs.csv", index=False)
+    pd.DataFrame({"NAME": ["P1", "P2", "O", "O2"], "SEX": np.nan}).to_csv(tmp_path / "defs.csv", index=False)
+
+    return tmp_path / "pairs.csv", tmp_path / "defs.csv", tmp_path / "fevents.parquet", tmp_path / "info.csv"
+
+
+def test_prep_coxhr_full_subcohort(surv_files):
+    """With the whole cohort as subcohort, the groups and weights are those of the set-based logic"""
+    _pairs, _endpoints, df_events, df_info, bitmaps = load_data(*surv_files)
+    birth_year = df_info.BIRTH_TYEAR.to_numpy()
+
+    for pair in PAIRS:
+        prior, outcome = pair
+        prior_age = {int(person): age for person, age in df_events.loc[df_events.ENDPOINT == prior, ["PERSON", "AGE"]].to_numpy()}
+        outcome_age = {int(person): age for person, age in df_events.loc[df_events.ENDPOINT == outcome, ["PERSON", "AGE"]].to_numpy()}
+
+        prevalent = {person for person, age in outcome_age.items() if birth_year[person] + age < STUDY_STARTS}
+        cohort = set(range(df_info.shape[0])) - prevalent
+        cases = set(outcome_age) & cohort
+        cc_subcohort = cohort
+        cc_weight_non_cases = 1 / (len(cc_subcohort & (cohort - cases)) / len(cohort - cases))
+        exclude = {person for person in set(prior_age) & set(outcome_age) if prior_age[person] > outcome_age[person]}
+        with_prior = (set(prior_age) & cohort) - exclude
+
+        df_unexp, df_unexp_outcome, df_unexp_exp_p1, df_unexp_exp_p2, df_tri_p1, df_tri_p2 = prep_coxhr(
+            pair,
+            prep_case_cohort(outcome, df_events, df_info, bitmaps),
+            df_events,
+            bitmaps
+        )
+
+        assert set(df_unexp.index) == cohort - with_prior - cases
+        assert set(df_unexp_outcome.index) == cases - with_prior
+        assert set(df_unexp_exp_p1.index) == set(df_unexp_exp_p2.index) == with_prior - cases
+        assert set(df_tri_p1.index) == set(df_tri_p2.index) == with_prior & cases
+        for df in [df_unexp, df_unexp_outcome, df_unexp_exp_p1, df_unexp_exp_p2, df_tri_p1, df_tri_p2]:
+            assert df.weight.tolist() == [1.0 if person in cases else cc_weight_non_cases for person in df.index]
+
+
+def test_run_pair_shared_case_cohort(surv_files, monkeypatch):
+    """The pairs of an outcome share its case-cohort setup, with the same results as setting it up for each pair"""
+    _pairs, _endpoints, df_events, df_info, bitmaps = load_data(*surv_files)
+
+    expected = []
+    for pair in PAIRS:
+        init_data(df_events, df_info, bitmaps)
+        res_rows, _timings_rows = run_pair((pair, False))
+        expected += res_rows
+
+    outcomes = []
+    def counted_prep_case_cohort(outcome, *args):
+        outcomes.append(outcome)
+        return prep_case_cohort(outcome, *args)
+    monkeypatch.setattr(surv_analysis, "prep_case_cohort", counted_prep_case_cohort)
+
+    init_data(df_events, df_info, bitmaps)
+    res_rows = []
+    for pair in PAIRS:
+        pair_rows, _timings_rows = run_pair((pair, False))
+        res_rows += pair_rows
+
+    assert outcomes == ["O", "O2"]
+    assert res_rows
+    pd.testing.assert_frame_equal(pd.DataFrame(res_rows), pd.DataFrame(expected))
+
+
+@pytest.mark.parametrize("n_failures", [1, 2])
+def test_run_pair_convergence_error(surv_files, monkeypatch, n_failures):
+    """A fit that doesn't converge is retried with the lower step size from its last iterate, then skipped"""
+    _pairs, _endpoints, df_events, df_info, bitmaps = load_data(*surv_files)
+    init_data(df_events, df_info, bitmaps)
+
+    last_iterate = np.zeros(3)
+    calls = []
+    def failing_compute_coxhr(pair, df, lag, step_size, init, *args):
+        calls.append((lag, step_size, init))
+        if len(calls) <= n_failures:
+            raise ConvergenceError("Convergence failed", params=last_iterate)
+        return compute_coxhr(pair, df, lag, step_size, init, *args)
+    monkeypatch.setattr(surv_analysis, "compute_coxhr", failing_compute_coxhr)
+
+    res_rows, timings_rows = run_pair((PAIRS[0], False))
+
+    # The jobs are run from the last lag, which is None
+    assert calls[0] == (None, DEFAULT_STEP_SIZE, None)
+    assert calls[1][:2] == (None, LOWER_STEP_SIZE)
+    assert calls[1][2] is last_iterate
+    assert [row[2] for row in timings_rows] == [None, None, [5, 15], [1, 5], [0, 1]]
+    lags = [row[2] for row in res_rows]
+    if n_failures == 1:
+        assert res_rows[0][2:4] == [None, LOWER_STEP_SIZE]
+    else:
+        assert None not in lags
+    assert lags[-1] == 5
+
+
+def test_main_workers(surv_files, tmp_path, capfd):
+    """Running the outcomes in a process pool gives the same results as running them in turn,
+    with the case-cohort design study of each outcome set up once"""
+    main(*surv_files, tmp_path / "serial.csv", tmp_path / "serial_timings.csv")
+    capfd.readouterr()
+    main(*surv_files, tmp_path / "pool.csv", tmp_path / "pool_timings.csv", n_workers=2)
+
+    # The workers log to the inherited stderr
+    setups = [
+        line.rsplit(" ", 1)[-1]
+        for line in capfd.readouterr().err.splitlines()
+        if "Setting-up the case-cohort design study for" in line
+    ]
+    assert sorted(setups) == ["O", "O2"]
+
+    sort_cols = ["prior", "outcome", "lag_hr"]
+    expected = pd.read_csv(tmp_path / "serial.csv").sort_values(sort_cols, ignore_index=True)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "pool.csv").sort_values(sort_cols, ignore_index=True),
+        expected
+    )
+    assert not expected.empty
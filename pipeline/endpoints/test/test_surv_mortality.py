@@ -0,0 +1,72 @@
+import importlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+ENDPOINTS_DIR = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def surv_mortality(monkeypatch):
+    """surv_mortality.py, run as a script next to log.py"""
+    monkeypatch.syspath_prepend(str(ENDPOINTS_DIR / "risteys_pipeline" / "utils"))
+    monkeypatch.syspath_prepend(str(ENDPOINTS_DIR))
+    return importlib.import_module("surv_mortality")
+
+
+@pytest.fixture
+def mortality_files(tmp_path, surv_mortality):
+    """Input files of surv_mortality.py for a cohort smaller than the subcohort size, so the subcohort is the whole cohort"""
+    rng = np.random.default_rng(0)
+    n_persons = 1000
+    fgids = np.array([f"FG{ii}" for ii in range(n_persons)])
+    birth_year = rng.uniform(1930, 1960, n_persons)
+    start_age = surv_mortality.STUDY_STARTS - birth_year
+
+    pd.DataFrame({
+        "FINNGENID": fgids,
+        "BL_YEAR": 2010.0,
+        "BL_AGE": 2010.0 - birth_year,
+        "SEX": rng.choice(["female", "male"], n_persons),
+    }).to_csv(tmp_path / "info.csv", index=False)
+
+    # Death is more frequent after endpoint A
+    has_endpoint = {endpoint: rng.random(n_persons) < 0.3 for endpoint in ["A", "B"]}
+    has_death = rng.random(n_persons) < np.where(has_endpoint["A"], 0.3, 0.1)
+    events = [
+        (endpoint, has, start_age + rng.uniform(low, high, n_persons))
+        for endpoint, has, low, high in [
+            ("A", has_endpoint["A"], -10, 15),
+            ("B", has_endpoint["B"], -10, 15),
+            ("DEATH", has_death, 15, 23),
+        ]
+    ]
+    pd.concat([
+        pd.DataFrame({"FINNGENID": fgids[has], "ENDPOINT": endpoint, "AGE": age[has]})
+        for endpoint, has, age in events
+    ]).to_parquet(tmp_path / "fevents.parquet")
+
+    pd.DataFrame({
+        "NAME": ["A", "B", "C"],
+        "SEX": np.nan,
+        "CORE_ENDPOINTS": ["yes", "yes", "no"],
+    }).to_csv(tmp_path / "defs.csv", index=False)
+
+    return tmp_path / "defs.csv", tmp_path / "fevents.parquet", tmp_path / "info.csv"
+
+
+def test_main_workers(surv_mortality, mortality_files, tmp_path):
+    """Running the endpoints in a process pool, with the shared bitmaps, gives the same results as running them in turn"""
+    surv_mortality.main(*mortality_files, tmp_path / "serial.csv", tmp_path / "serial_timings.csv")
+    surv_mortality.main(*mortality_files, tmp_path / "pool.csv", tmp_path / "pool_timings.csv", n_workers=2)
+
+    sort_cols = ["endpoint", "lag_hr"]
+    expected = pd.read_csv(tmp_path / "serial.csv").sort_values(sort_cols, ignore_index=True)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "pool.csv").sort_values(sort_cols, ignore_index=True),
+        expected
+    )
+    assert sorted(expected.endpoint.unique()) == ["A", "B"]
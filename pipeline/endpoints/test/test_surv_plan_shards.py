@@ -0,0 +1,69 @@
+import json
+
+import pandas as pd
+import pyarrow.parquet as parquet
+from risteys_pipeline.finngen.surv_plan_shards import N_SUBCOHORT, pair_costs, plan_shards, write_shard_fevents
+
+
+def test_plan_shards():
+    """The pairs of an outcome are assigned to the same shard"""
+    pairs = [(f"A{ii}", outcome) for outcome in ["B", "C", "D", "E", "F", "G"] for ii in range(5)]
+    costs = [2.0] * len(pairs)
+
+    shards, loads = plan_shards(pairs, costs, 3)
+
+    assert sorted(pair for shard in shards for pair in shard) == sorted(pairs)
+    assert loads == [20.0, 20.0, 20.0]
+    for shard in shards:
+        assert len(shard) == 10
+        assert len({outcome for _prior, outcome in shard}) == 2
+
+
+def test_plan_shards_split_outcome():
+    """An outcome costing more than the average shard is split, in parts of at most the average shard cost"""
+    pairs = [(f"A{ii}", "B") for ii in range(6)] + [("A0", "C"), ("A1", "D")]
+    costs = [10.0] * 6 + [5.0, 5.0]
+
+    shards, loads = plan_shards(pairs, costs, 3)
+
+    assert sorted(pair for shard in shards for pair in shard) == sorted(pairs)
+    assert sorted(loads) == [20.0, 25.0, 25.0]
+    assert [("A4", "B"), ("A5", "B")] in shards
+
+
+def test_plan_shards_more_shards_than_pairs():
+    """Shards without pairs are dropped"""
+    shards, loads = plan_shards([("A", "B"), ("C", "D")], [2.0, 1.0], 5)
+
+    assert shards == [[("A", "B")], [("C", "D")]]
+    assert loads == [2.0, 1.0]
+
+
+def test_pair_costs():
+    """Pairs without timings get a cost predicted from case counts, scaled on the timed pairs"""
+    pairs = [("A", "B"), ("C", "B"), ("A", "D")]
+    timed_costs = {("A", "B"): 2 * (N_SUBCOHORT + 1000)}
+    case_counts = {"A": 500, "B": 500, "C": 0, "D": 4000}
+
+    costs = pair_costs(pairs, timed_costs, case_counts)
+
+    assert costs == [2 * (N_SUBCOHORT + 1000), 2 * (N_SUBCOHORT + 500), 2 * (N_SUBCOHORT + 4500)]
+
+
+def test_write_shard_fevents(tmp_path):
+    """Each shard gets the first events of only its endpoints and DEATH, listed in the metadata"""
+    fevents = pd.DataFrame({
+        "FINNGENID": ["FG1", "FG1", "FG2", "FG2", "FG3"],
+        "ENDPOINT": ["A", "DEATH", "B", "C", "D"],
+        "AGE": [50.0, 80.0, 60.0, 61.0, 70.0],
+        "YEAR": [2000, 2030, 2010, 2011, 2020],
+    })
+    fevents.to_parquet(tmp_path / "fevents.parquet")
+
+    write_shard_fevents(tmp_path / "fevents.parquet", tmp_path, [[("A", "B")], [("C", "D")]])
+
+    shard = parquet.read_table(tmp_path / "shard_0000.parquet")
+    assert shard.column_names == ["FINNGENID", "ENDPOINT", "AGE"]
+    assert sorted(shard.column("ENDPOINT").to_pylist()) == ["A", "B", "DEATH"]
+    assert json.loads(shard.schema.metadata[b"risteys_endpoints"]) == ["A", "B", "DEATH"]
+    assert sorted(parquet.read_table(tmp_path / "shard_0001.parquet").column("ENDPOINT").to_pylist()) == ["C", "D", "DEATH"]
@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from risteys_pipeline.utils.utils import DAYS_IN_YEAR, to_decimal_year
+
+
+def test_to_decimal_year():
+    """Dates as strings, datetimes, and Arrow dates give the same decimal years as the datetime accessors"""
+    dates = pd.Series(pd.to_datetime(["1969-12-31", "1970-01-01", "2000-02-29", "2000-12-31", None, "1912-07-01"]))
+    expected = dates.dt.year + (dates.dt.dayofyear - 1) / DAYS_IN_YEAR
+    strings = dates.dt.strftime("%Y-%m-%d")
+
+    pd.testing.assert_series_equal(to_decimal_year(dates), expected)
+    pd.testing.assert_series_equal(to_decimal_year(strings, date_format="%Y-%m-%d"), expected)
+    assert np.array_equal(to_decimal_year(pa.array(strings)), expected, equal_nan=True)
+    assert np.array_equal(to_decimal_year(pa.array(dates.dt.date, type=pa.date32())), expected, equal_nan=True)
+
+    expected_offset = dates.dt.year + dates.dt.dayofyear / DAYS_IN_YEAR
+    pd.testing.assert_series_equal(to_decimal_year(dates, day_offset=1), expected_offset)
@@ -0,0 +1,116 @@
+import pandas as pd
+import pyarrow.parquet as parquet
+import pytest
+from risteys_pipeline.finngen import wide_to_long_endpoint_first_events as wide_to_long
+
+
+HEADER = "FINNGENID,A,A_NEVT,A_AGE,A_YEAR,A_FU_AGE,A_APPROX_EVENT_DAY,B,B_NEVT,B_AGE,B_YEAR,B_FU_AGE,B_APPROX_EVENT_DAY"
+ROWS = [
+    "FG1,1,2,50.5,2000.5,50.5,2000-06-01,0,0,,NA,80.0,2030-01-01",
+    "FG2,0,0,,,70.0,2020-01-01,1,1,60.25,2010.25,60.25,2010-04-01",
+    "FG3,NA,0,,NA,30.0,1990-01-01,1,3,40.0,2001.0,40.0,2001-01-01",
+    "FG4,1,1,10.0,1970.0,10.0,1970-01-01,1,1,11.0,1971.0,11.0,1971-01-01",
+]
+
+
+@pytest.fixture
+def wide_file(tmp_path):
+    """Wide-format first events, without a trailing newline"""
+    path = tmp_path / "wide.csv"
+    path.write_text("\n".join([HEADER] + ROWS))
+    return path
+
+
+def test_byte_ranges(wide_file):
+    """The ranges cover all the rows and start on line starts, even when asking for more ranges than lines"""
+    data = wide_file.read_bytes()
+    start = len(HEADER) + 1
+
+    for n_ranges in [1, 2, 3, 100]:
+        ranges = wide_to_long.byte_ranges(wide_file, start, n_ranges)
+
+        assert ranges[0][0] == start
+        assert ranges[-1][1] == len(data)
+        assert all(end == beg for (_, end), (beg, _) in zip(ranges[:-1], ranges[1:]))
+        assert all(data[beg - 1:beg] == b"\n" for beg, _ in ranges)
+        assert len(ranges) <= len(ROWS)
+
+
+@pytest.mark.parametrize("keep_all", [False, True])
+def test_wide_to_long_jobs(wide_file, tmp_path, monkeypatch, keep_all):
+    """Converting in parallel or in ranges smaller than a line gives the same table as one range"""
+    wide_to_long.wide_to_long(wide_file, tmp_path / "serial.parquet", keep_all=keep_all)
+    expected = parquet.read_table(tmp_path / "serial.parquet")
+
+    wide_to_long.wide_to_long(wide_file, tmp_path / "jobs.parquet", keep_all=keep_all, jobs=3)
+    monkeypatch.setattr(wide_to_long, "CHUNK_SIZE", 10)
+    wide_to_long.wide_to_long(wide_file, tmp_path / "small.parquet", keep_all=keep_all)
+
+    assert parquet.read_table(tmp_path / "jobs.parquet").equals(expected)
+    assert parquet.read_table(tmp_path / "small.parquet").equals(expected)
+
+    if keep_all:
+        assert expected.num_rows == 2 * len(ROWS)
+        assert expected.column("CONTROL_CASE_EXCL").to_pylist() == [1, 0, 0, 1, 2, 1, 1, 1]
+        assert expected.column("YEAR").to_pylist() == [2000.5, None, None, 2010.25, None, 2001.0, 1970.0, 1971.0]
+    else:
+        assert expected.column("FINNGENID").to_pylist() == ["FG1", "FG2", "FG3", "FG4", "FG4"]
+        assert expected.column("ENDPOINT").to_pylist() == ["A", "B", "B", "A", "B"]
+        assert expected.column("AGE").to_pylist() == [50.5, 60.25, 40.0, 10.0, 11.0]
+        assert expected.column("NEVT").to_pylist() == [2, 1, 3, 1, 1]
+
+
+def test_wide_to_long_partitioned(wide_file, tmp_path):
+    """The partitioned dataset, written in small row groups by workers, has the rows of the single file"""
+    wide_to_long.wide_to_long(wide_file, tmp_path / "serial.parquet", keep_all=True)
+    expected = pd.read_parquet(tmp_path / "serial.parquet")
+
+    wide_to_long.wide_to_long(
+        wide_file,
+        tmp_path / "dataset",
+        partition_by=wide_to_long.PARTITION_ENDPOINT,
+        keep_all=True,
+        jobs=2,
+        row_group_size=3
+    )
+    df = pd.read_parquet(tmp_path / "dataset")
+    df["ENDPOINT"] = df.ENDPOINT.astype(str)
+    df = df[expected.columns].sort_values(["FINNGENID", "ENDPOINT"], ignore_index=True)
+
+    pd.testing.assert_frame_equal(df, expected)
+    assert sorted(path.name for path in (tmp_path / "dataset").iterdir()) == ["ENDPOINT=A", "ENDPOINT=B"]
+
+
+def test_wide_to_long_partitioned_many_endpoints(tmp_path, monkeypatch):
+    """With more endpoints than MAX_OPEN_FILES, each partition is still a single file"""
+    endpoints = [f"E{ii}" for ii in range(8)]
+    header = ["FINNGENID"] + [endp + suffix for endp in endpoints for suffix in ["", "_NEVT", "_FU_AGE", "_APPROX_EVENT_DAY"]]
+    rows = [
+        [f"FG{person}"] + [
+            value
+            for endp_idx in range(len(endpoints))
+            for value in ["1" if (person + endp_idx) % 3 else "0", "1", f"{person + endp_idx}.5", "2000-01-01"]
+        ]
+        for person in range(30)
+    ]
+    wide_file = tmp_path / "wide.csv"
+    wide_file.write_text("\n".join(",".join(row) for row in [header] + rows) + "\n")
+
+    wide_to_long.wide_to_long(wide_file, tmp_path / "serial.parquet")
+    expected = pd.read_parquet(tmp_path / "serial.parquet")
+
+    monkeypatch.setattr(wide_to_long, "MAX_OPEN_FILES", 3)
+    monkeypatch.setattr(wide_to_long, "CHUNK_SIZE", 200)
+    wide_to_long.wide_to_long(wide_file, tmp_path / "dataset", partition_by=wide_to_long.PARTITION_ENDPOINT, row_group_size=25)
+
+    partitions = sorted((tmp_path / "dataset").iterdir())
+    assert [path.name for path in partitions] == [f"ENDPOINT={endp}" for endp in sorted(endpoints)]
+    for path in partitions:
+        assert len(list(path.iterdir())) == 1
+
+    df = pd.read_parquet(tmp_path / "dataset")
+    df["ENDPOINT"] = df.ENDPOINT.astype(str)
+    # The rows of each endpoint are in the input order
+    df = df[expected.columns].sort_values("ENDPOINT", kind="stable", ignore_index=True)
+    pd.testing.assert_frame_equal(df, expected.sort_values("ENDPOINT", kind="stable", ignore_index=True))
+    assert not list(tmp_path.glob(".dataset-*"))